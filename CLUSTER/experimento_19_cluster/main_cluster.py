@@ -14,21 +14,42 @@ Cada variable devuelve código + explicación + evidencias (columnas
 'modelo_<var>', '_explicacion', '_evidencias'). Se reparte el dataset en shards
 y se paraleliza con --workers.
 
+Columnas de la salida: el corpus se lee proyectado a id, texto, año y las 5 GT
+(corpus.COLUMNAS_BASE) y cada fila copia sólo esas columnas de entrada. Para
+conservar otras, `--columnas url,medio`; para el esquema completo del CSV (todas
+sus columnas, como antes del lector por columnas), `--columnas todas` (COLUMNAS=todas).
+
 Ejemplo (API OpenAI, sin servidor Ollama):
     OPENAI_API_KEY=sk-... \
     python main_cluster.py --model gpt-4o-mini --shard 0 --n-shards 1 --workers 8 \
       --experimentos-dir /ruta/Experimentos --data /ruta/...scrape.csv
 
+Ejemplo (batch API, corrida offline del corpus completo a mitad de coste):
+    OPENAI_API_KEY=sk-... \
+    python main_cluster.py --model gpt-4o-mini --batch ./lotes --shard 0 --n-shards 1 \
+      --experimentos-dir /ruta/Experimentos --data /ruta/...scrape.csv
+
 Ejemplo (Ollama local en la granja):
     OLLAMA_HOST=bastet07:11434 \
     python main_cluster.py --model gemma4:e4b --shard 0 --n-shards 2 --workers 4 \
       --experimentos-dir /ruta/Experimentos --data /ruta/...scrape.csv
+
+Ejemplo (cola compartida: cada shard toma artículos hasta vaciarla):
+    python main_cluster.py --model gemma4:e4b --cola /compartido/cola_exp19.sqlite \
+      --shard 0 --n-shards 2 --workers 4 --experimentos-dir /ruta/Experimentos --data /ruta/...scrape.csv
+    python merge_shards.py ./results /compartido/cola_exp19.sqlite   # FULL desde la cola
+
+Ejemplo (un solo shard balanceado entre varios servidores Ollama):
+    python main_cluster.py --model gemma4:e4b --ollama-hosts bastet07:11434,bastet08:11434 \
+      --workers 8 --experimentos-dir /ruta/Experimentos --data /ruta/...scrape.csv
 """
 
 import argparse
+import atexit
 import os
 import sys
 import time
+import asyncio
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -44,19 +65,48 @@ def parse_args():
     p.add_argument("--experimentos-dir", default=os.environ.get("EXPERIMENTOS_DIR"),
                    help="Ruta a la carpeta 'Experimentos' (con variables.py, utils.py, variables.json, prompts/). Env: EXPERIMENTOS_DIR")
     p.add_argument("--data", default=os.environ.get("DATA_CSV"),
-                   help="Ruta al CSV de datos (ya scrapeado). Env: DATA_CSV")
+                   help="Ruta al CSV de datos (ya scrapeado) o a su Parquet (corpus.py); si hay "
+                        "un .parquet más reciente junto al CSV se usa ese. Env: DATA_CSV")
+    p.add_argument("--columnas", default=os.environ.get("COLUMNAS", ""),
+                   help="Columnas extra del corpus que se copian a la salida (separadas por "
+                        "comas). Por defecto sólo id, texto, año y las 5 GT; 'todas' lee y "
+                        "copia todas las del CSV (esquema de salida completo). Env: COLUMNAS")
     p.add_argument("--output-dir", default=os.environ.get("OUTPUT_DIR", "./results"),
                    help="Carpeta de salida de resultados. Env: OUTPUT_DIR")
     p.add_argument("--model", default=os.environ.get("MODELO", "gpt-4o-mini"),
                    help="Modelo a usar (OpenAI/Claude/Gemini/Ollama). Env: MODELO")
     p.add_argument("--ollama-host", default=os.environ.get("OLLAMA_HOST"),
                    help="host:puerto del servidor Ollama (solo para modelos locales). Env: OLLAMA_HOST")
+    p.add_argument("--ollama-hosts", default=os.environ.get("OLLAMA_HOSTS"),
+                   help="Varios servidores Ollama separados por comas (host:puerto, o host a secas "
+                        "para usar los puertos de --llm-json): cada petición va al menos cargado, "
+                        "con failover. --workers pasa a ser el total del shard (~4 por servidor). "
+                        "Env: OLLAMA_HOSTS")
+    p.add_argument("--llm-json", default=os.environ.get("LLM_JSON"),
+                   help="llm.json de launch_process.py: puertos que se usan para los hosts sin "
+                        "puerto de --ollama-hosts. Env: LLM_JSON")
+    p.add_argument("--keep-alive", default=os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
+                   help="keep_alive de Ollama: el modelo queda cargado entre llamadas ('-1' = "
+                        "indefinido). Env: OLLAMA_KEEP_ALIVE")
+    p.add_argument("--num-predict", type=int, default=int(os.environ.get("NUM_PREDICT", 0)) or None,
+                   help="Tope de tokens de salida en Ollama (num_predict). Por defecto 512 por "
+                        "variable de lenguaje y 1024 en el resto. Env: NUM_PREDICT")
     p.add_argument("--shard", type=int, default=int(os.environ.get("SHARD", 0)),
                    help="Índice de este shard (0-based). Env: SHARD")
     p.add_argument("--n-shards", type=int, default=int(os.environ.get("N_SHARDS", 1)),
                    help="Número total de shards. Env: N_SHARDS")
+    p.add_argument("--cola", default=os.environ.get("COLA_DB"), metavar="SQLITE",
+                   help="Cola de trabajo compartida (SQLite en el FS compartido): en lugar del "
+                        "reparto estático i %% n_shards, cada shard toma artículos en préstamo "
+                        "hasta vaciarla; los préstamos de un shard caído vuelven a la cola. "
+                        "Todos los shards deben usar el mismo fichero. Env: COLA_DB")
+    p.add_argument("--cola-sin-wal", action="store_true",
+                   default=os.environ.get("COLA_SIN_WAL", "").lower() in ("1", "true", "yes"),
+                   help="Diario clásico en lugar de WAL para --cola (NFS entre nodos distintos, "
+                        "sin memoria compartida). Env: COLA_SIN_WAL=1")
     p.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", 8)),
-                   help="Peticiones concurrentes DENTRO de este shard. Env: WORKERS "
+                   help="Llamadas al modelo en vuelo DENTRO de este shard (tope global: los "
+                        "artículos se admiten en orden y sus variables van en paralelo). Env: WORKERS "
                         "(8 va bien para APIs; baja a ~4 para Ollama local)")
     p.add_argument("--limit", type=int, default=int(os.environ.get("LIMIT", 0)) or None,
                    help="Procesa como mucho N artículos de este shard (prueba rápida). Env: LIMIT")
@@ -74,6 +124,58 @@ def parse_args():
                    help="Lista separada por comas de variables a procesar. Vacío = las 5. "
                         "Opciones: lenguaje_sexista,masc_generico,sexismo_discurso,"
                         "asimetria_mujer_hombre,denominacion_sexualizada. Env: VARS")
+    p.add_argument("--cache-respuestas", default=os.environ.get("CACHE_RESPUESTAS"),
+                   help="Fichero SQLite de caché de respuestas (opt-in): prompts idénticos no "
+                        "vuelven a llamar al modelo. Env: CACHE_RESPUESTAS")
+    p.add_argument("--cache-max-mb", type=float, default=float(os.environ.get("CACHE_MAX_MB", 0)) or None,
+                   help="Tamaño máximo de la caché de respuestas (MB, evicción LRU). Env: CACHE_MAX_MB")
+    p.add_argument("--asyncio", action="store_true",
+                   default=os.environ.get("ASYNCIO", "").lower() in ("1", "true", "yes"),
+                   help="Usa el router asíncrono (utils.aconsultar) en un único hilo en lugar del "
+                        "ThreadPoolExecutor. Env: ASYNCIO=1")
+    p.add_argument("--concurrencia", type=int, default=int(os.environ.get("CONCURRENCIA", 256)),
+                   help="Con --asyncio: artículos en vuelo a la vez (las peticiones al proveedor "
+                        "se acotan además por proveedor). Env: CONCURRENCIA")
+    p.add_argument("--multivariable", action="store_true",
+                   default=os.environ.get("MULTIVARIABLE", "").lower() in ("1", "true", "yes"),
+                   help="Una sola llamada por artículo para todas las variables de --vars "
+                        "(prompt multivariable; mismas columnas de salida). Env: MULTIVARIABLE=1")
+    p.add_argument("--sin-salida-estructurada", action="store_true",
+                   default=os.environ.get("SIN_SALIDA_ESTRUCTURADA", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: no pedir salida JSON restringida por esquema al proveedor "
+                        "(sólo instrucciones del prompt + json_repair). Env: SIN_SALIDA_ESTRUCTURADA=1")
+    p.add_argument("--sin-esquema", action="store_true",
+                   default=os.environ.get("SIN_ESQUEMA", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: los clasificadores de variables no pasan su esquema JSON "
+                        "(BloqueAnalisis*) a consultar_ollama. Env: SIN_ESQUEMA=1")
+    p.add_argument("--sin-prefijo-estable", action="store_true",
+                   default=os.environ.get("SIN_PREFIJO_ESTABLE", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: usar el template tal cual, sin mover el artículo a un prefijo "
+                        "cacheable común a todas las variables. Env: SIN_PREFIJO_ESTABLE=1")
+    p.add_argument("--deduplicar", action="store_true",
+                   default=os.environ.get("DEDUPLICAR", "").lower() in ("1", "true", "yes"),
+                   help="Clasificar sólo un artículo por grupo de texto idéntico y replicar su "
+                        "resultado a las copias (por defecto se clasifican todos). Env: DEDUPLICAR=1")
+    p.add_argument("--variables-en-serie", action="store_true",
+                   default=os.environ.get("VARIABLES_EN_SERIE", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: clasificar las variables de cada artículo una tras otra "
+                        "(--workers artículos a la vez) en lugar de en paralelo. Env: VARIABLES_EN_SERIE=1")
+    p.add_argument("--sin-cortacircuitos", action="store_true",
+                   default=os.environ.get("SIN_CORTACIRCUITOS", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: sin corta-circuitos en el router (cada llamada fallida acaba "
+                        "en una fila codigo=1 en lugar de pausar los workers). Env: SIN_CORTACIRCUITOS=1")
+    p.add_argument("--max-pausa", type=float, default=float(os.environ.get("MAX_PAUSA", 1800)),
+                   help="Segundos que un circuito (proveedor o modelo) puede seguir abierto con "
+                        "los workers en pausa antes de abortar el shard. Env: MAX_PAUSA")
+    p.add_argument("--rpm", type=float, default=float(os.environ.get("RPM", 0)) or None,
+                   help="Cuota de peticiones/minuto del modelo (si el proveedor no la envía en "
+                        "cabeceras, p. ej. Gemini). Env: RPM")
+    p.add_argument("--tpm", type=float, default=float(os.environ.get("TPM", 0)) or None,
+                   help="Cuota de tokens/minuto del modelo. Env: TPM")
+    p.add_argument("--batch", default=os.environ.get("BATCH_DIR"), metavar="DIR",
+                   help="Modo lote (OpenAI/Anthropic): todas las llamadas del shard por la batch "
+                        "API (mitad de coste, sin latencia interactiva). DIR guarda el estado "
+                        "de los lotes para reanudar. Env: BATCH_DIR")
     return p.parse_args()
 
 
@@ -95,19 +197,59 @@ sys.path.append(EXPERIMENTOS_DIR)
 RUTA_VARIABLES_JSON = os.path.abspath(args.variables_json) if args.variables_json \
     else os.path.join(EXPERIMENTOS_DIR, "variables.json")
 RUTA_TEMPLATE = os.path.join(EXPERIMENTOS_DIR, "prompts", "prompt_clara.md")
+RUTA_TEMPLATE_MULTI = os.path.join(EXPERIMENTOS_DIR, "prompts", "prompt_clara_multivariable.md")
+if args.multivariable and (args.asyncio or args.batch):
+    sys.exit("ERROR: --multivariable no se combina con --asyncio ni --batch.")
+if args.cola and (args.asyncio or args.batch):
+    sys.exit("ERROR: --cola no se combina con --asyncio ni --batch.")
 
 import variables  # noqa: E402  (import tras ajustar sys.path)
 import utils       # noqa: E402  (se importa para que variables lo tenga disponible)
 import ollama      # noqa: E402  (para instrumentar el tiempo real de inferencia local)
+import lotes       # noqa: E402  (modo --batch)
+import balanceador_ollama  # noqa: E402  (--ollama-hosts)
+import cola_trabajo  # noqa: E402  (--cola)
+import corpus  # noqa: E402  (carga del corpus con proyección y filtros)
+import cortacircuitos  # noqa: E402  (pausa/aborto ante errores del proveedor)
+import deduplicacion  # noqa: E402  (un artículo por grupo de texto idéntico)
+import planificador  # noqa: E402  (variables en paralelo)
+from escritor_resultados import EscritorResultados  # noqa: E402
+
+# Un cliente por proveedor compartido por los workers; pool keep-alive = --workers.
+utils.configurar_pool(args.workers)
+utils.configurar_ollama(keep_alive=args.keep_alive, num_predict=args.num_predict)
+OLLAMA_HOSTS = balanceador_ollama.parsear_hosts(args.ollama_hosts, args.llm_json) \
+    if args.ollama_hosts else []
+utils.configurar_hosts_ollama(OLLAMA_HOSTS)
+utils.USAR_CORTACIRCUITOS = not args.sin_cortacircuitos
+utils.configurar_cortacircuitos(max_pausa=args.max_pausa)
+if args.num_predict:
+    variables.MAX_TOKENS_VARIABLE = args.num_predict
+if args.sin_salida_estructurada:
+    utils.USAR_SALIDA_ESTRUCTURADA = False
+if args.sin_esquema:
+    variables.USAR_ESQUEMA = False
+if args.sin_prefijo_estable:
+    utils.USAR_PREFIJO_ESTABLE = False
+if args.asyncio:
+    # APIs: hasta --concurrencia peticiones en vuelo; Ollama local sigue acotado a --workers.
+    utils.configurar_concurrencia_async(args.concurrencia)
+    utils.configurar_concurrencia_async(args.workers, "ollama")
+if args.cache_respuestas:
+    utils.activar_cache_respuestas(args.cache_respuestas, max_mb=args.cache_max_mb)
+if args.rpm or args.tpm:
+    utils.configurar_limites(rpm=args.rpm, tpm=args.tpm, modelo=args.model)
 
 # --- Instrumentación: tiempo REAL de inferencia por artículo (solo Ollama) ---
 # Ollama devuelve 'total_duration' (ns) por petición. Para modelos de API esta
 # métrica no aplica (queda en 0) y el tiempo de pared/latencia se mide igual.
 _tls = threading.local()
 _orig_ollama_chat = ollama.chat
+_orig_client_chat = ollama.Client.chat
 
-def _timed_chat(*a, **kw):
-    resp = _orig_ollama_chat(*a, **kw)
+def _anotar_duracion(resp):
+    if hasattr(resp, "__next__"):  # stream (corte temprano de utils): se mide al cerrarlo
+        return _stream_cronometrado(resp)
     try:
         dur = resp.get("total_duration") if isinstance(resp, dict) else getattr(resp, "total_duration", None)
     except Exception:
@@ -116,10 +258,31 @@ def _timed_chat(*a, **kw):
         _tls.model_ns = getattr(_tls, "model_ns", 0) + dur
     return resp
 
+def _stream_cronometrado(flujo):
+    t0 = time.perf_counter_ns()
+    dur = None
+    try:
+        for trozo in flujo:
+            dur = trozo.get("total_duration") or dur
+            yield trozo
+    finally:
+        flujo.close()
+        # Cortado antes del trozo final no hay total_duration: se usa el tiempo de pared.
+        _tls.model_ns = getattr(_tls, "model_ns", 0) + (dur or time.perf_counter_ns() - t0)
+
+def _timed_chat(*a, **kw):
+    return _anotar_duracion(_orig_ollama_chat(*a, **kw))
+
+def _timed_client_chat(self, *a, **kw):
+    return _anotar_duracion(_orig_client_chat(self, *a, **kw))
+
 ollama.chat = _timed_chat  # utils.consultar_ollama llama a ollama.chat -> queda instrumentado
+ollama.Client.chat = _timed_client_chat  # clientes por host del balanceador (--ollama-hosts)
 
 MODELO = args.model
 COLUMNA_ID = "IdNoticia"
+if args.batch and not lotes.proveedor_soporta_lote(MODELO):
+    sys.exit(f"ERROR: --batch sólo admite modelos de OpenAI o Anthropic (no {MODELO}).")
 
 # Selección de variables a procesar (--vars). Vacío = las 5, en su orden canónico.
 _ORDEN_VARS = ["lenguaje_sexista", "masc_generico", "sexismo_discurso",
@@ -133,10 +296,20 @@ if args.vars.strip():
 else:
     VARS_A_PROCESAR = list(_ORDEN_VARS)
 
+# Variables de cada artículo en paralelo bajo un tope global (--workers; con --asyncio,
+# --concurrencia). Con --multivariable ya es una sola llamada por artículo.
+plan = None
+if not (args.variables_en_serie or args.multivariable or args.batch):
+    plan = planificador.Planificador(args.concurrencia if args.asyncio else args.workers)
+N_ARTICULOS = plan.articulos_en_vuelo(len(VARS_A_PROCESAR)) if plan else args.workers
+
 print(f"🤖 Modelo      : {MODELO}")
 print(f"🎯 Variables   : {', '.join(VARS_A_PROCESAR)}")
 print(f"🖥️  OLLAMA_HOST : {os.environ.get('OLLAMA_HOST', '(N/A para API; localhost:11434 para local)')}")
-print(f"🔀 Shard       : {args.shard} / {args.n_shards}   (workers={args.workers})")
+if len(OLLAMA_HOSTS) > 1:
+    print(f"⚖️  Balanceo    : {len(OLLAMA_HOSTS)} servidores Ollama ({', '.join(OLLAMA_HOSTS)})")
+print(f"🔀 Shard       : {args.shard} / {args.n_shards}   "
+      + (f"(asyncio, concurrencia={args.concurrencia})" if args.asyncio else f"(workers={args.workers})"))
 print(f"📂 Experimentos: {EXPERIMENTOS_DIR}")
 print(f"📑 variables   : {RUTA_VARIABLES_JSON}")
 print(f"📄 Datos       : {args.data}")
@@ -156,64 +329,73 @@ nombre_output = os.path.join(
 # ==========================================
 # 2. CARGA DE DATOS + SELECCIÓN DE SHARD + REANUDACIÓN
 # ==========================================
-print("Cargando datos originales...")
+# Filtro de año opcional (0 = todos los años -> toda la base, >7k artículos) y
+# --only-labeled (etiqueta real en alguna de las 5 variables, para medir métricas sin
+# gastar en artículos no anotados): los aplica el lector, que sólo lee las columnas
+# necesarias. Muestreo determinista opcional (0 = sin muestreo) tras filtrar.
+if args.columnas.strip().lower() == "todas":
+    _columnas = None
+else:
+    _columnas = corpus.COLUMNAS_BASE + [c.strip() for c in args.columnas.split(",") if c.strip()]
 try:
-    data = pd.read_csv(args.data)
+    ruta_datos = corpus.resolver_ruta(args.data)
 except FileNotFoundError:
     sys.exit(f"No se encuentra el archivo de datos: {args.data}")
-
-# Filtro de año opcional (0 = todos los años -> toda la base, >7k artículos).
-if args.year:
-    df_base = data[data["año"] == args.year].copy()
-    print(f"-> Filtrando año {args.year}: {len(df_base)} artículos.")
-else:
-    df_base = data.copy()
-    print(f"-> Sin filtro de año: {len(df_base)} artículos (toda la base).")
-
-# Solo artículos con etiqueta real (ground truth) en las 5 variables de sexismo.
-# Útil para medir métricas sin gastar en artículos no anotados.
-_VARS_GT = ["lenguaje_sexista", "masc_generico", "sexismo_discurso",
-            "asimetria_mujer_hombre", "denominacion_sexualizada"]
-if args.only_labeled:
-    presentes = [c for c in _VARS_GT if c in df_base.columns]
-    antes = len(df_base)
-    df_base = df_base[df_base[presentes].notna().any(axis=1)].copy()
-    print(f"-> --only-labeled: {len(df_base)} artículos etiquetados (de {antes}).")
-
-# Muestreo determinista opcional (0 = sin muestreo -> se procesa toda la base).
-if args.n_samples and args.n_samples < len(df_base):
-    df_procesar = df_base.sample(n=args.n_samples, random_state=42).reset_index(drop=True)
-    print(f"-> Muestreo determinista (random_state=42): {len(df_procesar)} artículos.")
-else:
-    df_procesar = df_base.reset_index(drop=True)
+print(f"Cargando datos originales ({ruta_datos})...")
+df_procesar = corpus.cargar_corpus(
+    ruta_datos, columnas=_columnas, anio=args.year or None,
+    etiquetados="alguna" if args.only_labeled else None, n_muestras=args.n_samples or None)
+print(f"-> {len(df_procesar)} artículos"
+      + (f" del año {args.year}" if args.year else " (todos los años)")
+      + (" etiquetados" if args.only_labeled else "")
+      + (f" · muestreo determinista (random_state=42) de {args.n_samples}" if args.n_samples else "")
+      + ".")
+
+# --deduplicar: de cada grupo de duplicados exactos (piezas de agencia) sólo el representante se
+# reparte y se clasifica; al guardarlo se escriben también las filas de sus copias.
+dedup = None
+if args.deduplicar:
+    dedup = deduplicacion.Deduplicador(df_procesar, col_id=COLUMNA_ID)
+    dedup.imprimir_resumen(1 if args.multivariable else len(VARS_A_PROCESAR))
+    df_procesar = dedup.representantes()
 
 # Reparto en shards de forma determinista: cada fila va al shard (i % n_shards).
+# Con --cola no hay reparto: todos los shards encolan los mismos ids y se los
+# van prestando hasta vaciar la cola.
 total_dataset = len(df_procesar)
-df_procesar = df_procesar[df_procesar.index % args.n_shards == args.shard].copy()
-print(f"-> A este shard le tocan {len(df_procesar)} artículos de {total_dataset}.")
-
-# Reanudación: saltar IDs ya guardados en el CSV de ESTE shard.
-ids_procesados = set()
-es_primera_vez = True
-if os.path.exists(nombre_output):
-    try:
-        df_salida = pd.read_csv(nombre_output)
-        if COLUMNA_ID in df_salida.columns:
-            ids_procesados = set(df_salida[COLUMNA_ID].dropna().astype(str).unique())
-            es_primera_vez = False
-            print(f"-> Archivo previo detectado: {len(ids_procesados)} ya procesados.")
-    except pd.errors.EmptyDataError:
-        print("-> El archivo de salida existe pero está vacío. Empezando de cero.")
+cola = None
+if args.cola:
+    cola = cola_trabajo.ColaTrabajo(args.cola, wal=not args.cola_sin_wal)
+    nuevos = cola.poblar(df_procesar[COLUMNA_ID].astype(str))
+    print(f"-> Cola {args.cola}: {nuevos} artículos nuevos encolados · estado {cola.resumen()}")
+else:
+    df_procesar = df_procesar[df_procesar.index % args.n_shards == args.shard].copy()
+    print(f"-> A este shard le tocan {len(df_procesar)} artículos de {total_dataset}.")
+
+# Reanudación: saltar IDs ya guardados por ESTE shard (diario del escritor; un CSV
+# previo sin diario se importa al abrirlo).
+escritor = EscritorResultados(nombre_output, columna_id=COLUMNA_ID)
+# Cualquier salida (sys.exit, excepción, Ctrl-C) vacía el búfer y exporta el CSV;
+# cerrar() es idempotente, así que los cierres explícitos siguen valiendo.
+atexit.register(escritor.cerrar)
+ids_procesados = escritor.ids()
+if ids_procesados:
+    print(f"-> Archivo previo detectado: {len(ids_procesados)} ya procesados.")
 
 total_antes = len(df_procesar)
-df_procesar = df_procesar[~df_procesar[COLUMNA_ID].astype(str).isin(ids_procesados)]
+if dedup is not None:
+    df_procesar = df_procesar[[dedup.pendiente(i, ids_procesados)
+                               for i in df_procesar[COLUMNA_ID].astype(str)]]
+else:
+    df_procesar = df_procesar[~df_procesar[COLUMNA_ID].astype(str).isin(ids_procesados)]
 print(f"Quedan {len(df_procesar)} por procesar (se omitieron {total_antes - len(df_procesar)}).")
 
-if args.limit:
+if args.limit and cola is None:
     df_procesar = df_procesar.head(args.limit)
     print(f"-> LIMIT activo: solo se procesarán {len(df_procesar)} (prueba rápida).")
 
-if df_procesar.empty:
+if (df_procesar.empty if cola is None else not any(
+        cola.resumen()[e] for e in ("pendiente", "en_curso"))):
     print("Nada que procesar en este shard. Saliendo.")
     sys.exit(0)
 
@@ -243,24 +425,116 @@ _CLASIFICADORES = {
 }
 
 
-def procesar_fila(row):
-    resultados = {}
+# Códigos de variables.json para la ruta asíncrona (variables.aclasificar_var_lenguaje).
+_CODIGOS = {
+    "lenguaje_sexista": "25",
+    "masc_generico": "26",
+    "sexismo_discurso": "30",
+    "asimetria_mujer_hombre": "33",
+    "denominacion_sexualizada": "35",
+}
+
 
+def procesar_fila(row):
     texto = str(row["contenido_articulo"]) if pd.notna(row["contenido_articulo"]) else ""
+    if args.multivariable:
+        return _columnas_fila(_procesar_multivariable(texto))
+    if plan is None:
+        por_variable = [_clasificar_variable(nombre, texto) for nombre in VARS_A_PROCESAR]
+    else:
+        por_variable = plan.repartir(lambda nombre: _clasificar_variable(nombre, texto),
+                                     VARS_A_PROCESAR)
+        _tls.model_ns = getattr(_tls, "model_ns", 0) + sum(ns for *_, ns in por_variable)
+    return _columnas_fila([(nombre, res, cons) for nombre, res, cons, _ in por_variable])
+
+
+def _clasificar_variable(nombre: str, texto: str) -> tuple:
+    """(nombre, resultado, consumo, ns de Ollama); corre en el hilo del pool del planificador."""
+    ns_antes = getattr(_tls, "model_ns", 0)
+    res = _CLASIFICADORES[nombre](
+        texto, ruta_json=RUTA_VARIABLES_JSON, ruta_template=RUTA_TEMPLATE, modelo=MODELO)
+    ns = getattr(_tls, "model_ns", 0) - ns_antes
+    if plan is not None:
+        # El tiempo de Ollama se anota en el hilo del pool: se devuelve al del artículo.
+        _tls.model_ns = ns_antes
+    # Consumo de la última llamada API (utils.consultar_ollama → por hilo).
+    return nombre, res, utils.get_consumo_llamada(), ns
+
+
+def _procesar_multivariable(texto: str) -> list:
+    """Todas las variables en una llamada; el consumo se reparte a partes iguales."""
+    codigos = [_CODIGOS[n] for n in VARS_A_PROCESAR]
+    res = variables.clasificar_multivariable(
+        codigos, texto, ruta_json=RUTA_VARIABLES_JSON, ruta_template=RUTA_TEMPLATE_MULTI,
+        modelo=MODELO)
+    cons = utils.get_consumo_llamada()
+    n = len(codigos)
+    por_variable = []
+    for i, nombre in enumerate(VARS_A_PROCESAR):
+        # El resto de la división va a la primera variable: los totales cuadran.
+        parte = {k: cons[k] // n + (cons[k] % n if i == 0 else 0)
+                 for k in ("prompt_tokens", "completion_tokens",
+                           "cache_read_tokens", "cache_creation_tokens")}
+        por_variable.append((nombre, res[_CODIGOS[nombre]], parte))
+    return por_variable
+
+
+async def aprocesar_fila(row):
+    """procesar_fila con utils.aconsultar; con el planificador la primera variable
+    calienta la caché de prompts del artículo y el resto va en paralelo."""
+    texto = str(row["contenido_articulo"]) if pd.notna(row["contenido_articulo"]) else ""
+
+    async def _una(nombre):
+        res = await variables.aclasificar_var_lenguaje(
+            _CODIGOS[nombre], texto, ruta_json=RUTA_VARIABLES_JSON,
+            ruta_template=RUTA_TEMPLATE, modelo=MODELO)
+        # Cada tarea de gather tiene su copia del contexto: el consumo es el de su llamada.
+        return nombre, res, utils.get_consumo_llamada()
+
+    if plan is None:
+        por_variable = [await _una(nombre) for nombre in VARS_A_PROCESAR]
+    else:
+        por_variable = await plan.arepartir(_una, VARS_A_PROCESAR)
+    return _columnas_fila(por_variable)
+
+
+def _procesar_lote(filas) -> None:
+    """Modo --batch: todos los prompts del shard en lotes; vuelca las filas al terminar."""
+    vars_data = utils.cargar_variables_desde_json(RUTA_VARIABLES_JSON)
+    esquema_de = {nombre: utils.esquema_variable(utils.obtener_config_variable(vars_data, _CODIGOS[nombre]))
+                  for nombre in VARS_A_PROCESAR}
+    peticiones, esquemas = {}, {}
+    for i, row in enumerate(filas):
+        texto = str(row["contenido_articulo"]) if pd.notna(row["contenido_articulo"]) else ""
+        for nombre in VARS_A_PROCESAR:
+            peticiones[f"{i}::{nombre}"] = variables.construir_prompt_variable(
+                _CODIGOS[nombre], texto, ruta_json=RUTA_VARIABLES_JSON, ruta_template=RUTA_TEMPLATE)
+            esquemas[f"{i}::{nombre}"] = esquema_de[nombre]
+    respuestas = lotes.ejecutar_lote(peticiones, MODELO, temperature=0.1, dir_trabajo=args.batch,
+                                     esquemas=esquemas)
+    for i, row in enumerate(tqdm(filas, total=len(filas))):
+        por_variable = []
+        for nombre in VARS_A_PROCESAR:
+            salida, cons = respuestas[f"{i}::{nombre}"]
+            por_variable.append((nombre, variables.interpretar_respuesta_variable(salida), cons))
+        fila_completa = row.to_dict()
+        fila_completa.update(_columnas_fila(por_variable))
+        # Sin latencia por artículo en modo lote: el tiempo es el del lote completo.
+        fila_completa["modelo_tiempo_procesamiento_seg"] = 0.0
+        fila_completa["modelo_tiempo_modelo_real_seg"] = 0.0
+        _guardar(fila_completa)
+
+
+def _columnas_fila(por_variable) -> dict:
+    resultados = {}
     cache_read_total = 0
     cache_creation_total = 0
     prompt_tokens_total = 0
     completion_tokens_total = 0
 
-    for nombre in VARS_A_PROCESAR:
-        clasificador = _CLASIFICADORES[nombre]
-        res = clasificador(
-            texto, ruta_json=RUTA_VARIABLES_JSON, ruta_template=RUTA_TEMPLATE, modelo=MODELO)
+    for nombre, res, cons in por_variable:
         prefijo = f"modelo_{nombre}"
         resultados.update(_expandir_resultado(res, prefijo))
-
-        # Consumo de la última llamada API (utils.consultar_ollama → thread-local).
-        cons = utils.get_consumo_llamada()
         resultados[f"{prefijo}_prompt_tokens"] = cons["prompt_tokens"]
         resultados[f"{prefijo}_completion_tokens"] = cons["completion_tokens"]
         resultados[f"{prefijo}_cache_read_tokens"] = cons["cache_read_tokens"]
@@ -278,25 +552,21 @@ def procesar_fila(row):
 
 
 # ==========================================
-# 4. BUCLE PRINCIPAL (concurrencia opcional + guardado incremental con lock)
+# 4. BUCLE PRINCIPAL (concurrencia opcional + guardado incremental en segundo plano)
 # ==========================================
-print(f"Los datos se guardarán en tiempo real en: {nombre_output}")
-
-_write_lock = threading.Lock()
-_state = {"primera": es_primera_vez}
+print(f"Los datos se guardarán en tiempo real en: {escritor.ruta_diario} "
+      f"(CSV al terminar: {nombre_output})")
 
 
 def _guardar(fila_completa):
-    df_temp = pd.DataFrame([fila_completa])
-    with _write_lock:
-        if _state["primera"]:
-            df_temp.to_csv(nombre_output, index=False, mode="w", encoding="utf-8")
-            _state["primera"] = False
-        else:
-            df_temp.to_csv(nombre_output, index=False, mode="a", header=False, encoding="utf-8")
+    if cortacircuitos.abortado():
+        return  # fila calculada con el circuito agotado: se relanzará al reanudar
+    for fila in (dedup.expandir(fila_completa) if dedup is not None else [fila_completa]):
+        if str(fila[COLUMNA_ID]) not in ids_procesados:  # ya está en el CSV de este shard
+            escritor.escribir(fila)
 
 
-def _trabajo(row):
+def _fila_procesada(row) -> dict:
     start = time.time()
     _tls.model_ns = 0
     res_fila = procesar_fila(row)
@@ -306,32 +576,126 @@ def _trabajo(row):
     fila_completa.update(res_fila)
     fila_completa["modelo_tiempo_procesamiento_seg"] = duration
     fila_completa["modelo_tiempo_modelo_real_seg"] = model_real
+    return fila_completa
+
+
+def _trabajo(row):
+    _guardar(_fila_procesada(row))
+
+
+_filas_previas = None
+_lock_previas = threading.Lock()
+
+
+def _fila_previa(id_art: str) -> dict:
+    """--cola: fila que este shard ya escribió en una corrida anterior (sin volver al modelo)."""
+    global _filas_previas
+    with _lock_previas:
+        if _filas_previas is None:
+            _filas_previas = {str(f[COLUMNA_ID]): f for f in escritor.filas()}
+    return _filas_previas[id_art]
+
+
+def _bucle_cola(filas) -> int:
+    """--cola: préstamos hasta vaciar la cola; sólo se guardan las filas confirmadas."""
+    por_id = {str(row[COLUMNA_ID]): row for row in filas}
+
+    def _de_cola(id_art: str):
+        # La cola puede prestar un id que este shard ya terminó antes (filtrado de `filas`
+        # por la reanudación): se confirma con la fila ya escrita.
+        if id_art in ids_procesados:
+            return _fila_previa(id_art)
+        return _fila_procesada(por_id[id_art])
+
+    with tqdm(total=len(por_id)) as barra:
+        n = cola_trabajo.procesar_cola(
+            cola, _de_cola, _guardar,
+            workers=N_ARTICULOS, limite=args.limit, al_terminar=lambda: barra.update(1),
+            copias=dedup.copias if dedup is not None else None, parar=cortacircuitos.abortado)
+    print(f"-> Cola: {n} artículos confirmados por este shard · estado {cola.resumen()}")
+    return n
+
+
+async def _atrabajo(row, limite, barra):
+    async with limite:
+        start = time.time()
+        res_fila = await aprocesar_fila(row)
+        duration = time.time() - start
+    fila_completa = row.to_dict()
+    fila_completa.update(res_fila)
+    fila_completa["modelo_tiempo_procesamiento_seg"] = duration
+    # Con asyncio no hay hilo por artículo al que atribuir total_duration de Ollama.
+    fila_completa["modelo_tiempo_modelo_real_seg"] = 0.0
     _guardar(fila_completa)
+    barra.update(1)
+
+
+async def _bucle_async(filas):
+    limite = asyncio.Semaphore(args.concurrencia)
+    with tqdm(total=len(filas)) as barra:
+        await asyncio.gather(*(_atrabajo(row, limite, barra) for row in filas))
 
 
 filas = [row for _, row in df_procesar.iterrows()]
 
 _wall0 = time.time()
-if args.workers <= 1:
-    for row in tqdm(filas, total=len(filas)):
-        _trabajo(row)
-else:
-    with ThreadPoolExecutor(max_workers=args.workers) as ex:
-        futuros = [ex.submit(_trabajo, row) for row in filas]
-        for _ in tqdm(as_completed(futuros), total=len(futuros)):
-            pass
+try:
+    if args.batch:
+        _procesar_lote(filas)
+    elif cola is not None:
+        n_cola = _bucle_cola(filas)
+    elif args.asyncio:
+        asyncio.run(_bucle_async(filas))
+    elif args.workers <= 1:
+        for row in tqdm(filas, total=len(filas)):
+            _trabajo(row)
+    else:
+        with ThreadPoolExecutor(max_workers=N_ARTICULOS) as ex:
+            futuros = [ex.submit(_trabajo, row) for row in filas]
+            try:
+                for f in tqdm(as_completed(futuros), total=len(futuros)):
+                    f.result()
+            except cortacircuitos.CircuitoAbierto:
+                for f in futuros:
+                    f.cancel()
+                raise
+except cortacircuitos.CircuitoAbierto as e:
+    escritor.cerrar()
+    utils.imprimir_estadisticas_cortacircuitos()
+    sys.exit(f"\n❌ ABORTADO (corta-circuitos): {e}\n"
+             f"   Revisa saldo/API key/servidor. Progreso guardado en {escritor.ruta_diario}; "
+             "relanza el mismo comando para reanudar.")
+if cola is not None and cortacircuitos.abortado():
+    escritor.cerrar()
+    utils.imprimir_estadisticas_cortacircuitos()
+    sys.exit("\n❌ ABORTADO (corta-circuitos): la cola se detuvo y los artículos en curso "
+             "se devolvieron a ella. Relanza el mismo comando para reanudar.")
 _wall = time.time() - _wall0
+escritor.cerrar()
+if plan is not None:
+    plan.cerrar()
 
 # --- Resumen de throughput (tiempo de pared real de este shard) ---
-n = len(filas)
+n = n_cola if cola is not None else len(filas)
 print("\n" + "=" * 50)
 print(" RESUMEN DE TIEMPOS (este shard)")
 print("=" * 50)
 print(f"  Modelo               : {MODELO}")
 print(f"  Artículos procesados : {n}")
-print(f"  Workers              : {args.workers}")
+print(f"  Workers              : {args.workers}" + (f" (asyncio, concurrencia={args.concurrencia})" if args.asyncio else ""))
+if plan is not None:
+    print(f"  Variables en paralelo: {plan.estadisticas()}")
 print(f"  Tiempo de pared      : {_wall/60:.1f} min ({_wall:.0f} s)")
 if n:
     print(f"  Throughput real      : {_wall/n:.1f} s/artículo  |  {n/(_wall/3600):.0f} artículos/hora")
 print("  (para Ollama local, tiempo REAL de inferencia -> 'modelo_tiempo_modelo_real_seg')")
+utils.imprimir_estadisticas_pool()
+utils.imprimir_estadisticas_ollama()
+utils.imprimir_estadisticas_balanceador()
+utils.imprimir_estadisticas_limitador()
+utils.imprimir_estadisticas_cortacircuitos()
+utils.imprimir_estadisticas_cache_prompt()
+utils.imprimir_estadisticas_parseo()
+if args.cache_respuestas:
+    print(f"  Caché respuestas: {utils.estadisticas_cache_respuestas()}")
 print(f"\nProceso finalizado. Archivo completado: {nombre_output}")
@@ -1,22 +1,49 @@
-"""Junta los CSV por shard del experimento_19 en un único resultado final."""
-import glob
+"""
+Junta los CSV por shard del experimento_19 en un único resultado final.
+
+    python merge_shards.py ./results                      # CSV por shard
+    python merge_shards.py ./results /compartido/cola.sqlite  # corrida con --cola
+Con --cola la base de datos de la cola es la copia autoritativa (una fila
+confirmada por artículo), así que se lee de ahí en lugar de los CSV.
+"""
+import json
 import os
+import sqlite3
 import sys
 
 import pandas as pd
 
+
+# Lectura de shards (índice .ids + diario .jsonl) con los helpers de Experimentos:
+# EXPERIMENTOS_DIR o, por defecto, la carpeta del repo.
+sys.path.append(os.path.abspath(os.environ.get("EXPERIMENTOS_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "Experimentos")))
+from escritor_resultados import leer_salida  # noqa: E402
+from indice_completados import contar_confirmadas, salidas  # noqa: E402
+
 output_dir = sys.argv[1] if len(sys.argv) > 1 else "./results"
 patron = os.path.join(output_dir, "19-Experimento-19_03_2026_resultados_modelo_2024_scrape_shard*de*.csv")
 
-ficheros = sorted(glob.glob(patron))
-if not ficheros:
-    sys.exit(f"No se encontraron shards en {patron}")
+ruta_cola = sys.argv[2] if len(sys.argv) > 2 else None
+
+if ruta_cola:
+    # Tabla 'trabajos' de Experimentos/cola_trabajo.py.
+    with sqlite3.connect(ruta_cola) as conn:
+        filas = conn.execute(
+            "SELECT resultado FROM trabajos WHERE estado = 'hecho' ORDER BY id").fetchall()
+    print(f"Leyendo {len(filas)} filas confirmadas de la cola {ruta_cola}")
+    df = pd.DataFrame([json.loads(r) for (r,) in filas])
+else:
+    ficheros = salidas(patron)
+    if not ficheros:
+        sys.exit(f"No se encontraron shards en {patron}")
 
-print(f"Uniendo {len(ficheros)} shards:")
-for f in ficheros:
-    print(f"  - {f}")
+    print(f"Uniendo {len(ficheros)} shards:")
+    for f in ficheros:
+        n = contar_confirmadas(f)
+        print(f"  - {f}" + (f"  ({n} filas confirmadas)" if n is not None else ""))
 
-df = pd.concat([pd.read_csv(f) for f in ficheros], ignore_index=True)
+    df = pd.concat([leer_salida(f) for f in ficheros], ignore_index=True)
 if "IdNoticia" in df.columns:
     df = df.drop_duplicates(subset="IdNoticia")
 
@@ -6,6 +6,9 @@ OUT=results_b0
 
 printf '%s   Exp 21 B0 · gemma4:e4b · granja TSC\n\n' "$(date '+%H:%M:%S')"
 
+# El runner mantiene el índice <salida>.ids (una línea "id<TAB>offset<TAB>etiqueta"
+# por fila confirmada): contar filas y errores es un grep, sin leer resultados.
+# El CSV sólo aparece al terminar; se lee únicamente en corridas sin índice.
 filas() {  # cuenta filas reales (las explicaciones llevan saltos de línea)
   [ -s "$1" ] || { echo 0; return; }
   "$PY" -c "import csv,sys
@@ -13,11 +16,20 @@ try:
  print(sum(1 for _ in csv.DictReader(open(sys.argv[1],encoding='utf-8'))))
 except Exception: print(0)" "$1" 2>/dev/null || echo 0
 }
+filas_indice() {
+  [ -s "$1" ] || { echo 0; return; }
+  grep -c '' "$1"
+}
+errores_indice() {
+  [ -s "$1" ] || { echo 0; return; }
+  grep -c $'\terror$' "$1"
+}
 con_error() {  # filas con alguna variable fallida
   [ -s "$1" ] || { echo 0; return; }
   "$PY" -c "import pandas as pd,sys
 try:
- d=pd.read_csv(sys.argv[1]); print(int((d['n_variables_error']>0).sum()) if 'n_variables_error' in d else 0)
+ d=pd.read_csv(sys.argv[1])
+ print(int((d['n_variables_error']>0).sum()) if 'n_variables_error' in d else 0)
 except Exception: print(0)" "$1" 2>/dev/null || echo 0
 }
 
@@ -25,7 +37,9 @@ TOT=0; ERRTOT=0
 for i in 0 1 2; do
   f="$OUT/21b0-Experimento-21_b0_gemma4_e4b_shard${i}de3.csv"
   log="/tmp/exp21_b0_shard${i}.log"
-  n=$(filas "$f"); e=$(con_error "$f")
+  ids="${f%.csv}.ids"
+  if [ -e "$ids" ]; then n=$(filas_indice "$ids"); e=$(errores_indice "$ids")
+  else n=$(filas "$f"); e=$(con_error "$f"); fi
   TOT=$((TOT+n)); ERRTOT=$((ERRTOT+e))
 
   # estado del proceso
@@ -7,6 +7,9 @@
 #   ./lanzar_b0.sh host1:puerto host2:puerto [host3:puerto ...]
 # Ej (4 servidores del llm.json):
 #   ./lanzar_b0.sh bastet07:11434 bastet07:11435 bastet08:11436 bastet08:11437
+# Con BALANCEO=1 se lanza UN solo shard que reparte las peticiones entre todos los
+# servidores (menos cargado primero, con failover si uno cae):
+#   BALANCEO=1 ./lanzar_b0.sh bastet07:11434 bastet07:11435 bastet08:11436 bastet08:11437
 set -u
 cd "$(dirname "$0")" || exit 1
 
@@ -18,19 +21,32 @@ OUT=./results_b0
 
 [ $# -lt 1 ] && { echo "Uso: ./lanzar_b0.sh host1:puerto [host2:puerto ...]"; exit 1; }
 N=$#
-echo "Lanzando B0 en $N shards (--only-labeled, workers=4). Salida: $OUT"
-i=0
-for hp in "$@"; do
-  log="/tmp/exp21_b0_shard${i}.log"
-  OLLAMA_HOST="$hp" nohup "$PY" main_cluster.py \
+if [ "${BALANCEO:-0}" = "1" ]; then
+  hosts=$(IFS=,; echo "$*")
+  log="/tmp/exp21_b0_shard0.log"
+  echo "Lanzando B0 en 1 shard balanceado entre $N servidores (workers=$((4*N))). Salida: $OUT"
+  nohup "$PY" main_cluster.py \
       --model gemma4:e4b --baseline \
-      --shard "$i" --n-shards "$N" --workers 4 --only-labeled \
+      --shard 0 --n-shards 1 --workers $((4*N)) --only-labeled \
+      --ollama-hosts "$hosts" \
       --experimentos-dir "$EXP" --agente-dir "$AGE" --data "$DATA" \
       --output-dir "$OUT" > "$log" 2>&1 &
-  echo "  shard $i/$N → $hp   (log: $log)"
-  i=$((i+1))
-  sleep 2
-done
+  echo "  shard 0/1 → $hosts   (log: $log)"
+else
+  echo "Lanzando B0 en $N shards (--only-labeled, workers=4). Salida: $OUT"
+  i=0
+  for hp in "$@"; do
+    log="/tmp/exp21_b0_shard${i}.log"
+    OLLAMA_HOST="$hp" nohup "$PY" main_cluster.py \
+        --model gemma4:e4b --baseline \
+        --shard "$i" --n-shards "$N" --workers 4 --only-labeled \
+        --experimentos-dir "$EXP" --agente-dir "$AGE" --data "$DATA" \
+        --output-dir "$OUT" > "$log" 2>&1 &
+    echo "  shard $i/$N → $hp   (log: $log)"
+    i=$((i+1))
+    sleep 2
+  done
+fi
 echo
 echo "Seguimiento:  tail -f /tmp/exp21_b0_shard*.log"
 echo "Al terminar:  $PY merge_shards.py --input-dir $OUT --output $OUT/FULL.csv"
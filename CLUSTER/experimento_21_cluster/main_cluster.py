@@ -15,6 +15,11 @@ Exp 21 funcione sin cambios; añade columnas de traza del agente.
 
 Prompt caching desactivado (config canónica del benchmark; Ollama lo ignora igual).
 
+Columnas de la salida: el corpus se lee proyectado a id, texto, año y las 5 GT
+(corpus.COLUMNAS_BASE) y cada fila copia sólo esas columnas de entrada. Para
+conservar otras, `--columnas url,medio`; para el esquema completo del CSV (todas
+sus columnas, como antes del lector por columnas), `--columnas todas` (COLUMNAS=todas).
+
 Ejemplo (granja Ollama, B1 con skills):
     OLLAMA_HOST=bastet07:11434 \
     python main_cluster.py --model gemma4:e4b --shard 0 --n-shards 2 --workers 4 \
@@ -28,9 +33,22 @@ Ejemplo (B0 baseline sin skills):
       --workers 4 --experimentos-dir /ruta/Experimentos \
       --agente-dir /ruta/Experimentos/experiments/experimento_21_agentskills \
       --data /ruta/...scrape.csv --only-labeled
+
+Ejemplo (cola compartida: los shards rápidos se quedan con el trabajo restante):
+    python main_cluster.py --model gemma4:e4b --cola /compartido/cola_b1.sqlite \
+      --shard 0 --n-shards 4 --workers 4 --experimentos-dir /ruta/Experimentos \
+      --agente-dir /ruta/Experimentos/experiments/experimento_21_agentskills \
+      --data /ruta/...scrape.csv --only-labeled
+
+Ejemplo (B0 en un solo shard balanceado entre los 4 Ollama del llm.json de bastet07):
+    python main_cluster.py --model gemma4:e4b --baseline --ollama-hosts bastet07 \
+      --llm-json ../llm.json --workers 16 --experimentos-dir /ruta/Experimentos \
+      --agente-dir /ruta/Experimentos/experiments/experimento_21_agentskills \
+      --data /ruta/...scrape.csv --only-labeled
 """
 
 import argparse
+import atexit
 import json
 import os
 import sys
@@ -52,7 +70,13 @@ def parse_args():
     p.add_argument("--agente-dir", default=os.environ.get("AGENTE_DIR"),
                    help="Carpeta experimento_21_agentskills (agente.py, tools.py, guias.py, skills/). Env: AGENTE_DIR")
     p.add_argument("--data", default=os.environ.get("DATA_CSV"),
-                   help="CSV del corpus (con contenido_articulo e IdNoticia). Env: DATA_CSV")
+                   help="CSV del corpus (con contenido_articulo e IdNoticia) o su Parquet "
+                        "(corpus.py); si hay un .parquet más reciente junto al CSV se usa ese. "
+                        "Env: DATA_CSV")
+    p.add_argument("--columnas", default=os.environ.get("COLUMNAS", ""),
+                   help="Columnas extra del corpus que se copian a la salida (separadas por "
+                        "comas). Por defecto sólo id, texto, año y las 5 GT; 'todas' lee y "
+                        "copia todas las del CSV (esquema de salida completo). Env: COLUMNAS")
     p.add_argument("--output-dir", default=os.environ.get("OUTPUT_DIR", "./results"),
                    help="Carpeta de salida. Env: OUTPUT_DIR")
     p.add_argument("--model", default=os.environ.get("MODELO", "gemma4:e4b"),
@@ -68,12 +92,60 @@ def parse_args():
                    help="Ablación B1: desactivar la tool RAG en vivo CONSULTAR_GUIA. Env: SIN_CONSULTAR_GUIA")
     p.add_argument("--ollama-host", default=os.environ.get("OLLAMA_HOST"),
                    help="host:puerto del servidor Ollama de la granja. Env: OLLAMA_HOST")
+    p.add_argument("--ollama-hosts", default=os.environ.get("OLLAMA_HOSTS"),
+                   help="Varios servidores Ollama separados por comas (host:puerto, o host a secas "
+                        "para usar los puertos de --llm-json): cada petición va al menos cargado, "
+                        "con failover. --workers pasa a ser el total del shard (~4 por servidor). "
+                        "Env: OLLAMA_HOSTS")
+    p.add_argument("--llm-json", default=os.environ.get("LLM_JSON"),
+                   help="llm.json de launch_process.py: puertos que se usan para los hosts sin "
+                        "puerto de --ollama-hosts. Env: LLM_JSON")
+    p.add_argument("--sin-corte-temprano", action="store_true",
+                   default=os.environ.get("SIN_CORTE_TEMPRANO", "").lower() in ("1", "true", "yes"),
+                   help="B0: no cortar el streaming de Ollama al cerrar el FINAL (respuesta "
+                        "completa, como antes). Env: SIN_CORTE_TEMPRANO")
+    p.add_argument("--sin-multiturno", action="store_true",
+                   default=os.environ.get("SIN_MULTITURNO", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: el agente reenvía system + historial entero como un único "
+                        "prompt en cada turno (transporte anterior). Env: SIN_MULTITURNO=1")
+    p.add_argument("--precarga", default=os.environ.get("PRECARGA"), metavar="JSON",
+                   help="B1: política de precarga (experimento_21_agentskills/precarga.py); las "
+                        "skills que el agente casi siempre lee van ya en el primer turno. Env: PRECARGA")
+    p.add_argument("--deduplicar", action="store_true",
+                   default=os.environ.get("DEDUPLICAR", "").lower() in ("1", "true", "yes"),
+                   help="Clasificar sólo un artículo por grupo de texto idéntico y replicar su "
+                        "resultado a las copias (por defecto se clasifican todos). Env: DEDUPLICAR=1")
+    p.add_argument("--sin-cortacircuitos", action="store_true",
+                   default=os.environ.get("SIN_CORTACIRCUITOS", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: sin corta-circuitos en el router (cada llamada fallida acaba "
+                        "en una fila codigo=1 en lugar de pausar los workers). Env: SIN_CORTACIRCUITOS=1")
+    p.add_argument("--max-pausa", type=float, default=float(os.environ.get("MAX_PAUSA", 1800)),
+                   help="Segundos que un circuito (proveedor o modelo) puede seguir abierto con "
+                        "los workers en pausa antes de abortar el shard. Env: MAX_PAUSA")
+    p.add_argument("--keep-alive", default=os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
+                   help="keep_alive de Ollama: el modelo queda cargado entre llamadas ('-1' = "
+                        "indefinido). Env: OLLAMA_KEEP_ALIVE")
+    p.add_argument("--num-predict", type=int, default=int(os.environ.get("NUM_PREDICT", 0)) or None,
+                   help="Tope de tokens de salida en Ollama (num_predict). Por defecto 512 por "
+                        "variable de lenguaje y 1024 en el resto. Env: NUM_PREDICT")
     p.add_argument("--shard", type=int, default=int(os.environ.get("SHARD", 0)),
                    help="Índice de este shard (0-based). Env: SHARD")
     p.add_argument("--n-shards", type=int, default=int(os.environ.get("N_SHARDS", 1)),
                    help="Número total de shards. Env: N_SHARDS")
+    p.add_argument("--cola", default=os.environ.get("COLA_DB"), metavar="SQLITE",
+                   help="Cola de trabajo compartida (SQLite en el FS compartido) en lugar del "
+                        "reparto estático i %% n_shards: cada shard toma artículos en préstamo "
+                        "hasta vaciarla. Todos los shards, mismo fichero. Env: COLA_DB")
+    p.add_argument("--cola-sin-wal", action="store_true",
+                   default=os.environ.get("COLA_SIN_WAL", "").lower() in ("1", "true", "yes"),
+                   help="Diario clásico en lugar de WAL para --cola (NFS entre nodos). Env: COLA_SIN_WAL=1")
     p.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", 4)),
-                   help="Peticiones concurrentes dentro de este shard. Env: WORKERS")
+                   help="Llamadas al modelo en vuelo dentro de este shard (tope global: los "
+                        "artículos se admiten en orden y sus variables van en paralelo). Env: WORKERS")
+    p.add_argument("--variables-en-serie", action="store_true",
+                   default=os.environ.get("VARIABLES_EN_SERIE", "").lower() in ("1", "true", "yes"),
+                   help="Ablación: las 5 variables de cada artículo una tras otra (--workers "
+                        "artículos a la vez) en lugar de en paralelo. Env: VARIABLES_EN_SERIE=1")
     p.add_argument("--limit", type=int, default=int(os.environ.get("LIMIT", 0)) or None,
                    help="Procesa como mucho N artículos (prueba rápida). Env: LIMIT")
     p.add_argument("--year", type=int, default=int(os.environ.get("YEAR", 0)),
@@ -81,6 +153,14 @@ def parse_args():
     p.add_argument("--only-labeled", action="store_true",
                    default=os.environ.get("ONLY_LABELED", "").lower() in ("1", "true", "yes"),
                    help="Solo artículos con GT en las 5 variables. Env: ONLY_LABELED")
+    p.add_argument("--cache-respuestas", default=os.environ.get("CACHE_RESPUESTAS"),
+                   help="Fichero SQLite de caché de respuestas (opt-in): prompts idénticos no "
+                        "vuelven a llamar al modelo. Env: CACHE_RESPUESTAS")
+    p.add_argument("--cache-max-mb", type=float, default=float(os.environ.get("CACHE_MAX_MB", 0)) or None,
+                   help="Tamaño máximo de la caché de respuestas (MB, evicción LRU). Env: CACHE_MAX_MB")
+    p.add_argument("--batch", default=os.environ.get("BATCH_DIR"), metavar="DIR",
+                   help="Modo lote (sólo --baseline, modelos OpenAI/Anthropic): llamadas B0 por la "
+                        "batch API. DIR guarda el estado de los lotes para reanudar. Env: BATCH_DIR")
     return p.parse_args()
 
 
@@ -94,6 +174,10 @@ if not args.data:
     sys.exit("ERROR: define --data o DATA_CSV.")
 if not (0 <= args.shard < args.n_shards):
     sys.exit(f"ERROR: --shard ({args.shard}) debe estar en [0, {args.n_shards}).")
+if args.batch and not args.baseline:
+    sys.exit("ERROR: --batch requiere --baseline (el bucle de agentes B1 es multi-turno).")
+if args.batch and args.cola:
+    sys.exit("ERROR: --cola no se combina con --batch.")
 
 # El cliente Ollama lee OLLAMA_HOST del entorno; lo fijamos por si vino por CLI.
 if args.ollama_host:
@@ -107,23 +191,56 @@ for _p in (EXPERIMENTOS_DIR, AGENTE_DIR):
 
 import ollama       # noqa: E402  (instrumentar el tiempo real de inferencia)
 import agente       # noqa: E402  (código de agentes del Exp 21)
+import utils        # noqa: E402  (router multi-proveedor que usa agente.py)
+import lotes        # noqa: E402  (modo --batch)
+import balanceador_ollama  # noqa: E402  (--ollama-hosts)
+import cola_trabajo  # noqa: E402  (--cola)
+import corpus  # noqa: E402  (carga del corpus con proyección y filtros)
+import cortacircuitos  # noqa: E402  (pausa/aborto ante errores del proveedor)
+import deduplicacion  # noqa: E402  (un artículo por grupo de texto idéntico)
+import planificador  # noqa: E402  (variables en paralelo)
+from escritor_resultados import EscritorResultados  # noqa: E402
+
+if args.batch and not lotes.proveedor_soporta_lote(args.model):
+    sys.exit(f"ERROR: --batch sólo admite modelos de OpenAI o Anthropic (no {args.model}).")
+
+# Un cliente por proveedor compartido por los workers; pool keep-alive = --workers.
+utils.configurar_pool(args.workers)
+utils.configurar_ollama(keep_alive=args.keep_alive, num_predict=args.num_predict)
+OLLAMA_HOSTS = balanceador_ollama.parsear_hosts(args.ollama_hosts, args.llm_json) \
+    if args.ollama_hosts else []
+utils.configurar_hosts_ollama(OLLAMA_HOSTS)
+utils.USAR_CORTACIRCUITOS = not args.sin_cortacircuitos
+utils.configurar_cortacircuitos(max_pausa=args.max_pausa)
+if args.cache_respuestas:
+    utils.activar_cache_respuestas(args.cache_respuestas, max_mb=args.cache_max_mb)
 
 # Config canónica del benchmark: sin prompt caching (Ollama lo ignora igualmente).
 agente.USAR_PROMPT_CACHE = False
 
+if args.sin_corte_temprano:
+    agente.CORTE_TEMPRANO = False
+
 # Ablaciones B1 (solo aplican en nivel B1; en B0 no hay catálogo ni tools).
+if args.sin_multiturno:
+    agente.TRANSPORTE_CHAT = False
 if args.sin_resumenes_guias:
     agente.INCLUIR_RESUMENES_GUIAS = False
 if args.sin_consultar_guia:
     agente.HABILITAR_CONSULTAR_GUIA = False
+if args.precarga and not args.baseline:
+    import precarga  # noqa: E402
+    agente.PRECARGA = precarga.cargar_politica(args.precarga)
 
 # --- Instrumentación: tiempo REAL de inferencia por artículo (Ollama) ---
 _tls = threading.local()
 _orig_ollama_chat = ollama.chat
+_orig_client_chat = ollama.Client.chat
 
 
-def _timed_chat(*a, **kw):
-    resp = _orig_ollama_chat(*a, **kw)
+def _anotar_duracion(resp):
+    if hasattr(resp, "__next__"):  # stream (corte temprano de utils): se mide al cerrarlo
+        return _stream_cronometrado(resp)
     try:
         dur = resp.get("total_duration") if isinstance(resp, dict) else getattr(resp, "total_duration", None)
     except Exception:
@@ -133,7 +250,29 @@ def _timed_chat(*a, **kw):
     return resp
 
 
+def _stream_cronometrado(flujo):
+    t0 = time.perf_counter_ns()
+    dur = None
+    try:
+        for trozo in flujo:
+            dur = trozo.get("total_duration") or dur
+            yield trozo
+    finally:
+        flujo.close()
+        # Cortado antes del trozo final no hay total_duration: se usa el tiempo de pared.
+        _tls.model_ns = getattr(_tls, "model_ns", 0) + (dur or time.perf_counter_ns() - t0)
+
+
+def _timed_chat(*a, **kw):
+    return _anotar_duracion(_orig_ollama_chat(*a, **kw))
+
+
+def _timed_client_chat(self, *a, **kw):
+    return _anotar_duracion(_orig_client_chat(self, *a, **kw))
+
+
 ollama.chat = _timed_chat  # utils.consultar_ollama -> ollama.chat queda instrumentado
+ollama.Client.chat = _timed_client_chat  # clientes por host del balanceador (--ollama-hosts)
 
 MODELO = args.model
 COLUMNA_ID = "IdNoticia"
@@ -146,16 +285,25 @@ if not args.baseline:
         NIVEL = "b1sinres"
     elif args.sin_consultar_guia:
         NIVEL = "b1singuia"
+    if args.precarga:
+        NIVEL += "pre"
 _VARS = ["lenguaje_sexista", "masc_generico", "sexismo_discurso",
          "asimetria_mujer_hombre", "denominacion_sexualizada"]
 _clasificar = agente.clasificar_variable_baseline if args.baseline else agente.clasificar_variable
+# Variables de cada artículo en paralelo (un agente por variable) bajo el tope --workers.
+plan = None if (args.variables_en_serie or args.batch) else planificador.Planificador(args.workers)
+N_ARTICULOS = plan.articulos_en_vuelo(len(_VARS)) if plan else args.workers
 
 print(f"🤖 Modelo      : {MODELO}")
 _abl = (" · sin resúmenes" if args.sin_resumenes_guias else "") + \
-       (" · sin CONSULTAR_GUIA" if args.sin_consultar_guia else "")
+       (" · sin CONSULTAR_GUIA" if args.sin_consultar_guia else "") + \
+       (" · sin multiturno" if args.sin_multiturno else "") + \
+       (" · precarga" if args.precarga else "")
 print(f"🧩 Nivel       : {NIVEL.upper()}  "
       f"({'baseline sin skills' if args.baseline else 'Agent Skills'+_abl})")
 print(f"🖥️  OLLAMA_HOST : {os.environ.get('OLLAMA_HOST', '(localhost:11434)')}")
+if len(OLLAMA_HOSTS) > 1:
+    print(f"⚖️  Balanceo    : {len(OLLAMA_HOSTS)} servidores Ollama ({', '.join(OLLAMA_HOSTS)})")
 print(f"🔀 Shard       : {args.shard} / {args.n_shards}   (workers={args.workers})")
 print(f"📂 Agente dir  : {AGENTE_DIR}")
 
@@ -172,46 +320,58 @@ nombre_output = os.path.join(
 # ==========================================
 # 2. CARGA + SHARD + REANUDACIÓN
 # ==========================================
-print("Cargando datos...")
 try:
-    data = pd.read_csv(args.data)
+    ruta_datos = corpus.resolver_ruta(args.data)
 except FileNotFoundError:
     sys.exit(f"No se encuentra el archivo de datos: {args.data}")
-
-df_base = data[data["año"] == args.year].copy() if args.year else data.copy()
-
+print(f"Cargando datos ({ruta_datos})...")
+# Sólo las columnas necesarias; año y --only-labeled se filtran en el lector.
+_columnas = None if args.columnas.strip().lower() == "todas" else \
+    corpus.COLUMNAS_BASE + [c.strip() for c in args.columnas.split(",") if c.strip()]
+df_procesar = corpus.cargar_corpus(ruta_datos, columnas=_columnas, anio=args.year or None,
+                                   etiquetados="todas" if args.only_labeled else None)
 if args.only_labeled:
-    presentes = [c for c in _VARS if c in df_base.columns]
-    antes = len(df_base)
-    df_base = df_base[df_base[presentes].notna().all(axis=1)].copy()
-    print(f"-> --only-labeled: {len(df_base)} artículos con GT en las 5 (de {antes}).")
-
-df_procesar = df_base.reset_index(drop=True)
+    print(f"-> --only-labeled: {len(df_procesar)} artículos con GT en las 5.")
+# --deduplicar: de cada grupo de duplicados exactos (piezas de agencia) sólo el representante se
+# reparte y se clasifica; al guardarlo se escriben también las filas de sus copias.
+dedup = None
+if args.deduplicar:
+    dedup = deduplicacion.Deduplicador(df_procesar, col_id=COLUMNA_ID)
+    dedup.imprimir_resumen(len(_VARS))
+    df_procesar = dedup.representantes()
 total_dataset = len(df_procesar)
-df_procesar = df_procesar[df_procesar.index % args.n_shards == args.shard].copy()
-print(f"-> A este shard le tocan {len(df_procesar)} artículos de {total_dataset}.")
+cola = None
+if args.cola:
+    # Sin reparto estático: todos los shards encolan los mismos ids.
+    cola = cola_trabajo.ColaTrabajo(args.cola, wal=not args.cola_sin_wal)
+    nuevos = cola.poblar(df_procesar[COLUMNA_ID].astype(str))
+    print(f"-> Cola {args.cola}: {nuevos} artículos nuevos encolados · estado {cola.resumen()}")
+else:
+    df_procesar = df_procesar[df_procesar.index % args.n_shards == args.shard].copy()
+    print(f"-> A este shard le tocan {len(df_procesar)} artículos de {total_dataset}.")
 
-ids_procesados = set()
-es_primera_vez = True
-if os.path.exists(nombre_output):
-    try:
-        df_salida = pd.read_csv(nombre_output)
-        if COLUMNA_ID in df_salida.columns:
-            ids_procesados = set(df_salida[COLUMNA_ID].dropna().astype(str).unique())
-            es_primera_vez = False
-            print(f"-> Reanudación: {len(ids_procesados)} ya procesados.")
-    except pd.errors.EmptyDataError:
-        print("-> Archivo de salida vacío. Empezando de cero.")
+escritor = EscritorResultados(nombre_output, columna_id=COLUMNA_ID)
+# Cualquier salida (sys.exit, excepción, Ctrl-C) vacía el búfer y exporta el CSV;
+# cerrar() es idempotente, así que los cierres explícitos siguen valiendo.
+atexit.register(escritor.cerrar)
+ids_procesados = escritor.ids()
+if ids_procesados:
+    print(f"-> Reanudación: {len(ids_procesados)} ya procesados.")
 
 total_antes = len(df_procesar)
-df_procesar = df_procesar[~df_procesar[COLUMNA_ID].astype(str).isin(ids_procesados)]
+if dedup is not None:
+    df_procesar = df_procesar[[dedup.pendiente(i, ids_procesados)
+                               for i in df_procesar[COLUMNA_ID].astype(str)]]
+else:
+    df_procesar = df_procesar[~df_procesar[COLUMNA_ID].astype(str).isin(ids_procesados)]
 print(f"Quedan {len(df_procesar)} por procesar (se omitieron {total_antes - len(df_procesar)}).")
 
-if args.limit:
+if args.limit and cola is None:
     df_procesar = df_procesar.head(args.limit)
     print(f"-> LIMIT activo: solo {len(df_procesar)}.")
 
-if df_procesar.empty:
+if (df_procesar.empty if cola is None else not any(
+        cola.resumen()[e] for e in ("pendiente", "en_curso"))):
     print("Nada que procesar en este shard. Saliendo.")
     sys.exit(0)
 
@@ -219,16 +379,30 @@ if df_procesar.empty:
 # ==========================================
 # 3. PROCESAMIENTO (5 agentes por artículo)
 # ==========================================
-def procesar_fila(row):
+def procesar_fila(row, respuestas=None):
+    """`respuestas`: {variable: (salida, consumo)} ya obtenidas en modo --batch."""
     texto = str(row["contenido_articulo"]) if pd.notna(row["contenido_articulo"]) else ""
     out = {}
     n_err = 0
-    for variable in _VARS:
-        res, traza = _clasificar(variable, texto, modelo=MODELO)
+    if respuestas is not None:
+        por_variable = [(v, *agente.interpretar_baseline(v, texto, MODELO, *respuestas[v]))
+                        for v in _VARS]
+    elif plan is None:
+        por_variable = [(v, *_clasificar(v, texto, modelo=MODELO)) for v in _VARS]
+    else:
+        con_ns = plan.repartir(lambda v: _clasificar_variable(v, texto), _VARS)
+        # El tiempo de Ollama se anotó en los hilos del pool: se suma al del artículo.
+        _tls.model_ns = getattr(_tls, "model_ns", 0) + sum(ns for *_, ns in con_ns)
+        por_variable = [(v, res, traza) for v, res, traza, _ in con_ns]
+    for variable, res, traza in por_variable:
         out[f"modelo_{variable}"] = res["codigo"]
         out[f"modelo_{variable}_explicacion"] = res["explicacion"]
         out[f"modelo_{variable}_evidencias"] = " | ".join(res["evidencias"]) if res["evidencias"] else ""
+        out[f"modelo_{variable}_evidencias_spans"] = json.dumps(res.get("spans", []))
         out[f"{variable}_n_tools"] = traza["n_tools"]
+        out[f"{variable}_skills"] = "|".join(traza.get("skills_cargadas", []))
+        out[f"{variable}_precargadas"] = "|".join(traza.get("skills_precargadas", []))
+        out[f"{variable}_turnos"] = traza["n_llamadas"]
         out[f"{variable}_colapso_b0"] = int(traza["colapso_b0"])
         out[f"{variable}_error"] = traza.get("error") or ""
         if traza.get("error"):
@@ -237,25 +411,29 @@ def procesar_fila(row):
     return out
 
 
+def _clasificar_variable(variable: str, texto: str) -> tuple:
+    """(variable, resultado, traza, ns de Ollama); corre en un hilo del planificador."""
+    _tls.model_ns = 0
+    res, traza = _clasificar(variable, texto, modelo=MODELO)
+    return variable, res, traza, _tls.model_ns
+
+
 # ==========================================
 # 4. BUCLE PRINCIPAL (concurrencia + guardado incremental con lock)
 # ==========================================
-print(f"Guardado en tiempo real en: {nombre_output}")
-_write_lock = threading.Lock()
-_state = {"primera": es_primera_vez}
+print(f"Guardado en tiempo real en: {escritor.ruta_diario} (CSV al terminar: {nombre_output})")
 
 
 def _guardar(fila_completa):
-    df_temp = pd.DataFrame([fila_completa])
-    with _write_lock:
-        if _state["primera"]:
-            df_temp.to_csv(nombre_output, index=False, mode="w", encoding="utf-8")
-            _state["primera"] = False
-        else:
-            df_temp.to_csv(nombre_output, index=False, mode="a", header=False, encoding="utf-8")
+    if cortacircuitos.abortado():
+        return  # fila calculada con el circuito agotado: se relanzará al reanudar
+    etiqueta = "error" if fila_completa.get("n_variables_error") else ""
+    for fila in (dedup.expandir(fila_completa) if dedup is not None else [fila_completa]):
+        if str(fila[COLUMNA_ID]) not in ids_procesados:  # ya está en el CSV de este shard
+            escritor.escribir(fila, etiqueta=etiqueta)
 
 
-def _trabajo(row):
+def _fila_procesada(row) -> dict:
     start = time.time()
     _tls.model_ns = 0
     res_fila = procesar_fila(row)
@@ -263,39 +441,168 @@ def _trabajo(row):
     fila.update(res_fila)
     fila["modelo_tiempo_procesamiento_seg"] = time.time() - start
     fila["modelo_tiempo_modelo_real_seg"] = getattr(_tls, "model_ns", 0) / 1e9
-    _guardar(fila)
+    return fila
+
+
+def _trabajo(row):
+    _guardar(_fila_procesada(row))
+
+
+def _prevuelo(fn, *a):
+    """Primer artículo sin paciencia: si abre un circuito (clave, modelo ausente) se aborta ya."""
+    utils.configurar_cortacircuitos(max_pausa=0)
+    try:
+        return fn(*a)
+    finally:
+        utils.configurar_cortacircuitos(max_pausa=args.max_pausa)
+
+
+def _fila_cola(row):
+    """--cola: un artículo con las 5 variables en error vuelve a la cola (no se confirma)."""
+    fila = _fila_procesada(row)
+    return None if fila["n_variables_error"] >= len(_VARS) else fila
+
+
+_filas_previas = None
+_lock_previas = threading.Lock()
+
+
+def _fila_previa(id_art: str) -> dict:
+    """--cola: fila que este shard ya escribió en una corrida anterior (sin volver al modelo)."""
+    global _filas_previas
+    with _lock_previas:
+        if _filas_previas is None:
+            _filas_previas = {str(f[COLUMNA_ID]): f for f in escritor.filas()}
+    return _filas_previas[id_art]
 
 
 filas = [row for _, row in df_procesar.iterrows()]
 
-# Pre-vuelo: procesa el primer artículo en serie. Si fallan las 5 variables, el
-# servidor Ollama no está sirviendo el modelo (host/puerto sin el modelo cargado):
-# se aborta ANTES de escribir filas basura (todas codigo=1 / sin_final).
-_pf = procesar_fila(filas[0])
-if _pf.get("n_variables_error", 0) >= len(_VARS):
-    sys.exit(
-        f"\n❌ ABORTADO (pre-vuelo): el primer artículo falló en las {len(_VARS)} "
-        f"variables. Revisa que OLLAMA_HOST={os.environ.get('OLLAMA_HOST')} sirve "
-        f"'{MODELO}' (curl http://$OLLAMA_HOST/api/tags | grep {MODELO.split(':')[0]}).\n"
-        "No se ha escrito nada.")
-_fila0 = filas[0].to_dict(); _fila0.update(_pf)
-_fila0["modelo_tiempo_procesamiento_seg"] = 0.0
-_fila0["modelo_tiempo_modelo_real_seg"] = 0.0
-_guardar(_fila0)
-filas = filas[1:]  # el primero ya está guardado
-
-_wall0 = time.time()
-if args.workers <= 1:
-    for row in tqdm(filas, total=len(filas)):
-        _trabajo(row)
-else:
-    with ThreadPoolExecutor(max_workers=args.workers) as ex:
-        futuros = [ex.submit(_trabajo, row) for row in filas]
-        for _ in tqdm(as_completed(futuros), total=len(futuros)):
-            pass
-_wall = time.time() - _wall0
 
-n = len(filas)
+def _procesar_lote(filas) -> None:
+    """Modo --batch: prompts B0 de todo el shard en lotes; vuelca las filas al terminar."""
+    peticiones = {}
+    for i, row in enumerate(filas):
+        texto = str(row["contenido_articulo"]) if pd.notna(row["contenido_articulo"]) else ""
+        for variable in _VARS:
+            peticiones[f"{i}::{variable}"] = agente.prompt_baseline(variable, texto)
+    respuestas = lotes.ejecutar_lote(peticiones, MODELO, dir_trabajo=args.batch)
+    for i, row in enumerate(tqdm(filas, total=len(filas))):
+        res_fila = procesar_fila(row, {v: respuestas[f"{i}::{v}"] for v in _VARS})
+        if res_fila["n_variables_error"] >= len(_VARS):
+            continue  # no se escribe: la reanudación volverá a pedir este artículo
+        fila = row.to_dict()
+        fila.update(res_fila)
+        fila["modelo_tiempo_procesamiento_seg"] = 0.0
+        fila["modelo_tiempo_modelo_real_seg"] = 0.0
+        _guardar(fila)
+
+
+if args.batch:
+    _wall0 = time.time()
+    _procesar_lote(filas)
+    _wall = time.time() - _wall0
+    escritor.cerrar()
+    print(f"\nLote completado en {_wall/60:.1f} min ({len(filas)} artículos). Archivo: {nombre_output}")
+    sys.exit(0)
+
+def _bucle_cola(filas) -> int:
+    """
+    --cola: el pre-vuelo es un préstamo más (se confirma o vuelve a la cola) y después
+    los workers toman préstamos hasta vaciarla. Devuelve los artículos confirmados aquí.
+    """
+    por_id = {str(row[COLUMNA_ID]): row for row in filas}
+
+    def _de_cola(id_art: str):
+        # La cola puede prestar un id que este shard ya terminó antes (filtrado de `filas`
+        # por la reanudación): se confirma con la fila ya escrita.
+        if id_art in ids_procesados:
+            return _fila_previa(id_art)
+        return _fila_cola(por_id[id_art])
+
+    ids = cola.tomar(1)
+    while ids and ids[0] in ids_procesados:
+        fila0 = _fila_previa(ids[0])
+        cola.completar(ids[0], fila0, dedup.copias(fila0) if dedup is not None else None)
+        ids = cola.tomar(1)
+    if not ids:
+        return 0
+    try:
+        fila0 = _prevuelo(_fila_cola, por_id[ids[0]])
+    except cortacircuitos.CircuitoAbierto:
+        cola.liberar(ids[0])
+        raise
+    if fila0 is None:
+        cola.liberar(ids[0])
+        sys.exit(
+            f"\n❌ ABORTADO (pre-vuelo): el primer artículo falló en las {len(_VARS)} "
+            f"variables. Revisa que OLLAMA_HOST={os.environ.get('OLLAMA_HOST')} sirve "
+            f"'{MODELO}'. El artículo vuelve a la cola.")
+    n = 0
+    if cola.completar(ids[0], fila0, dedup.copias(fila0) if dedup is not None else None):
+        _guardar(fila0)
+        n = 1
+    with tqdm(total=len(por_id)) as barra:
+        n += cola_trabajo.procesar_cola(
+            cola, _de_cola, _guardar, workers=N_ARTICULOS,
+            limite=args.limit - 1 if args.limit else None, al_terminar=lambda: barra.update(1),
+            copias=dedup.copias if dedup is not None else None, parar=cortacircuitos.abortado)
+    print(f"-> Cola: {n} artículos confirmados por este shard · estado {cola.resumen()}")
+    return n
+
+
+try:
+    if cola is not None:
+        _wall0 = time.time()
+        n = _bucle_cola(filas)
+        _wall = time.time() - _wall0
+    else:
+        # Pre-vuelo: procesa el primer artículo en serie. Si fallan las 5 variables, el
+        # servidor Ollama no está sirviendo el modelo (host/puerto sin el modelo cargado):
+        # se aborta ANTES de escribir filas basura (todas codigo=1 / sin_final).
+        _pf = _prevuelo(procesar_fila, filas[0])
+        if _pf.get("n_variables_error", 0) >= len(_VARS):
+            sys.exit(
+                f"\n❌ ABORTADO (pre-vuelo): el primer artículo falló en las {len(_VARS)} "
+                f"variables. Revisa que OLLAMA_HOST={os.environ.get('OLLAMA_HOST')} sirve "
+                f"'{MODELO}' (curl http://$OLLAMA_HOST/api/tags | grep {MODELO.split(':')[0]}).\n"
+                "No se ha escrito nada.")
+        _fila0 = filas[0].to_dict(); _fila0.update(_pf)
+        _fila0["modelo_tiempo_procesamiento_seg"] = 0.0
+        _fila0["modelo_tiempo_modelo_real_seg"] = 0.0
+        _guardar(_fila0)
+        filas = filas[1:]  # el primero ya está guardado
+
+        _wall0 = time.time()
+        if args.workers <= 1:
+            for row in tqdm(filas, total=len(filas)):
+                _trabajo(row)
+        else:
+            with ThreadPoolExecutor(max_workers=N_ARTICULOS) as ex:
+                futuros = [ex.submit(_trabajo, row) for row in filas]
+                try:
+                    for f in tqdm(as_completed(futuros), total=len(futuros)):
+                        f.result()
+                except cortacircuitos.CircuitoAbierto:
+                    for f in futuros:
+                        f.cancel()
+                    raise
+        _wall = time.time() - _wall0
+        n = len(filas)
+except cortacircuitos.CircuitoAbierto as e:
+    escritor.cerrar()
+    utils.imprimir_estadisticas_cortacircuitos()
+    sys.exit(f"\n❌ ABORTADO (corta-circuitos): {e}\n"
+             f"   Revisa saldo/API key/servidor. Progreso guardado en {escritor.ruta_diario}; "
+             "relanza el mismo comando para reanudar.")
+if cola is not None and cortacircuitos.abortado():
+    escritor.cerrar()
+    utils.imprimir_estadisticas_cortacircuitos()
+    sys.exit("\n❌ ABORTADO (corta-circuitos): la cola se detuvo y los artículos en curso "
+             "se devolvieron a ella. Relanza el mismo comando para reanudar.")
+escritor.cerrar()
+if plan is not None:
+    plan.cerrar()
 print("\n" + "=" * 50)
 print(f" RESUMEN — Exp 21 {NIVEL.upper()} · {MODELO} · shard {args.shard}/{args.n_shards}")
 print("=" * 50)
@@ -303,4 +610,14 @@ print(f"  Artículos      : {n}")
 print(f"  Tiempo de pared: {_wall/60:.1f} min")
 if n:
     print(f"  Throughput     : {_wall/n:.1f} s/artículo | {n/(_wall/3600):.0f} art/hora")
+if plan is not None:
+    print(f"  Variables en paralelo: {plan.estadisticas()}")
+utils.imprimir_estadisticas_pool()
+utils.imprimir_estadisticas_cache_prompt()
+utils.imprimir_estadisticas_ollama()
+utils.imprimir_estadisticas_balanceador()
+utils.imprimir_estadisticas_streaming()
+utils.imprimir_estadisticas_cortacircuitos()
+if args.cache_respuestas:
+    print(f"  Caché respuestas: {utils.estadisticas_cache_respuestas()}")
 print(f"\nArchivo completado: {nombre_output}")
@@ -3,36 +3,57 @@
 Uso:
     python merge_shards.py --input-dir results_b1_completo --output results_b1_completo/FULL.csv
     python merge_shards.py results_b1_completo            # salida por defecto: <dir>/FULL.csv
+    python merge_shards.py results_b1 --cola /compartido/cola_b1.sqlite   # corrida con --cola
 """
 import argparse
-import glob
+import json
 import os
+import sqlite3
 import sys
 
 import pandas as pd
 
+
+# Lectura de shards (índice .ids + diario .jsonl) con los helpers de Experimentos:
+# EXPERIMENTOS_DIR o, por defecto, la carpeta del repo.
+sys.path.append(os.path.abspath(os.environ.get("EXPERIMENTOS_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "Experimentos")))
+from escritor_resultados import leer_salida  # noqa: E402
+from indice_completados import contar_confirmadas, salidas  # noqa: E402
+
 ap = argparse.ArgumentParser()
 ap.add_argument("input_dir", nargs="?", default=None)
 ap.add_argument("--input-dir", dest="input_dir_opt", default=None)
 ap.add_argument("--output", default=None)
 ap.add_argument("--pattern", default="*shard*de*.csv",
                 help="Glob de los CSV por shard (por defecto *shard*de*.csv)")
+ap.add_argument("--cola", default=None,
+                help="SQLite de --cola: se leen de ahí las filas confirmadas (copia autoritativa)")
 args = ap.parse_args()
 
 input_dir = args.input_dir_opt or args.input_dir
 if not input_dir:
     sys.exit("Falta el directorio de shards (posicional o --input-dir).")
 
-patron = os.path.join(input_dir, args.pattern)
-ficheros = sorted(glob.glob(patron))
-if not ficheros:
-    sys.exit(f"No se encontraron shards en {patron}")
-
-print(f"Uniendo {len(ficheros)} shards:")
-for f in ficheros:
-    print(f"  - {f}")
-
-df = pd.concat([pd.read_csv(f) for f in ficheros], ignore_index=True)
+if args.cola:
+    # Tabla 'trabajos' de Experimentos/cola_trabajo.py.
+    with sqlite3.connect(args.cola) as conn:
+        filas = conn.execute(
+            "SELECT resultado FROM trabajos WHERE estado = 'hecho' ORDER BY id").fetchall()
+    print(f"Leyendo {len(filas)} filas confirmadas de la cola {args.cola}")
+    df = pd.DataFrame([json.loads(r) for (r,) in filas])
+else:
+    patron = os.path.join(input_dir, args.pattern)
+    ficheros = salidas(patron)
+    if not ficheros:
+        sys.exit(f"No se encontraron shards en {patron}")
+
+    print(f"Uniendo {len(ficheros)} shards:")
+    for f in ficheros:
+        n = contar_confirmadas(f)
+        print(f"  - {f}" + (f"  ({n} filas confirmadas)" if n is not None else ""))
+
+    df = pd.concat([leer_salida(f) for f in ficheros], ignore_index=True)
 if "IdNoticia" in df.columns:
     df = df.drop_duplicates(subset="IdNoticia")
 
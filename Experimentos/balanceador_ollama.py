@@ -0,0 +1,278 @@
+"""
+Balanceador en cliente para varios servidores Ollama de la granja.
+
+Hasta ahora cada shard de CLUSTER/*/main_cluster.py quedaba atado a un único
+OLLAMA_HOST (lanzar_b0.sh: un host:puerto por shard). Con artículos de longitud
+muy desigual unos servidores terminan antes y se quedan ociosos mientras otros
+acumulan cola, y un servidor caído tumba su shard entero.
+
+Aquí cada petición va al servidor sano menos cargado, con la puntuación
+    (peticiones en vuelo + 1) × EWMA de la latencia
+de modo que un servidor lento (GPU compartida, modelo recargándose) recibe menos
+trabajo sin dejar de recibir. Ante un fallo de conexión o un 5xx la petición se
+reintenta en otro servidor; tras FALLOS_PARA_EXPULSAR fallos seguidos el servidor
+se expulsa durante un tiempo que crece exponencialmente y, vencido ese plazo, se
+readmite a prueba: un éxito lo devuelve al reparto, otro fallo lo expulsa de nuevo.
+
+Los errores del modelo (4xx: modelo no descargado, petición inválida) no son culpa
+del servidor y se propagan sin expulsarlo.
+
+Uso (desde los runners, vía utils):
+    utils.configurar_hosts_ollama(["bastet07:11434", "bastet07:11435", "bastet08:11436"])
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Optional
+
+import ollama
+
+ALFA_EWMA = 0.2                 # peso de la última latencia en la media móvil
+FALLOS_PARA_EXPULSAR = 2        # fallos consecutivos antes de sacar el servidor del reparto
+EXPULSION_BASE = 15.0           # segundos de la primera expulsión
+EXPULSION_MAX = 300.0           # tope del backoff de expulsión
+PUERTO_POR_DEFECTO = 11434
+
+
+def _es_fallo_de_servidor(e: Exception) -> bool:
+    """Conexión rechazada/cortada, timeout o 5xx → el servidor, no la petición."""
+    status = getattr(e, "status_code", None)
+    if isinstance(status, int) and status > 0:
+        return status >= 500
+    nombre = type(e).__name__.lower()
+    return isinstance(e, (ConnectionError, TimeoutError, OSError)) or any(
+        t in nombre for t in ("connect", "timeout", "network", "protocol", "readerror"))
+
+
+class _Servidor:
+    """Estado de un endpoint: carga, latencia y salud."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.en_vuelo = 0
+        self.ewma: Optional[float] = None
+        self.fallos_seguidos = 0
+        self.expulsiones = 0
+        self.nivel_expulsion = 0    # se reinicia con el primer éxito tras readmitirlo
+        self.expulsado_hasta = 0.0
+        self.a_prueba = False
+        self.stats = {"peticiones": 0, "fallos": 0}
+        self._clientes_async = weakref.WeakKeyDictionary()   # bucle de eventos → AsyncClient
+
+    def puntuacion(self, latencia_por_defecto: float) -> float:
+        return (self.en_vuelo + 1) * (self.ewma if self.ewma is not None else latencia_por_defecto)
+
+
+class Balanceador:
+    """Reparte ollama.chat entre varios servidores; seguro entre hilos y tareas asyncio."""
+
+    def __init__(self, hosts: list[str]):
+        if not hosts:
+            raise ValueError("El balanceador necesita al menos un host de Ollama.")
+        self._servidores = [_Servidor(h) for h in dict.fromkeys(hosts)]
+        self._lock = threading.Lock()
+        # Un ollama.Client por host: conexiones keep-alive propias de cada servidor.
+        self._clientes = {s.host: ollama.Client(host=s.host) for s in self._servidores}
+
+    @property
+    def hosts(self) -> list[str]:
+        return [s.host for s in self._servidores]
+
+    # --- selección ---
+    def _elegir(self, excluidos: set) -> _Servidor:
+        with self._lock:
+            ahora = time.monotonic()
+            candidatos = [s for s in self._servidores if s.host not in excluidos]
+            if not candidatos:
+                raise ConnectionError("Ningún servidor Ollama ha respondido: "
+                                      + ", ".join(self.hosts))
+            sanos = [s for s in candidatos if s.expulsado_hasta <= ahora]
+            for s in sanos:
+                if s.expulsado_hasta and not s.a_prueba:
+                    s.a_prueba = True  # plazo vencido: readmisión a prueba
+            if not sanos:
+                # Todos expulsados: mejor probar el que antes vuelve que fallar en seco.
+                sanos = [min(candidatos, key=lambda s: s.expulsado_hasta)]
+            conocidas = [s.ewma for s in self._servidores if s.ewma is not None]
+            # Sin muestras aún: se toma la mejor latencia conocida (se prueba pronto).
+            por_defecto = min(conocidas) if conocidas else 1.0
+            elegido = min(sanos, key=lambda s: s.puntuacion(por_defecto))
+            elegido.en_vuelo += 1
+            elegido.stats["peticiones"] += 1
+            return elegido
+
+    # --- resultado ---
+    def _exito(self, s: _Servidor, segundos: float) -> None:
+        with self._lock:
+            s.en_vuelo -= 1
+            s.ewma = segundos if s.ewma is None else ALFA_EWMA * segundos + (1 - ALFA_EWMA) * s.ewma
+            s.fallos_seguidos = 0
+            s.nivel_expulsion = 0
+            if s.a_prueba:
+                print(f"[balanceador] {s.host} readmitido.")
+            s.a_prueba = False
+            s.expulsado_hasta = 0.0
+
+    def _fallo(self, s: _Servidor, e: Exception) -> None:
+        with self._lock:
+            s.en_vuelo -= 1
+            s.stats["fallos"] += 1
+            s.fallos_seguidos += 1
+            if s.a_prueba or s.fallos_seguidos >= FALLOS_PARA_EXPULSAR:
+                s.expulsiones += 1
+                s.nivel_expulsion += 1
+                plazo = min(EXPULSION_MAX, EXPULSION_BASE * 2 ** (s.nivel_expulsion - 1))
+                s.expulsado_hasta = time.monotonic() + plazo
+                s.a_prueba = False
+                print(f"[balanceador] {s.host} expulsado {plazo:.0f}s "
+                      f"({type(e).__name__}: {str(e)[:120]})")
+
+    def _liberar(self, s: _Servidor) -> None:
+        with self._lock:
+            s.en_vuelo -= 1
+
+    # --- llamadas ---
+    def chat(self, **kwargs):
+        """Como ollama.chat(**kwargs), en el servidor menos cargado (failover incluido)."""
+        probados: set = set()
+        while True:
+            s = self._elegir(probados)
+            t0 = time.perf_counter()
+            try:
+                response = self._clientes[s.host].chat(**kwargs)
+                if kwargs.get("stream"):
+                    # El stream abre la conexión en el primer next(): así un servidor
+                    # caído todavía admite failover.
+                    primero = next(response, None)
+            except Exception as e:
+                if not _es_fallo_de_servidor(e):
+                    self._liberar(s)
+                    raise
+                self._fallo(s, e)
+                probados.add(s.host)
+                if len(probados) >= len(self._servidores):
+                    raise
+                continue
+            if kwargs.get("stream"):
+                return self._flujo(s, t0, primero, response)
+            self._exito(s, time.perf_counter() - t0)
+            return response
+
+    def _flujo(self, s: _Servidor, t0: float, primero, resto):
+        """Reemite el stream y anota el resultado al agotarlo o al cerrarlo (corte temprano)."""
+        try:
+            if primero is not None:
+                yield primero
+            yield from resto
+        except Exception as e:
+            if _es_fallo_de_servidor(e):
+                self._fallo(s, e)
+            else:
+                self._liberar(s)
+            raise
+        except GeneratorExit:
+            resto.close()
+            self._exito(s, time.perf_counter() - t0)
+            raise
+        else:
+            self._exito(s, time.perf_counter() - t0)
+
+    def _cliente_async(self, s: _Servidor):
+        import asyncio
+        # Igual que en utils: los clientes async quedan ligados a su bucle de eventos;
+        # el cliente retiene su bucle, así que los de bucles cerrados se descartan aquí.
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in s._clientes_async:
+                for viejo in [b for b in list(s._clientes_async.keys()) if b.is_closed()]:
+                    del s._clientes_async[viejo]
+                s._clientes_async[loop] = ollama.AsyncClient(host=s.host)
+            return s._clientes_async[loop]
+
+    async def achat(self, **kwargs):
+        """Versión asyncio de chat()."""
+        probados: set = set()
+        while True:
+            s = self._elegir(probados)
+            t0 = time.perf_counter()
+            try:
+                response = await self._cliente_async(s).chat(**kwargs)
+                if kwargs.get("stream"):
+                    primero = await anext(response, None)
+            except BaseException as e:  # también CancelledError: la petición deja de contar
+                if not isinstance(e, Exception) or not _es_fallo_de_servidor(e):
+                    self._liberar(s)
+                    raise
+                self._fallo(s, e)
+                probados.add(s.host)
+                if len(probados) >= len(self._servidores):
+                    raise
+                continue
+            if kwargs.get("stream"):
+                return self._aflujo(s, t0, primero, response)
+            self._exito(s, time.perf_counter() - t0)
+            return response
+
+    async def _aflujo(self, s: _Servidor, t0: float, primero, resto):
+        try:
+            if primero is not None:
+                yield primero
+            async for trozo in resto:
+                yield trozo
+        except Exception as e:
+            if _es_fallo_de_servidor(e):
+                self._fallo(s, e)
+            else:
+                self._liberar(s)
+            raise
+        except GeneratorExit:
+            await resto.aclose()
+            self._exito(s, time.perf_counter() - t0)
+            raise
+        except BaseException:  # cancelación de la tarea
+            self._liberar(s)
+            raise
+        else:
+            self._exito(s, time.perf_counter() - t0)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            ahora = time.monotonic()
+            return {
+                s.host: {
+                    **s.stats,
+                    "en_vuelo": s.en_vuelo,
+                    "latencia_ewma_s": round(s.ewma, 2) if s.ewma is not None else None,
+                    "expulsiones": s.expulsiones,
+                    "expulsado": s.expulsado_hasta > ahora,
+                }
+                for s in self._servidores
+            }
+
+
+def parsear_hosts(valor: str, ruta_llm_json: Optional[str] = None) -> list[str]:
+    """
+    'h1:11434,h1:11435,h2' → lista de host:puerto. Un host sin puerto se expande con
+    los puertos de tasks.var_parameters.port del llm.json (si se da) o con 11434.
+    """
+    puertos = puertos_llm_json(ruta_llm_json) if ruta_llm_json else [PUERTO_POR_DEFECTO]
+    hosts = []
+    for item in (valor or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if ":" in item.split("//")[-1]:
+            hosts.append(item)
+        else:
+            hosts.extend(f"{item}:{p}" for p in puertos)
+    return hosts
+
+
+def puertos_llm_json(ruta: str) -> list[int]:
+    """Puertos de los Ollama que levanta launch_process.py con ese llm.json."""
+    datos = json.loads(Path(ruta).read_text(encoding="utf-8"))
+    return [int(p) for p in datos["tasks"]["var_parameters"]["port"]]
@@ -0,0 +1,151 @@
+"""
+Caché persistente de respuestas LLM (content-addressed) para utils.consultar_ollama.
+
+La clave es un SHA-256 de (modelo, prompt final tras partir por IRIS_CACHE_BREAK,
+temperatura, opciones del proveedor): dos llamadas byte-idénticas comparten
+entrada aunque vengan de ablaciones o relanzamientos distintos. Se guarda también
+el consumo de tokens de la llamada original, para que un acierto siga rellenando
+las columnas de consumo/coste del CSV.
+
+Backend SQLite en modo WAL: una conexión por hilo y `busy_timeout`, así que es
+seguro con muchos workers y con varios procesos (shards) sobre el mismo fichero
+en disco local. Evicción por antigüedad (`max_dias`) y por tamaño (`max_mb`,
+se descartan primero las entradas usadas hace más tiempo).
+
+Uso (desde los runners):
+    utils.activar_cache_respuestas("cache/respuestas.sqlite", max_mb=2048)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+# Cada cuántas escrituras se comprueba la evicción por tamaño/edad.
+PODAR_CADA = 200
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS respuestas (
+    clave     TEXT PRIMARY KEY,
+    modelo    TEXT NOT NULL,
+    respuesta TEXT NOT NULL,
+    consumo   TEXT NOT NULL,
+    creado    REAL NOT NULL,
+    usado     REAL NOT NULL,
+    bytes     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_respuestas_usado ON respuestas(usado);
+"""
+
+
+def clave_respuesta(modelo: str, partes: tuple, temperature: float,
+                    opciones: Optional[dict] = None) -> str:
+    """Hash estable de todo lo que determina la respuesta del proveedor."""
+    material = json.dumps(
+        {"modelo": modelo, "partes": list(partes), "temperature": float(temperature),
+         "opciones": opciones or {}},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CacheRespuestas:
+    """Caché SQLite clave→(respuesta, consumo), segura entre hilos y procesos."""
+
+    def __init__(self, ruta: str | Path, max_mb: Optional[float] = None,
+                 max_dias: Optional[float] = None):
+        self.ruta = Path(ruta)
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self.max_edad = max_dias * 86400 if max_dias else None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._aciertos = 0
+        self._fallos = 0
+        self._escrituras = 0
+        self._conexion().executescript(_ESQUEMA)
+        self._podar()
+
+    def _conexion(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=60, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA busy_timeout=60000")
+            self._local.con = con
+        return con
+
+    def obtener(self, clave: str) -> Optional[tuple[str, dict]]:
+        """(respuesta, consumo) si hay entrada vigente; None si no."""
+        con = self._conexion()
+        fila = con.execute(
+            "SELECT respuesta, consumo, creado FROM respuestas WHERE clave = ?",
+            (clave,)).fetchone()
+        ahora = time.time()
+        if fila is not None and self.max_edad and fila[2] < ahora - self.max_edad:
+            con.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+            fila = None
+        with self._lock:
+            if fila is None:
+                self._fallos += 1
+            else:
+                self._aciertos += 1
+        if fila is None:
+            return None
+        con.execute("UPDATE respuestas SET usado = ? WHERE clave = ?", (ahora, clave))
+        return fila[0], json.loads(fila[1])
+
+    def guardar(self, clave: str, modelo: str, respuesta: str, consumo: dict[str, Any]) -> None:
+        consumo_txt = json.dumps(consumo, ensure_ascii=False)
+        tam = len(respuesta.encode("utf-8")) + len(consumo_txt)
+        ahora = time.time()
+        self._conexion().execute(
+            "INSERT OR REPLACE INTO respuestas "
+            "(clave, modelo, respuesta, consumo, creado, usado, bytes) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (clave, modelo, respuesta, consumo_txt, ahora, ahora, tam))
+        with self._lock:
+            self._escrituras += 1
+            toca_podar = self._escrituras % PODAR_CADA == 0
+        if toca_podar:
+            self._podar()
+
+    def _podar(self) -> None:
+        """Evicción: primero por edad, después LRU hasta quedar bajo max_bytes."""
+        con = self._conexion()
+        if self.max_edad:
+            con.execute("DELETE FROM respuestas WHERE creado < ?",
+                        (time.time() - self.max_edad,))
+        if not self.max_bytes:
+            return
+        total = con.execute("SELECT COALESCE(SUM(bytes), 0) FROM respuestas").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Se libera hasta el 90 % del máximo para no podar en cada escritura.
+        sobrante = total - int(self.max_bytes * 0.9)
+        liberado = 0
+        claves = []
+        for clave, tam in con.execute("SELECT clave, bytes FROM respuestas ORDER BY usado"):
+            claves.append((clave,))
+            liberado += tam
+            if liberado >= sobrante:
+                break
+        con.executemany("DELETE FROM respuestas WHERE clave = ?", claves)
+
+    def estadisticas(self) -> dict:
+        fila = self._conexion().execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM respuestas").fetchone()
+        with self._lock:
+            consultas = self._aciertos + self._fallos
+            return {
+                "entradas": fila[0],
+                "mb": round(fila[1] / 1024 / 1024, 2),
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "ratio_aciertos": round(self._aciertos / consultas, 3) if consultas else None,
+            }
@@ -0,0 +1,287 @@
+"""
+Cola de trabajo compartida (SQLite) para repartir artículos entre shards.
+
+El reparto estático de CLUSTER/*/main_cluster.py (fila i → shard i % n_shards)
+ata cada artículo a un shard: el shard de la GPU lenta, o el que recibe los
+artículos más largos, termina horas después que los demás. Con esta cola todos
+los shards piden artículos a un mismo fichero SQLite en el sistema de ficheros
+compartido y los rápidos se quedan con el trabajo que queda.
+
+Cada artículo se toma en *préstamo* (lease) durante DURACION_LEASE segundos; un
+hilo de latido renueva los préstamos en curso, así que si el proceso muere su
+trabajo vuelve a la cola al vencer el plazo. Tras MAX_INTENTOS préstamos sin
+completar el artículo queda como 'fallido' (no bloquea la campaña).
+
+El resultado se confirma una sola vez: completar() guarda la fila en la misma
+transacción que la marca como 'hecho' y sólo el primero en terminar la escribe;
+si un préstamo vencido acaba en dos shards, el segundo recibe False y la descarta.
+La base de datos es, por tanto, la copia autoritativa (resultados()), y los CSV
+por shard sólo reciben filas confirmadas.
+
+Nota: el modo WAL de SQLite necesita memoria compartida entre procesos; en un
+NFS entre nodos distintos usar wal=False (diario clásico con bloqueo de fichero).
+
+Uso:
+    cola = ColaTrabajo("results/cola.sqlite")
+    cola.poblar(ids)                                   # idempotente desde todos los shards
+    procesar_cola(cola, procesar, guardar, workers=8)  # procesar(id) -> fila | None
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+DURACION_LEASE = 300.0      # segundos que un artículo queda reservado sin latido
+MAX_INTENTOS = 3            # préstamos antes de dar el artículo por fallido
+ESPERA_VACIA = 5.0          # sondeo cuando sólo quedan préstamos ajenos en curso
+TIMEOUT_BLOQUEO = 60.0      # espera máxima por el bloqueo de escritura de SQLite
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id          TEXT PRIMARY KEY,
+    estado      TEXT NOT NULL DEFAULT 'pendiente',  -- pendiente | en_curso | hecho | fallido
+    trabajador  TEXT,
+    lease_hasta REAL,
+    intentos    INTEGER NOT NULL DEFAULT 0,
+    resultado   TEXT,
+    actualizado REAL
+);
+CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, lease_hasta);
+"""
+
+
+def _a_json(valor):
+    # Escalares de numpy/pandas (int64, Timestamp...) que json no serializa.
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+
+class ColaTrabajo:
+    """Préstamos de artículos sobre un fichero SQLite; segura entre hilos y procesos."""
+
+    def __init__(self, ruta: str, duracion_lease: float = DURACION_LEASE,
+                 trabajador: Optional[str] = None, wal: bool = True):
+        self.ruta = ruta
+        self.duracion_lease = duracion_lease
+        self.trabajador = trabajador or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, timeout=TIMEOUT_BLOQUEO,
+                                     isolation_level=None, check_same_thread=False)
+        if wal:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_ESQUEMA)
+        self._en_mano: set = set()
+        self._latido: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+
+    # --- transacciones ---
+    def _escribir(self, fn):
+        """Ejecuta fn(conn) en una transacción IMMEDIATE (bloqueo de escritura desde el inicio)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return resultado
+
+    def poblar(self, ids: Iterable) -> int:
+        """Encola los ids que no estén ya (cualquier estado). Devuelve cuántos son nuevos."""
+        filas = [(str(i), time.time()) for i in ids]
+
+        def _fn(conn):
+            antes = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO trabajos (id, actualizado) VALUES (?, ?)", filas)
+            return conn.total_changes - antes
+        return self._escribir(_fn)
+
+    def tomar(self, n: int = 1) -> list[str]:
+        """
+        Hasta `n` ids pendientes (o con préstamo vencido) prestados a este trabajador.
+        Los vencidos que ya agotaron MAX_INTENTOS pasan a 'fallido'.
+        """
+        def _fn(conn):
+            ahora = time.time()
+            conn.execute(
+                "UPDATE trabajos SET estado = 'fallido', trabajador = NULL, actualizado = ? "
+                "WHERE estado = 'en_curso' AND lease_hasta < ? AND intentos >= ?",
+                (ahora, ahora, MAX_INTENTOS))
+            ids = [r[0] for r in conn.execute(
+                "SELECT id FROM trabajos WHERE estado = 'pendiente' "
+                "OR (estado = 'en_curso' AND lease_hasta < ?) LIMIT ?", (ahora, n))]
+            conn.executemany(
+                "UPDATE trabajos SET estado = 'en_curso', trabajador = ?, lease_hasta = ?, "
+                "intentos = intentos + 1, actualizado = ? WHERE id = ?",
+                [(self.trabajador, ahora + self.duracion_lease, ahora, i) for i in ids])
+            return ids
+        ids = self._escribir(_fn)
+        if ids:
+            with self._lock:
+                self._en_mano.update(ids)
+            self._arrancar_latido()
+        return ids
+
+    def completar(self, id_trabajo, resultado: dict, copias: Optional[dict] = None) -> bool:
+        """
+        Confirma el resultado de `id_trabajo`. True si esta llamada lo ha escrito;
+        False si ya estaba hecho (otro shard terminó antes un préstamo duplicado).
+        `copias` ({id: fila}) se confirma en la misma transacción: artículos que no
+        se encolaron porque reciben el resultado de este (deduplicacion.py).
+        """
+        id_trabajo = str(id_trabajo)
+        datos = json.dumps(resultado, ensure_ascii=False, default=_a_json)
+
+        def _fn(conn):
+            ahora = time.time()
+            cur = conn.execute(
+                "UPDATE trabajos SET estado = 'hecho', resultado = ?, trabajador = ?, "
+                "lease_hasta = NULL, actualizado = ? WHERE id = ? AND estado != 'hecho'",
+                (datos, self.trabajador, ahora, id_trabajo))
+            if cur.rowcount == 1 and copias:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO trabajos (id, estado, trabajador, resultado, actualizado) "
+                    "VALUES (?, 'hecho', ?, ?, ?)",
+                    [(str(i), self.trabajador, json.dumps(f, ensure_ascii=False, default=_a_json), ahora)
+                     for i, f in copias.items()])
+            return cur.rowcount == 1
+        escrito = self._escribir(_fn)
+        self._soltar(id_trabajo)
+        return escrito
+
+    def liberar(self, id_trabajo) -> None:
+        """Devuelve el préstamo a la cola (o lo da por fallido si agotó MAX_INTENTOS)."""
+        id_trabajo = str(id_trabajo)
+        self._escribir(lambda conn: conn.execute(
+            "UPDATE trabajos SET estado = CASE WHEN intentos >= ? THEN 'fallido' ELSE 'pendiente' END, "
+            "trabajador = NULL, lease_hasta = NULL, actualizado = ? "
+            "WHERE id = ? AND estado = 'en_curso' AND trabajador = ?",
+            (MAX_INTENTOS, time.time(), id_trabajo, self.trabajador)))
+        self._soltar(id_trabajo)
+
+    def _soltar(self, id_trabajo: str) -> None:
+        with self._lock:
+            self._en_mano.discard(id_trabajo)
+
+    # --- latido ---
+    def _arrancar_latido(self) -> None:
+        with self._lock:
+            if self._latido is not None:
+                return
+            self._latido = threading.Thread(target=self._bucle_latido, daemon=True,
+                                            name="cola-latido")
+            self._latido.start()
+
+    def _bucle_latido(self) -> None:
+        while not self._parar.wait(self.duracion_lease / 3):
+            try:
+                self.renovar()
+            except sqlite3.Error as e:  # un latido perdido no es fatal: queda margen
+                print(f"[cola] latido fallido: {e}")
+
+    def renovar(self) -> None:
+        """Alarga los préstamos en curso de este trabajador."""
+        with self._lock:
+            ids = list(self._en_mano)
+        if not ids:
+            return
+        hasta = time.time() + self.duracion_lease
+        self._escribir(lambda conn: conn.executemany(
+            "UPDATE trabajos SET lease_hasta = ? "
+            "WHERE id = ? AND estado = 'en_curso' AND trabajador = ?",
+            [(hasta, i, self.trabajador) for i in ids]))
+
+    def cerrar(self) -> None:
+        self._parar.set()
+        if self._latido is not None:
+            self._latido.join(timeout=5)
+        with self._lock:
+            self._conn.close()
+
+    # --- consulta ---
+    def resumen(self) -> dict:
+        """Nº de artículos por estado (los préstamos vencidos cuentan como pendientes)."""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT CASE WHEN estado = 'en_curso' AND lease_hasta < ? THEN 'pendiente' "
+                "ELSE estado END, COUNT(*) FROM trabajos GROUP BY 1", (time.time(),)).fetchall()
+        resumen = {"pendiente": 0, "en_curso": 0, "hecho": 0, "fallido": 0}
+        resumen.update(dict(filas))
+        return resumen
+
+    def resultados(self) -> Iterator[dict]:
+        """Filas confirmadas (una por artículo), en orden de id."""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT resultado FROM trabajos WHERE estado = 'hecho' ORDER BY id").fetchall()
+        for (datos,) in filas:
+            yield json.loads(datos)
+
+
+def procesar_cola(cola: ColaTrabajo, procesar: Callable[[str], Optional[dict]],
+                  guardar: Callable[[dict], None], workers: int = 1,
+                  limite: Optional[int] = None, al_terminar: Optional[Callable[[], None]] = None,
+                  copias: Optional[Callable[[dict], dict]] = None,
+                  parar: Optional[Callable[[], bool]] = None) -> int:
+    """
+    Bucle de `workers` hilos que toman préstamos hasta vaciar la cola (o procesar
+    `limite` artículos). procesar(id) devuelve la fila o None (error: se libera
+    para reintento); sólo las filas confirmadas por completar() llegan a guardar().
+    `al_terminar` se llama tras cada artículo (p. ej. barra de progreso).
+    `copias(fila)` → {id: fila} de duplicados que se confirman junto a la fila.
+    `parar()` → True detiene la toma de préstamos (p. ej. corta-circuitos agotado);
+    lo que estaba en curso vuelve a la cola.
+    Devuelve el nº de filas guardadas por este proceso.
+    """
+    estado = {"tomados": 0, "guardados": 0}
+    lock = threading.Lock()
+
+    def _reservar_cupo() -> bool:
+        with lock:
+            if limite is not None and estado["tomados"] >= limite:
+                return False
+            estado["tomados"] += 1
+            return True
+
+    def _hilo():
+        while not (parar is not None and parar()) and _reservar_cupo():
+            ids = cola.tomar(1)
+            if not ids:
+                with lock:
+                    estado["tomados"] -= 1
+                r = cola.resumen()
+                if not r["en_curso"] and not r["pendiente"]:
+                    return
+                # Quedan préstamos ajenos en curso: si su shard muere, vencerán.
+                time.sleep(ESPERA_VACIA)
+                continue
+            id_trabajo = ids[0]
+            try:
+                fila = procesar(id_trabajo)
+            except Exception as e:
+                print(f"[cola] {id_trabajo}: {type(e).__name__}: {e}")
+                fila = None
+            if fila is None:
+                cola.liberar(id_trabajo)
+            elif cola.completar(id_trabajo, fila, copias(fila) if copias else None):
+                guardar(fila)
+                with lock:
+                    estado["guardados"] += 1
+            if al_terminar is not None:
+                al_terminar()
+
+    if workers <= 1:
+        _hilo()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for f in [ex.submit(_hilo) for _ in range(workers)]:
+                f.result()
+    return estado["guardados"]
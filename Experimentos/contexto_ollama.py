@@ -0,0 +1,62 @@
+"""
+num_ctx de Ollama por buckets según el tamaño del prompt.
+
+Contextos sobredimensionados gastan VRAM y prefill (y restan slots paralelos al
+servidor); infradimensionados truncan el artículo EN SILENCIO. Se estima el nº de
+tokens del prompt y se usa el bucket más pequeño que cabe.
+
+El bucket vigente de cada modelo sólo crece: Ollama recarga el modelo cuando cambia
+num_ctx, así que alternar buckets entre llamadas costaría más que un contexto holgado.
+
+Lo comparten Experimentos/utils.py y los utils de los experimentos que llaman a
+Ollama por su cuenta (experimento_interspeech), para que todos usen el mismo cálculo.
+
+Uso:
+    num_ctx = contexto_ollama.num_ctx_para(modelo, prompt, num_predict)
+"""
+from __future__ import annotations
+
+import threading
+
+OLLAMA_BUCKETS_CTX = (2048, 4096, 8192, 16384, 32768)
+CARACTERES_POR_TOKEN = 3.5     # estimación conservadora para español
+_MARGEN_CTX = 1.10
+
+_ctx_ollama: dict = {}         # modelo → bucket vigente
+_lock = threading.Lock()
+_stats = {"prompt_excede_ctx_max": 0, "buckets": {}}
+
+
+def configurar(buckets_ctx: tuple) -> None:
+    global OLLAMA_BUCKETS_CTX
+    OLLAMA_BUCKETS_CTX = tuple(sorted(int(b) for b in buckets_ctx))
+
+
+def tokens_estimados(texto: str) -> int:
+    return int(len(texto) / CARACTERES_POR_TOKEN)
+
+
+def num_ctx_para(modelo: str, prompt: str, num_predict: int) -> int:
+    """El bucket más pequeño donde caben el prompt estimado y num_predict (sin bajar nunca)."""
+    necesario = int(len(prompt) / CARACTERES_POR_TOKEN * _MARGEN_CTX) + num_predict
+    bucket = next((b for b in OLLAMA_BUCKETS_CTX if b >= necesario), None)
+    with _lock:
+        if bucket is None:
+            bucket = OLLAMA_BUCKETS_CTX[-1]
+            _stats["prompt_excede_ctx_max"] += 1
+        bucket = max(bucket, _ctx_ollama.get(modelo, 0))
+        _ctx_ollama[modelo] = bucket
+        _stats["buckets"][bucket] = _stats["buckets"].get(bucket, 0) + 1
+    return bucket
+
+
+def num_ctx_actual() -> dict:
+    """{modelo: num_ctx vigente}."""
+    with _lock:
+        return dict(_ctx_ollama)
+
+
+def estadisticas() -> dict:
+    with _lock:
+        return {"prompt_excede_ctx_max": _stats["prompt_excede_ctx_max"],
+                "buckets": dict(_stats["buckets"]), "num_ctx_actual": dict(_ctx_ollama)}
@@ -0,0 +1,187 @@
+"""
+Almacén columnar del corpus (Parquet) y cargador común de los runners.
+
+Cada shard empezaba con `pd.read_csv` del export completo `..._clara_scrape.csv`
+(todas las columnas, texto íntegro, comillas y saltos de línea que parsear) y
+filtraba después por año, --only-labeled y muestreo; con N shards en la granja
+el arranque en frío y la memoria se multiplicaban por N.
+
+Aquí:
+  - convertir_a_parquet(): conversión única CSV → Parquet (mismo orden de filas,
+    así el muestreo con random_state=42 y el reparto i % n_shards no cambian).
+  - cargar_corpus(): lee sólo las columnas pedidas (por defecto id, texto, año y
+    las variables GT) y empuja los filtros de año y de etiquetado al lector de
+    Parquet, que descarta grupos de filas por sus estadísticas.
+  - iterar_lotes(): lo mismo en lotes de TAM_LOTE filas, para recorrer el corpus
+    sin cargarlo entero.
+
+Si se pasa un .csv y existe al lado un .parquet más reciente, se usa el Parquet.
+Sin pyarrow (o sin Parquet) se lee el CSV con la misma proyección y filtros.
+
+Uso:
+    python corpus.py data/clara_scrape.csv          # → data/clara_scrape.parquet
+    df = corpus.cargar_corpus(ruta, anio=2024, etiquetados="alguna")
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+import pandas as pd
+
+COLUMNA_ID = "IdNoticia"
+COLUMNA_TEXTO = "contenido_articulo"
+COLUMNA_ANIO = "año"
+VARIABLES_GT = ["lenguaje_sexista", "masc_generico", "sexismo_discurso",
+                "asimetria_mujer_hombre", "denominacion_sexualizada"]
+COLUMNAS_BASE = [COLUMNA_ID, COLUMNA_TEXTO, COLUMNA_ANIO, *VARIABLES_GT]
+
+FILAS_POR_GRUPO = 512   # grupos pequeños: el filtro por año descarta más sin leerlos
+TAM_LOTE = 1024
+
+
+def _hay_pyarrow() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def ruta_parquet_de(ruta_csv: str | Path) -> Path:
+    return Path(ruta_csv).with_suffix(".parquet")
+
+
+def resolver_ruta(ruta: str | Path) -> Path:
+    """El Parquet hermano de un CSV si existe y no es más antiguo que él."""
+    ruta = Path(ruta)
+    if ruta.suffix.lower() == ".csv" and _hay_pyarrow():
+        pq_ruta = ruta_parquet_de(ruta)
+        if pq_ruta.is_file() and (not ruta.is_file()
+                                  or pq_ruta.stat().st_mtime >= ruta.stat().st_mtime):
+            return pq_ruta
+    if not ruta.exists():
+        raise FileNotFoundError(ruta)
+    return ruta
+
+
+def convertir_a_parquet(ruta_csv: str | Path, ruta_parquet: Optional[str | Path] = None,
+                        filas_por_grupo: int = FILAS_POR_GRUPO) -> Path:
+    """CSV → Parquet (zstd) conservando el orden de filas. Escritura atómica."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    ruta_parquet = Path(ruta_parquet) if ruta_parquet else ruta_parquet_de(ruta_csv)
+    df = pd.read_csv(ruta_csv)
+    # Columnas object con tipos mezclados (int y str): se guardan como texto.
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) or pd.isna(v) else str(v))
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    tmp = ruta_parquet.with_suffix(".tmp")
+    pq.write_table(tabla, tmp, row_group_size=filas_por_grupo, compression="zstd")
+    os.replace(tmp, ruta_parquet)
+    print(f"[corpus] {len(df)} filas · {len(df.columns)} columnas → {ruta_parquet}")
+    return ruta_parquet
+
+
+def _disponibles(ruta: Path) -> list[str]:
+    """Columnas del fichero, sin leer datos (esquema Parquet o cabecera del CSV)."""
+    if ruta.suffix.lower() == ".parquet":
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(ruta).names)
+    return list(pd.read_csv(ruta, nrows=0).columns)
+
+
+def _filtro_arrow(anio: Optional[int], etiquetados: Optional[str], gt: list[str]):
+    import pyarrow.dataset as ds
+    filtro = None
+    if anio:
+        filtro = ds.field(COLUMNA_ANIO) == anio
+    if etiquetados and gt:
+        validas = [ds.field(c).is_valid() for c in gt]
+        combinada = validas[0]
+        for v in validas[1:]:
+            combinada = (combinada | v) if etiquetados == "alguna" else (combinada & v)
+        filtro = combinada if filtro is None else filtro & combinada
+    return filtro
+
+
+def _filtrar_pandas(df: pd.DataFrame, anio: Optional[int], etiquetados: Optional[str],
+                    gt: list[str]) -> pd.DataFrame:
+    if anio:
+        df = df[df[COLUMNA_ANIO] == anio]
+    if etiquetados and gt:
+        presentes = df[gt].notna()
+        df = df[presentes.any(axis=1) if etiquetados == "alguna" else presentes.all(axis=1)]
+    return df
+
+
+def _preparar(ruta, columnas, anio, etiquetados):
+    if etiquetados not in (None, "alguna", "todas"):
+        raise ValueError("etiquetados debe ser None, 'alguna' o 'todas'")
+    ruta = resolver_ruta(ruta)
+    if columnas is not None:
+        # Las columnas de los filtros se leen aunque no se pidan (y se quitan al final).
+        columnas = list(columnas) + ([COLUMNA_ANIO] if anio else []) + \
+                   (list(VARIABLES_GT) if etiquetados else [])
+    disponibles = _disponibles(ruta)
+    cols = None if columnas is None else [c for c in dict.fromkeys(columnas) if c in disponibles]
+    gt = [c for c in VARIABLES_GT if c in disponibles]
+    return ruta, cols, gt
+
+
+def cargar_corpus(ruta: str | Path, columnas: Optional[Sequence[str]] = COLUMNAS_BASE,
+                  anio: Optional[int] = None, etiquetados: Optional[str] = None,
+                  n_muestras: Optional[int] = None) -> pd.DataFrame:
+    """
+    Corpus filtrado con índice 0..n-1. `columnas=None` lee todas. `etiquetados`:
+    'alguna' (GT en al menos una variable) o 'todas' (GT en las 5). `n_muestras`
+    muestrea tras filtrar con random_state=42, como hacían los runners.
+    """
+    pedidas = list(columnas) if columnas is not None else None
+    ruta, cols, gt = _preparar(ruta, columnas, anio, etiquetados)
+    if ruta.suffix.lower() == ".parquet":
+        import pyarrow.parquet as pq
+        df = pq.read_table(ruta, columns=cols,
+                           filters=_filtro_arrow(anio, etiquetados, gt)).to_pandas()
+    else:
+        df = _filtrar_pandas(pd.read_csv(ruta, usecols=cols), anio, etiquetados, gt)
+    if pedidas is not None:
+        df = df[[c for c in df.columns if c in pedidas]]
+    if n_muestras and n_muestras < len(df):
+        df = df.sample(n=n_muestras, random_state=42)
+    return df.reset_index(drop=True)
+
+
+def iterar_lotes(ruta: str | Path, columnas: Optional[Sequence[str]] = COLUMNAS_BASE,
+                 anio: Optional[int] = None, etiquetados: Optional[str] = None,
+                 tam_lote: int = TAM_LOTE) -> Iterator[pd.DataFrame]:
+    """Como cargar_corpus (sin muestreo), en DataFrames de hasta `tam_lote` filas."""
+    pedidas = list(columnas) if columnas is not None else None
+    ruta, cols, gt = _preparar(ruta, columnas, anio, etiquetados)
+    if ruta.suffix.lower() == ".parquet":
+        import pyarrow.dataset as ds
+        escaner = ds.dataset(ruta, format="parquet").scanner(
+            columns=cols, filter=_filtro_arrow(anio, etiquetados, gt), batch_size=tam_lote)
+        lotes = (lote.to_pandas() for lote in escaner.to_batches() if lote.num_rows)
+    else:
+        lotes = (_filtrar_pandas(trozo, anio, etiquetados, gt)
+                 for trozo in pd.read_csv(ruta, usecols=cols, chunksize=tam_lote))
+    for df in lotes:
+        if pedidas is not None:
+            df = df[[c for c in df.columns if c in pedidas]]
+        if len(df):
+            yield df
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Convierte el corpus CSV a Parquet (una vez).")
+    ap.add_argument("csv", help="Export del corpus (p. ej. ..._clara_scrape.csv)")
+    ap.add_argument("--salida", default=None, help="Parquet de salida (por defecto, junto al CSV)")
+    ap.add_argument("--filas-por-grupo", type=int, default=FILAS_POR_GRUPO)
+    args = ap.parse_args()
+    convertir_a_parquet(args.csv, args.salida, args.filas_por_grupo)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
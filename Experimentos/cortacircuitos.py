@@ -0,0 +1,237 @@
+"""
+Corta-circuitos compartido por todos los hilos/tareas del router (utils.consultar_ollama).
+
+experimento_21_agentskills/main.py aborta tras MAX_FALLOS_SEGUIDOS artículos fallidos
+íntegros, pero sólo en su bucle secuencial. En los runners con hilos del cluster,
+una clave caducada o un saldo agotado convertía cada llamada en un "" inmediato y
+se escribían miles de filas codigo=1 ("error") a toda velocidad, que luego había
+que localizar y relanzar.
+
+Aquí cada llamada pasa por dos circuitos, el del proveedor ("openai") y el del
+endpoint ("openai:gpt-5-mini", "ollama:gemma3:4b"):
+  - cerrado: las llamadas pasan; se anota cada resultado en una ventana deslizante
+    de VENTANA_S segundos. Con MIN_LLAMADAS o más y una tasa de error >= UMBRAL_ERROR,
+    o con un único error fatal, se abre: credenciales o saldo (401/402/403) abren el
+    del proveedor; un modelo inexistente (404, "try pulling") sólo el de su endpoint,
+    para no parar los demás modelos del mismo proveedor.
+  - abierto: las llamadas se BLOQUEAN (el pool entero queda en pausa, sin escribir
+    filas) durante una espera que crece exponencialmente desde ESPERA_BASE.
+  - semiabierto: vencida la espera pasa una sola llamada de sondeo; si acierta se
+    cierra y se despierta a todos, si falla se vuelve a abrir con el doble de espera.
+
+Los 429 de límite de tasa no cuentan: de ellos se ocupa limitador.py. Si un
+circuito lleva abierto más de MAX_PAUSA segundos seguidos se da por agotado: toda
+llamada lanza CircuitoAbierto y los runners se detienen (el progreso ya guardado
+sirve para reanudar).
+
+Uso (desde utils):
+    for c in circuitos_de("openai", "gpt-5-mini"):
+        c.permitir()            # bloquea mientras esté abierto
+    ...                         # llamada; después c.exito() o c.fallo(e)
+                                # (o c.liberar() si permitir() devolvió True y no hubo llamada)
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import limitador
+
+VENTANA_S = 60.0          # ventana deslizante de la tasa de error
+MIN_LLAMADAS = 8          # llamadas en la ventana antes de juzgar la tasa
+UMBRAL_ERROR = 0.5        # tasa de error que abre el circuito
+ESPERA_BASE = 30.0        # segundos de la primera apertura
+ESPERA_MAX = 600.0        # tope del backoff entre sondeos
+MAX_PAUSA = 1800.0        # abierto más tiempo seguido → se aborta la corrida
+
+# Fatales de todo el proveedor (credenciales, saldo) y sólo del modelo pedido.
+_STATUS_FATALES = (401, 402, 403)
+_TEXTOS_FATALES = ("insufficient_quota", "insufficient quota", "credit balance", "billing",
+                   "api key", "api_key", "x-api-key", "unauthorized", "permission denied")
+_STATUS_FATALES_MODELO = (404,)
+_TEXTOS_FATALES_MODELO = ("not found, try pulling",)
+
+
+class CircuitoAbierto(Exception):
+    """El circuito lleva abierto más de MAX_PAUSA: la corrida debe detenerse."""
+
+
+def alcance_fatal(e: Exception) -> Optional[str]:
+    """"proveedor" (credenciales, saldo), "modelo" (modelo inexistente) o None si no es fatal."""
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    texto = str(e).lower()
+    if status in _STATUS_FATALES or any(t in texto for t in _TEXTOS_FATALES):
+        return "proveedor"
+    if status in _STATUS_FATALES_MODELO or any(t in texto for t in _TEXTOS_FATALES_MODELO):
+        return "modelo"
+    return None
+
+
+def es_fatal(e: Exception) -> bool:
+    """Error que no se arregla reintentando: credenciales, saldo, modelo inexistente."""
+    return alcance_fatal(e) is not None
+
+
+class Circuito:
+    """Estado de un proveedor o endpoint: ventana de resultados y apertura."""
+
+    def __init__(self, clave: str, de_modelo: bool = False):
+        self.clave = clave
+        self.de_modelo = de_modelo          # endpoint proveedor:modelo (no el proveedor)
+        self._cond = threading.Condition()
+        self.estado = "cerrado"
+        self._eventos: deque = deque()      # (instante, acierto)
+        self._abierto_hasta = 0.0
+        self._abierto_desde: Optional[float] = None
+        self._nivel = 0
+        self._sondeando = False
+        self.agotado = False
+        self._stats = {"llamadas": 0, "fallos": 0, "aperturas": 0, "segundos_pausa": 0.0,
+                       "ultimo_error": ""}
+
+    # --- admisión ---
+    def _turno(self) -> Optional[float]:
+        """None si la llamada puede pasar; si no, segundos a esperar. Con el lock tomado."""
+        if self.estado == "cerrado":
+            return None
+        ahora = time.monotonic()
+        if self.agotado or ahora - self._abierto_desde > MAX_PAUSA:
+            self.agotado = True
+            raise CircuitoAbierto(
+                f"{self.clave}: abierto más de {MAX_PAUSA:.0f}s "
+                f"(último error: {self._stats['ultimo_error']})")
+        if self.estado == "abierto" and ahora >= self._abierto_hasta:
+            self.estado = "semiabierto"
+            self._sondeando = False
+        if self.estado == "semiabierto" and not self._sondeando:
+            self._sondeando = True
+            return None
+        return max(0.05, min(self._abierto_hasta - ahora, 1.0))
+
+    def permitir(self) -> bool:
+        """
+        Bloquea el hilo mientras el circuito esté abierto (o con un sondeo en curso).
+        True si la llamada admitida es el sondeo: quien la hace debe cerrar con
+        exito(), fallo() o liberar(), o el circuito queda esperando su resultado.
+        """
+        with self._cond:
+            while (espera := self._turno()) is not None:
+                self._cond.wait(espera)
+            return self.estado == "semiabierto"
+
+    async def apermitir(self) -> bool:
+        while True:
+            with self._cond:
+                espera = self._turno()
+                if espera is None:
+                    return self.estado == "semiabierto"
+            await asyncio.sleep(espera)
+
+    # --- resultados ---
+    def _anotar(self, acierto: bool, ahora: float) -> None:
+        self._stats["llamadas"] += 1
+        self._eventos.append((ahora, acierto))
+        while self._eventos and self._eventos[0][0] < ahora - VENTANA_S:
+            self._eventos.popleft()
+
+    def exito(self) -> None:
+        with self._cond:
+            ahora = time.monotonic()
+            self._anotar(True, ahora)
+            if self.estado != "cerrado":
+                pausa = ahora - self._abierto_desde
+                self._stats["segundos_pausa"] += pausa
+                print(f"[cortacircuitos] {self.clave}: sondeo correcto, se reanuda "
+                      f"tras {pausa:.0f}s de pausa.")
+                self.estado = "cerrado"
+                self._abierto_desde = None
+                self._nivel = 0
+                self._sondeando = False
+                self._eventos.clear()
+                self._cond.notify_all()
+
+    def fallo(self, e: Exception) -> None:
+        alcance = alcance_fatal(e)
+        if limitador.es_limite_de_tasa(e) and alcance is None:
+            self.liberar()
+            return
+        with self._cond:
+            ahora = time.monotonic()
+            self._anotar(False, ahora)
+            self._stats["fallos"] += 1
+            self._stats["ultimo_error"] = f"{type(e).__name__}: {str(e)[:200]}"
+            if self.estado == "semiabierto":
+                self._abrir(ahora, "falló el sondeo")
+            elif self.estado == "cerrado":
+                fallos = sum(1 for _, ok in self._eventos if not ok)
+                if alcance == "proveedor" or (alcance == "modelo" and self.de_modelo):
+                    self._abrir(ahora, "error fatal")
+                elif len(self._eventos) >= MIN_LLAMADAS and fallos / len(self._eventos) >= UMBRAL_ERROR:
+                    self._abrir(ahora, f"{fallos}/{len(self._eventos)} errores en {VENTANA_S:.0f}s")
+
+    def liberar(self) -> None:
+        """La llamada no dice nada de la salud (429): si era el sondeo, otro lo repite."""
+        with self._cond:
+            if self.estado == "semiabierto" and self._sondeando:
+                self._sondeando = False
+                self._cond.notify_all()
+
+    def _abrir(self, ahora: float, motivo: str) -> None:
+        espera = min(ESPERA_BASE * (2 ** self._nivel), ESPERA_MAX)
+        self._nivel += 1
+        self._stats["aperturas"] += 1
+        if self._abierto_desde is None:
+            self._abierto_desde = ahora
+        self.estado = "abierto"
+        self._abierto_hasta = ahora + espera
+        self._sondeando = False
+        print(f"[cortacircuitos] {self.clave}: ABIERTO ({motivo}; {self._stats['ultimo_error']}). "
+              f"Pausa de {espera:.0f}s antes del siguiente sondeo.")
+
+    def estadisticas(self) -> dict:
+        with self._cond:
+            return {"estado": "agotado" if self.agotado else self.estado, **self._stats,
+                    "segundos_pausa": round(self._stats["segundos_pausa"], 1)}
+
+
+_circuitos: dict[str, Circuito] = {}
+_lock = threading.Lock()
+
+
+def circuito(clave: str, de_modelo: bool = False) -> Circuito:
+    with _lock:
+        if clave not in _circuitos:
+            _circuitos[clave] = Circuito(clave, de_modelo)
+        return _circuitos[clave]
+
+
+def circuitos_de(proveedor: str, modelo: str = "") -> list[Circuito]:
+    """[circuito del proveedor, circuito del endpoint proveedor:modelo]."""
+    return [circuito(proveedor)] + ([circuito(f"{proveedor}:{modelo}", True)] if modelo else [])
+
+
+def configurar(max_pausa: Optional[float] = None, umbral_error: Optional[float] = None,
+               espera_base: Optional[float] = None) -> None:
+    """Ajustes de la corrida (antes de lanzar los workers)."""
+    global MAX_PAUSA, UMBRAL_ERROR, ESPERA_BASE
+    if max_pausa is not None:
+        MAX_PAUSA = float(max_pausa)
+    if umbral_error is not None:
+        UMBRAL_ERROR = float(umbral_error)
+    if espera_base is not None:
+        ESPERA_BASE = float(espera_base)
+
+
+def abortado() -> bool:
+    """¿Algún circuito agotado? Los runners dejan de tomar trabajo y de escribir filas."""
+    with _lock:
+        return any(c.agotado for c in _circuitos.values())
+
+
+def estadisticas() -> dict:
+    with _lock:
+        circuitos = list(_circuitos.values())
+    return {c.clave: c.estadisticas() for c in circuitos}
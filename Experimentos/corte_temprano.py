@@ -0,0 +1,93 @@
+"""
+Detector incremental de veredicto para la generación en streaming.
+
+Los prompts B0 (exp21) y de confianza (exp22) piden una línea `FINAL: {...}` y los
+de las variables 25–39 un objeto JSON, pero los modelos locales suelen seguir
+escribiendo después (repiten el JSON, añaden notas, abren otra valla markdown).
+En Ollama cada token de salida es tiempo de GPU: utils.consultar_ollama(...,
+cortar_en=...) recibe la respuesta en streaming, pasa cada trozo por este detector
+y cierra la conexión (Ollama aborta la generación) en cuanto el objeto del
+veredicto está completo.
+
+El detector cuenta llaves fuera de cadenas JSON (respetando escapes), así que
+`{"explicacion": "usa {llaves} y \\"comillas\\""}` no corta antes de tiempo.
+
+Modos:
+  - "final": el objeto que sigue al primer `FINAL:`.
+  - "json":  el primer objeto JSON de nivel superior (tolera vallas ```json).
+"""
+from __future__ import annotations
+
+MODOS = ("final", "json")
+MARCADOR_FINAL = "FINAL:"
+
+
+class DetectorVeredicto:
+    """Se alimenta con los trozos del stream; `completo` pasa a True al cerrar el objeto."""
+
+    def __init__(self, modo: str = "json"):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de corte desconocido: {modo!r} (válidos: {MODOS})")
+        self.modo = modo
+        self._buffer = ""
+        self._pos = 0             # siguiente carácter por examinar
+        self._inicio = None       # índice de la '{' de apertura del veredicto
+        self._fin = None          # índice tras la '}' de cierre
+        self._profundidad = 0
+        self._en_cadena = False
+        self._escape = False
+
+    @property
+    def completo(self) -> bool:
+        return self._fin is not None
+
+    @property
+    def texto(self) -> str:
+        """Lo recibido hasta el cierre del veredicto (todo, si aún no se ha cerrado)."""
+        return self._buffer[:self._fin] if self.completo else self._buffer
+
+    def alimentar(self, trozo: str) -> bool:
+        """Añade `trozo` y devuelve True si el veredicto ya está completo."""
+        if self.completo:
+            return True
+        self._buffer += trozo or ""
+        if self._inicio is None and not self._buscar_inicio():
+            return False
+        self._escanear()
+        return self.completo
+
+    def _buscar_inicio(self) -> bool:
+        desde = 0
+        if self.modo == "final":
+            i = self._buffer.find(MARCADOR_FINAL)
+            if i < 0:
+                return False
+            desde = i + len(MARCADOR_FINAL)
+        j = self._buffer.find("{", desde)
+        if j < 0:
+            return False
+        self._inicio = self._pos = j
+        return True
+
+    def _escanear(self) -> None:
+        b = self._buffer
+        for i in range(self._pos, len(b)):
+            c = b[i]
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_cadena = False
+            elif c == '"':
+                self._en_cadena = True
+            elif c == "{":
+                self._profundidad += 1
+            elif c == "}":
+                self._profundidad -= 1
+                if self._profundidad == 0:
+                    self._fin = i + 1
+                    self._pos = i + 1
+                    return
+        self._pos = len(b)
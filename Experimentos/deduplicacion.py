@@ -0,0 +1,128 @@
+"""
+Detección de artículos con texto idéntico: se clasifica uno y se replica al resto.
+
+Las piezas de agencia se publican tal cual en varios medios, así que el corpus
+tiene grupos de IdNoticia con el mismo `contenido_articulo`. Los runners los
+clasificaban todos (y los remove_duplicates.py de los exp 16–18 sólo limpiaban
+IdNoticia repetidos a posteriori).
+
+Aquí, antes de repartir el trabajo:
+  1. se normaliza el texto (Unicode NFKC, espacios colapsados) y se calcula su huella;
+  2. los artículos con la misma huella forman un grupo y sólo el primero (en el
+     orden del corpus) va al modelo;
+  3. expandir() copia las columnas de resultado del representante a cada miembro,
+     que conserva sus propias columnas (id, GT...) y anota `duplicado_de`.
+
+Los textos de menos de MIN_CARACTERES (vacíos, descargas fallidas) no se agrupan:
+que coincidan no dice nada del artículo.
+
+Uso:
+    dedup = Deduplicador(df)
+    df = dedup.representantes()              # lo que se manda al modelo
+    for fila in dedup.expandir(fila_rep):    # representante + sus duplicados
+        escritor.escribir(fila)
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import unicodedata
+from typing import Optional
+
+import pandas as pd
+
+MIN_CARACTERES = 200
+COLUMNA_DUPLICADO = "duplicado_de"
+
+_RE_ESPACIOS = re.compile(r"\s+")
+
+
+def normalizar_texto(texto) -> str:
+    if texto is None or (isinstance(texto, float) and pd.isna(texto)):
+        return ""
+    return _RE_ESPACIOS.sub(" ", unicodedata.normalize("NFKC", str(texto))).strip()
+
+
+def huella(texto) -> Optional[str]:
+    """blake2b del texto normalizado; None si es demasiado corto para agruparlo."""
+    normal = normalizar_texto(texto)
+    if len(normal) < MIN_CARACTERES:
+        return None
+    return hashlib.blake2b(normal.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Deduplicador:
+    """Grupos de texto idéntico de un DataFrame del corpus."""
+
+    def __init__(self, df: pd.DataFrame, col_id: str = "IdNoticia",
+                 col_texto: str = "contenido_articulo"):
+        self.col_id = col_id
+        self._df = df
+        self._columnas_base = set(df.columns)
+        self._filas: dict[str, dict] = {}
+        self._miembros: dict[str, list[str]] = {}   # id representante → ids duplicados
+        self._rep_de: dict[str, str] = {}
+        rep_por_huella: dict[str, str] = {}
+        self._es_rep = []
+        for _, row in df.iterrows():
+            rid = str(row[col_id])
+            h = huella(row.get(col_texto))
+            rep = rep_por_huella.setdefault(h, rid) if h is not None else rid
+            self._es_rep.append(rep == rid)
+            if rep != rid:
+                self._miembros.setdefault(rep, []).append(rid)
+                self._rep_de[rid] = rep
+                self._filas[rid] = row.to_dict()
+
+    def representantes(self) -> pd.DataFrame:
+        """
+        Las filas que van al modelo, en el orden del corpus. Conservan su índice
+        original: el reparto estático (índice % n_shards) manda cada representante
+        al mismo shard que sin deduplicar, así que reanudar no cambia de shard nada.
+        """
+        return self._df[self._es_rep]
+
+    def miembros(self, id_rep) -> list[str]:
+        return self._miembros.get(str(id_rep), [])
+
+    def pendiente(self, id_rep, hechos: set) -> bool:
+        """Un representante está hecho sólo si lo están él y todos sus duplicados."""
+        id_rep = str(id_rep)
+        return id_rep not in hechos or any(m not in hechos for m in self.miembros(id_rep))
+
+    def expandir(self, fila: dict) -> list[dict]:
+        """[fila del representante, fila de cada duplicado con los mismos resultados]."""
+        id_rep = str(fila[self.col_id])
+        miembros = self.miembros(id_rep)
+        if not miembros:
+            return [fila]
+        resultado = {k: v for k, v in fila.items() if k not in self._columnas_base}
+        filas = [fila]
+        for mid in miembros:
+            propia = self._filas[mid]
+            # Columnas del corpus presentes en la fila (todas, o sólo el id en exp21/22).
+            base = {k: propia[k] for k in fila if k in self._columnas_base}
+            filas.append({**base, **resultado, COLUMNA_DUPLICADO: id_rep})
+        return filas
+
+    def copias(self, fila: dict) -> dict:
+        """{id: fila} de los duplicados de `fila` (para ColaTrabajo.completar)."""
+        return {str(f[self.col_id]): f for f in self.expandir(fila)[1:]}
+
+    def resumen(self, llamadas_por_articulo: int = 1) -> dict:
+        articulos = len(self._es_rep)
+        ahorrados = len(self._rep_de)
+        return {
+            "articulos": articulos,
+            "a_clasificar": articulos - ahorrados,
+            "grupos_duplicados": len(self._miembros),
+            "articulos_ahorrados": ahorrados,
+            "llamadas_ahorradas": ahorrados * llamadas_por_articulo,
+            "ahorro_pct": round(100 * ahorrados / articulos, 1) if articulos else 0.0,
+        }
+
+    def imprimir_resumen(self, llamadas_por_articulo: int = 1) -> None:
+        r = self.resumen(llamadas_por_articulo)
+        print(f"-> Duplicados exactos: {r['articulos_ahorrados']} artículos en "
+              f"{r['grupos_duplicados']} grupos · se clasifican {r['a_clasificar']} de "
+              f"{r['articulos']} ({r['ahorro_pct']}% menos, ~{r['llamadas_ahorradas']} llamadas).")
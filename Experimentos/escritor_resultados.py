@@ -0,0 +1,313 @@
+"""
+Sumidero de resultados con diario JSONL, búfer acotado y volcado en segundo plano.
+
+Los runners guardaban cada artículo con `pd.DataFrame([fila]).to_csv(mode="a")`
+bajo un lock global: construir un DataFrame por fila y serializar a todos los
+workers detrás del lock se nota a partir de ~16 workers, y los CSV con
+explicaciones multilínea son lentos y frágiles de releer.
+
+Aquí escribir() sólo encola la fila (bloquea únicamente si el búfer de
+MAX_BUFFER filas está lleno) y un hilo de fondo:
+  1. la añade al diario `<salida>.jsonl` (append-only, fsync por tanda): es la
+     copia a prueba de caídas.
+  2. anota sus ids en el índice `<salida>.ids` (indice_completados.py) tras el
+     fsync del diario: la fila cuenta como hecha sólo cuando está en el índice,
+     y la reanudación (ids()) y los scripts de estado leen sólo el índice.
+  3. cada FILAS_POR_PARTE filas escribe una parte Parquet en `<salida>.parquet/`
+     (si pyarrow está instalado).
+Al abrir se repara el diario (se descarta lo escrito después de la última
+entrada del índice) y se regeneran las partes Parquet que faltasen tras una caída. El CSV sólo se escribe
+bajo demanda (exportar_csv(), que los runners llaman al cerrar para que
+merge_shards/metrics sigan leyendo el mismo fichero).
+
+Si `<salida>.csv` ya existe de una corrida anterior sin diario, se importa al
+diario la primera vez: la reanudación sigue funcionando.
+
+leer_salida() lee una salida sin abrir un escritor (merge_shards.py): el CSV si
+está al día o, si no (shard caído o aún corriendo), las filas confirmadas del diario.
+
+Uso:
+    with EscritorResultados("results/exp_shard0de2.csv") as escritor:
+        hechos = escritor.ids()
+        escritor.escribir(fila)          # desde cualquier hilo
+    # al salir: vacía el búfer, cierra la última parte y exporta el CSV
+"""
+from __future__ import annotations
+
+import importlib.util
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from indice_completados import IndiceCompletados, ruta_indice
+
+MAX_BUFFER = 1000           # filas en memoria antes de frenar a los workers
+FILAS_POR_PARTE = 500       # filas por fichero Parquet
+INTERVALO_VOLCADO = 2.0     # segundos máximos que una fila espera en el búfer
+
+_FIN = object()
+
+
+def _a_json(valor):
+    # Escalares de numpy/pandas (int64, Timestamp...) que json no serializa.
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+
+def _hay_pyarrow() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+class EscritorResultados:
+    """Filas → diario JSONL (+ partes Parquet) desde un hilo de fondo; seguro entre hilos."""
+
+    def __init__(self, ruta_csv: str | Path, parquet: bool = True,
+                 max_buffer: int = MAX_BUFFER, filas_por_parte: int = FILAS_POR_PARTE,
+                 intervalo: float = INTERVALO_VOLCADO, columna_id: str = "IdNoticia"):
+        self.ruta_csv = Path(ruta_csv)
+        self.columna_id = columna_id
+        self.indice = IndiceCompletados(ruta_indice(self.ruta_csv))
+        self.ruta_diario = self.ruta_csv.with_suffix(".jsonl")
+        self.dir_parquet = self.ruta_csv.with_suffix(".parquet")
+        self.parquet = parquet and _hay_pyarrow()
+        if parquet and not self.parquet:
+            print("[escritor] pyarrow no instalado: sólo diario JSONL (+ CSV al exportar).")
+        self.filas_por_parte = filas_por_parte
+        self.intervalo = intervalo
+        self._cola: queue.Queue = queue.Queue(maxsize=max_buffer)
+        self._error: Optional[BaseException] = None
+        self._cerrado = False
+        self.ruta_csv.parent.mkdir(parents=True, exist_ok=True)
+
+        self._importar_csv_previo()
+        self._n_diario, self._offset = self._reparar_diario()
+        self._pendientes_parquet: list = []
+        self._n_partes = 0
+        if self.parquet:
+            self._recuperar_partes()
+        self._diario = open(self.ruta_diario, "ab")
+        self._hilo = threading.Thread(target=self._bucle, daemon=True, name="escritor-resultados")
+        self._hilo.start()
+
+    # --- apertura / recuperación ---
+    def _importar_csv_previo(self) -> None:
+        if self.ruta_diario.exists() or not self.ruta_csv.is_file():
+            return
+        try:
+            previo = pd.read_csv(self.ruta_csv)
+        except pd.errors.EmptyDataError:
+            return
+        entradas, offset = [], 0
+        with open(self.ruta_diario, "wb") as f:
+            for fila in previo.to_dict("records"):
+                linea = (json.dumps(fila, ensure_ascii=False, default=_a_json) + "\n").encode("utf-8")
+                f.write(linea)
+                offset += len(linea)
+                entradas.append((fila.get(self.columna_id), offset, ""))
+        self.indice.ruta.unlink(missing_ok=True)
+        self.indice.anotar(entradas)
+        print(f"[escritor] {len(previo)} filas de {self.ruta_csv.name} importadas al diario.")
+
+    def _reparar_diario(self) -> tuple[int, int]:
+        """
+        Deja el diario en lo confirmado por el índice (lo posterior, de una caída entre
+        ambos fsync, se descarta y se reprocesa). Devuelve (nº de filas, tamaño en bytes).
+        """
+        if not self.ruta_diario.exists():
+            self.indice.ruta.unlink(missing_ok=True)
+            return 0, 0
+        if not self.indice.existe():
+            return self._indexar_diario()
+        confirmado = self.indice.reparar()
+        with open(self.ruta_diario, "rb+") as f:
+            tam = f.seek(0, os.SEEK_END)
+            if tam > confirmado:
+                f.truncate(confirmado)
+            elif tam < confirmado:
+                # Diario más corto que el índice (copiado a medias): se reindexa entero.
+                self.indice.ruta.unlink()
+                return self._indexar_diario()
+        return self.indice.contar(), confirmado
+
+    def _indexar_diario(self) -> tuple[int, int]:
+        """Diario sin índice (versión anterior del escritor): una pasada completa, una vez."""
+        entradas, offset = [], 0
+        with open(self.ruta_diario, "rb+") as f:
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break
+                offset += len(linea)
+                if linea.strip():
+                    entradas.append((json.loads(linea).get(self.columna_id), offset, ""))
+            f.truncate(offset)
+        self.indice.anotar(entradas)
+        return len(entradas), offset
+
+    def _recuperar_partes(self) -> None:
+        import pyarrow.parquet as pq
+        self.dir_parquet.mkdir(exist_ok=True)
+        partes = sorted(self.dir_parquet.glob("part-*.parquet"))
+        self._n_partes = len(partes)
+        en_partes = sum(pq.read_metadata(p).num_rows for p in partes)
+        if en_partes < self._n_diario:
+            # Filas del diario que no llegaron a Parquet antes de la caída.
+            faltan = list(self.filas())[en_partes:]
+            for i in range(0, len(faltan), self.filas_por_parte):
+                self._escribir_parte(faltan[i:i + self.filas_por_parte])
+
+    # --- escritura ---
+    def escribir(self, fila: dict, etiqueta: str = "") -> None:
+        """
+        Encola una fila (copia superficial). Sólo bloquea si el búfer está lleno.
+        `etiqueta` se guarda en el índice (p. ej. "error") para que los scripts de
+        estado la cuenten sin leer las filas.
+        """
+        if self._error is not None:
+            raise RuntimeError("El hilo de escritura de resultados ha fallado") from self._error
+        if self._cerrado:
+            raise RuntimeError("EscritorResultados ya está cerrado")
+        self._cola.put((dict(fila), etiqueta))
+
+    def _bucle(self) -> None:
+        try:
+            fin = False
+            while not fin:
+                try:
+                    tanda = [self._cola.get(timeout=self.intervalo)]
+                except queue.Empty:
+                    continue
+                while True:
+                    try:
+                        tanda.append(self._cola.get_nowait())
+                    except queue.Empty:
+                        break
+                if tanda[-1] is _FIN:
+                    tanda.pop()
+                    fin = True
+                self._volcar(tanda, final=fin)
+        except BaseException as e:
+            self._error = e
+            print(f"[escritor] error en el hilo de escritura: {type(e).__name__}: {e}")
+            # Sigue drenando para que los workers no se queden bloqueados en put().
+            while self._cola.get() is not _FIN:
+                pass
+
+    def _volcar(self, tanda: list, final: bool = False) -> None:
+        filas = [fila for fila, _ in tanda]
+        if tanda:
+            lineas = [(json.dumps(fila, ensure_ascii=False, default=_a_json) + "\n").encode("utf-8")
+                      for fila in filas]
+            self._diario.write(b"".join(lineas))
+            self._diario.flush()
+            os.fsync(self._diario.fileno())
+            entradas = []
+            for (fila, etiqueta), linea in zip(tanda, lineas):
+                self._offset += len(linea)
+                entradas.append((fila.get(self.columna_id), self._offset, etiqueta))
+            self.indice.anotar(entradas)  # confirma la tanda
+            self._n_diario += len(tanda)
+        if not self.parquet:
+            return
+        self._pendientes_parquet.extend(filas)
+        while len(self._pendientes_parquet) >= self.filas_por_parte:
+            self._escribir_parte(self._pendientes_parquet[:self.filas_por_parte])
+            del self._pendientes_parquet[:self.filas_por_parte]
+        if final and self._pendientes_parquet:
+            self._escribir_parte(self._pendientes_parquet)
+            self._pendientes_parquet = []
+
+    def _escribir_parte(self, filas: list) -> None:
+        df = pd.DataFrame(filas)
+        ruta = self.dir_parquet / f"part-{self._n_partes:05d}.parquet"
+        tmp = ruta.with_suffix(".tmp")
+        try:
+            df.to_parquet(tmp, index=False)
+        except Exception:
+            # Columnas object con tipos mezclados (int y str): se guardan como texto.
+            for col in df.columns[df.dtypes == object]:
+                df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) else str(v))
+            df.to_parquet(tmp, index=False)
+        os.replace(tmp, ruta)  # una parte a medias nunca queda con nombre definitivo
+        self._n_partes += 1
+
+    def cerrar(self, exportar_csv: bool = True) -> None:
+        """Vacía el búfer, cierra la última parte y (por defecto) exporta el CSV."""
+        if self._cerrado:
+            return
+        self._cerrado = True
+        self._cola.put(_FIN)
+        self._hilo.join()
+        self._diario.close()
+        if self._error is not None:
+            raise RuntimeError("El hilo de escritura de resultados ha fallado") from self._error
+        if exportar_csv:
+            self.exportar_csv()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
+
+    # --- lectura ---
+    def filas(self) -> Iterator[dict]:
+        """Filas del diario en orden de escritura (sólo las ya volcadas)."""
+        if not self.ruta_diario.exists():
+            return
+        with open(self.ruta_diario, encoding="utf-8") as f:
+            for linea in f:
+                if not linea.endswith("\n"):
+                    break  # línea que el hilo de fondo aún está escribiendo
+                if linea.strip():
+                    yield json.loads(linea)
+
+    def ids(self) -> set:
+        """Valores de `columna_id` ya confirmados (como str), para reanudar; lee sólo el índice."""
+        return self.indice.ids()
+
+    def leer(self) -> pd.DataFrame:
+        return pd.DataFrame(list(self.filas()))
+
+    def exportar_csv(self, ruta: Optional[str | Path] = None) -> Path:
+        """Escribe el CSV completo a partir del diario (atómico: tmp + rename)."""
+        ruta = Path(ruta) if ruta else self.ruta_csv
+        tmp = ruta.with_suffix(ruta.suffix + ".tmp")
+        t0 = time.time()
+        self.leer().to_csv(tmp, index=False, encoding="utf-8")
+        os.replace(tmp, ruta)
+        print(f"[escritor] CSV exportado: {ruta} ({self._n_diario} filas, {time.time() - t0:.1f}s)")
+        return ruta
+
+
+def filas_confirmadas(ruta_salida: str | Path) -> Iterator[dict]:
+    """Filas del diario de una salida hasta la última confirmada en su índice."""
+    ruta_diario = Path(ruta_salida).with_suffix(".jsonl")
+    confirmado = IndiceCompletados(ruta_indice(ruta_salida)).offset_confirmado()
+    if not confirmado or not ruta_diario.exists():
+        return
+    leido = 0
+    with open(ruta_diario, "rb") as f:
+        for linea in f:
+            leido += len(linea)
+            if leido > confirmado:
+                break  # escrito tras el último fsync del índice: no confirmado
+            if linea.strip():
+                yield json.loads(linea)
+
+
+def leer_salida(ruta_salida: str | Path) -> pd.DataFrame:
+    """El CSV exportado de una salida o, si falta o es anterior al índice, sus filas confirmadas."""
+    ruta_csv = Path(ruta_salida)
+    ruta_ids = ruta_indice(ruta_csv)
+    if ruta_csv.is_file() and not (
+            ruta_ids.exists() and ruta_ids.stat().st_mtime > ruta_csv.stat().st_mtime):
+        return pd.read_csv(ruta_csv)
+    filas = list(filas_confirmadas(ruta_csv))
+    print(f"[escritor] {ruta_csv.name} sin exportar: {len(filas)} filas del diario")
+    return pd.DataFrame(filas)
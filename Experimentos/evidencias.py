@@ -0,0 +1,174 @@
+"""
+Verificación de evidencias contra el texto del artículo, con offsets de carácter.
+
+Los clasificadores comprobaban cada evidencia con `e in texto`. Eso rechaza citas
+correctas que el modelo reescribe al copiarlas: comillas tipográficas ↔ rectas
+(y variables.py cambia " por ' antes de construir el prompt), guiones largos,
+saltos de línea colapsados, una tilde perdida o una mayúscula inicial. Además
+no devolvía posiciones, así que el resaltado tenía que volver a buscar cada cita.
+
+Aquí se construye un índice por artículo (compartido por sus 5 variables, en
+caché) y cada evidencia se busca en tres pasos, del más barato al más caro:
+  1. literal: texto.find(evidencia), sin normalizar nada;
+  2. normalizada: comillas → ', guiones → -, espacios colapsados, sin tildes y en
+     minúsculas, en ambos lados; el texto normalizado guarda para cada carácter su
+     posición en el original, así que el span se traduce al texto real;
+  3. aproximada (acotada): distancia de edición <= TOLERANCIA·len, hasta
+     MAX_ERRORES. Con k errores, alguno de los k+1 trozos del patrón aparece
+     intacto (palomar); sólo se alinean las ventanas donde aparece un trozo.
+
+Una evidencia válida se devuelve como el fragmento LITERAL del artículo
+(texto[ini:fin]), no como la escribió el modelo.
+
+Uso:
+    idx = indice(texto)                 # una vez por artículo
+    c = idx.buscar("la presidenta dijo")
+    if c:
+        print(c.ini, c.fin, idx.literal(c))
+    idx.verificar(["...", "..."])        # {"validas", "invalidas", "spans"}
+"""
+from __future__ import annotations
+
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+TOLERANCIA = 0.1          # errores admitidos por carácter de la evidencia (0 = sin aproximada)
+MAX_ERRORES = 8           # tope absoluto de la distancia de edición
+MIN_APROXIMADA = 20       # evidencias más cortas sólo se aceptan exactas (tras normalizar)
+MAX_APROXIMADA = 400      # ni más largas (la alineación es cuadrática)
+MAX_VENTANAS = 32         # ventanas candidatas alineadas por evidencia
+
+_TABLA = {**dict.fromkeys(map(ord, "\"'`´‘’‚‛“”„‟«»‹›′″"), "'"),
+          **dict.fromkeys(map(ord, "‐‑‒–—―−"), "-")}
+
+
+def normalizar(texto: str) -> tuple[str, list[int]]:
+    """(texto normalizado, posición en el original de cada uno de sus caracteres)."""
+    chars: list[str] = []
+    origen: list[int] = []
+    espacio = -1                         # inicio del hueco de espacios pendiente
+    for i, c in enumerate(texto):
+        partes = c if c.isascii() else unicodedata.normalize("NFKD", c)
+        for d in partes.translate(_TABLA).lower():
+            if d.isspace():
+                if espacio < 0:
+                    espacio = i
+            elif not unicodedata.combining(d):
+                if espacio >= 0 and chars:
+                    chars.append(" ")
+                    origen.append(espacio)
+                espacio = -1
+                chars.append(d)
+                origen.append(i)
+    return "".join(chars), origen
+
+
+def _alinear(patron: str, ventana: str, k: int) -> Optional[tuple[int, int]]:
+    """(distancia, fin) del encaje más largo de menor coste de `patron` en `ventana`; None si > k."""
+    prev = [0] * (len(ventana) + 1)          # inicio libre en la ventana
+    for i, pc in enumerate(patron, 1):
+        cur = [i]
+        for j, vc in enumerate(ventana, 1):
+            cur.append(min(prev[j - 1] + (pc != vc), prev[j] + 1, cur[j - 1] + 1))
+        if min(cur) > k:                     # ninguna fila posterior baja de aquí
+            return None
+        prev = cur
+    d = min(prev)
+    # Con empate, el fin más lejano: una errata en la última palabra no debe recortarla.
+    return d, len(prev) - 1 - prev[::-1].index(d)
+
+
+@dataclass(frozen=True)
+class Coincidencia:
+    ini: int              # offsets en el texto ORIGINAL (slice texto[ini:fin])
+    fin: int
+    distancia: int        # 0 = exacta (literal o tras normalizar)
+    sin_normalizar: bool  # encontrada tal cual en el texto
+
+
+class IndiceEvidencias:
+    """Texto de un artículo con su versión normalizada (perezosa) para buscar evidencias."""
+
+    def __init__(self, texto: str):
+        self.texto = texto
+        self._norm: Optional[tuple[str, list[int]]] = None
+
+    def _normalizado(self) -> tuple[str, list[int]]:
+        if self._norm is None:
+            self._norm = normalizar(self.texto)
+        return self._norm
+
+    def _span(self, ini: int, fin: int, distancia: int) -> Coincidencia:
+        origen = self._normalizado()[1]
+        return Coincidencia(origen[ini], origen[fin - 1] + 1, distancia, False)
+
+    def buscar(self, evidencia: str) -> Optional[Coincidencia]:
+        if not evidencia or not isinstance(evidencia, str):
+            return None
+        i = self.texto.find(evidencia)
+        if i >= 0:
+            return Coincidencia(i, i + len(evidencia), 0, True)
+        patron = normalizar(evidencia)[0]
+        if not patron:
+            return None
+        norm = self._normalizado()[0]
+        j = norm.find(patron)
+        if j >= 0:
+            return self._span(j, j + len(patron), 0)
+        return self._aproximada(patron, norm)
+
+    def _aproximada(self, patron: str, norm: str) -> Optional[Coincidencia]:
+        m = len(patron)
+        k = min(MAX_ERRORES, int(m * TOLERANCIA))
+        if k == 0 or not MIN_APROXIMADA <= m <= MAX_APROXIMADA:
+            return None
+        trozo = m // (k + 1)
+        vistos: set[int] = set()
+        mejor: Optional[tuple[int, int, int]] = None          # (distancia, ini, fin) en norm
+        for p in range(0, trozo * (k + 1), trozo):
+            pieza = patron[p:p + trozo]
+            pos = norm.find(pieza)
+            while pos >= 0 and len(vistos) < MAX_VENTANAS:
+                t = pos - p                                   # inicio si no hubiera errores
+                if t not in vistos:
+                    vistos.add(t)
+                    a, b = max(0, t - k), min(len(norm), t + m + k)
+                    r = _alinear(patron, norm[a:b], k if mejor is None else mejor[0] - 1)
+                    if r is not None:
+                        d, fin = r
+                        # El inicio sale de alinear al revés lo que acaba en `fin`.
+                        largo = _alinear(patron[::-1], norm[a:a + fin][::-1], d)[1]
+                        mejor = (d, a + fin - largo, a + fin)
+                        if d == 1:
+                            return self._span(mejor[1], mejor[2], d)
+                pos = norm.find(pieza, pos + 1)
+        return self._span(mejor[1], mejor[2], mejor[0]) if mejor else None
+
+    def literal(self, c: Coincidencia) -> str:
+        return self.texto[c.ini:c.fin]
+
+    def verificar(self, evidencias: list) -> dict:
+        """{"validas": [fragmentos literales], "invalidas": [...], "spans": [[ini, fin], ...]}."""
+        validas, invalidas, spans = [], [], []
+        for e in evidencias:
+            if not e:
+                continue
+            c = self.buscar(e)
+            if c is None:
+                invalidas.append(e)
+            else:
+                validas.append(self.literal(c))
+                spans.append([c.ini, c.fin])
+        return {"validas": validas, "invalidas": invalidas, "spans": spans}
+
+
+@lru_cache(maxsize=64)
+def indice(texto: str) -> IndiceEvidencias:
+    """Índice del artículo; las 5 variables (hilos) del mismo texto comparten uno."""
+    return IndiceEvidencias(texto)
+
+
+def verificar(evidencias: list, texto: str) -> dict:
+    return indice(texto).verificar(evidencias)
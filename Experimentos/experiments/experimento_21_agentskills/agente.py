@@ -12,7 +12,8 @@ Un agente = una variable. Bucle de decisión estilo ReAct sobre acciones de text
   - Si el modelo emite FINAL sin usar ninguna skill, se registra "colapso a B0".
 
 Métrica de comportamiento devuelta en `traza`: nº de tools, skills cargadas,
-si colapsó a B0. Sirve para el Cap. 5 (uso real de tools por proveedor).
+si colapsó a B0. Sirve para el Cap. 5 (uso real de tools por proveedor). El
+consumo se acumula por agente y queda además desglosado por turno en traza["turnos"].
 """
 
 from __future__ import annotations
@@ -29,8 +30,9 @@ for p in (str(EXPERIMENTOS_DIR), str(EXP_DIR)):
     if p not in sys.path:
         sys.path.insert(0, p)
 
-from utils import IRIS_CACHE_BREAK, consultar_ollama, get_consumo_llamada  # noqa: E402
+from utils import IRIS_CACHE_BREAK, consultar_chat, consultar_ollama, get_consumo_llamada  # noqa: E402
 import tools  # noqa: E402
+import evidencias as evidencias_idx  # noqa: E402
 import guias  # noqa: E402
 import costes  # noqa: E402
 
@@ -75,9 +77,25 @@ _BLOQUE_GUIA = """  CONSULTAR_GUIA: <consulta en lenguaje natural>
 
 # Ablación de prompt caching: si es True se inserta IRIS_CACHE_BREAK, que además de
 # habilitar la caché reestructura el prompt (prefijo→system, sufijo→user). Ese cambio
-# de estructura altera el comportamiento del agente: ver DIARIO/Cap.5.
+# de estructura altera el comportamiento del agente: ver DIARIO/Cap.5. Con
+# TRANSPORTE_CHAT sólo decide si se marcan cortes cache_control (Anthropic).
 USAR_PROMPT_CACHE = True
 
+# Transporte del bucle B1: True → conversación multi-turno (utils.consultar_chat), cada
+# turno envía sólo lo nuevo y el proveedor reutiliza el prefijo ya visto. False →
+# transporte anterior: system + historial entero como un único prompt en cada turno
+# (los tokens de entrada crecen de forma cuadrática con el nº de turnos).
+TRANSPORTE_CHAT = True
+
+# Precarga de skills (precarga.py): {variable: [skills]} aprendido de trazas previas.
+# Esas skills entran ya leídas en el primer turno y ahorran los LEER_SKILL iniciales.
+# None → sin precarga (el agente lo carga todo por sí mismo).
+PRECARGA: dict | None = None
+
+# B0 en Ollama: generación en streaming cortada al cerrar el objeto FINAL (el resto
+# de la salida no se usa y cuesta tiempo de GPU). False → respuesta completa.
+CORTE_TEMPRANO = True
+
 
 def _cache_break() -> str:
     return IRIS_CACHE_BREAK if USAR_PROMPT_CACHE else "\n\n"
@@ -98,31 +116,30 @@ Aplica esa metodología al texto y responde con UNA sola línea, exactamente en
 No añadas nada más. No mezcles otras variables."""
 
 
-def clasificar_variable_baseline(
+def prompt_baseline(variable: str, texto: str) -> str:
+    """Prompt B0 de `variable` (metodología inyectada). Compartido con el modo lote."""
+    system = SYSTEM_BASELINE.format(
+        variable=variable, metodologia=tools.read_skill(variable))
+    return (system + "\n\n=== TEXTO A CLASIFICAR ===\n" + texto
+            + "\n=== FIN TEXTO ===\n\nTu respuesta:")
+
+
+def interpretar_baseline(
     variable: str,
     texto: str,
-    modelo: str = "claude-haiku-4-5-20251001",
-    temperature: float = 0.1,
+    modelo: str,
+    salida: str,
+    consumo: dict,
     verbose: bool = False,
 ) -> tuple[dict, dict]:
-    """
-    Nivel B0: misma tarea y mismas 5 llamadas, pero la metodología va INYECTADA en el
-    prompt (sin progressive disclosure, sin tools). Única diferencia frente a B1.
-    """
-    system = SYSTEM_BASELINE.format(
-        variable=variable, metodologia=tools.read_skill(variable))
+    """Convierte la respuesta B0 (y su consumo) en (resultado, traza)."""
     traza = {"skills_cargadas": [], "guias_consultadas": [], "n_tools": 0,
              "verifico": False, "colapso_b0": True, "iters": 1, "error": None,
              "prompt_tokens": 0, "completion_tokens": 0, "cache_read_tokens": 0,
              "cache_creation_tokens": 0, "n_llamadas": 0, "coste_usd": None}
-
-    prompt = (system + "\n\n=== TEXTO A CLASIFICAR ===\n" + texto
-              + "\n=== FIN TEXTO ===\n\nTu respuesta:")
-    salida = consultar_ollama(prompt, modelo=modelo, temperature=temperature)
-    c = get_consumo_llamada()
     for k in ("prompt_tokens", "completion_tokens", "cache_read_tokens",
               "cache_creation_tokens"):
-        traza[k] += c.get(k, 0)
+        traza[k] += consumo.get(k, 0)
     traza["n_llamadas"] = 1
     if verbose:
         print(f"[B0 {variable}] {salida[:200]}")
@@ -130,7 +147,8 @@ def clasificar_variable_baseline(
     accion, arg = _parse_accion(salida)
     traza["coste_usd"] = costes.calcular_coste(
         modelo, traza["prompt_tokens"], traza["completion_tokens"],
-        traza["cache_read_tokens"], traza["cache_creation_tokens"])
+        traza["cache_read_tokens"], traza["cache_creation_tokens"],
+        lote=bool(consumo.get("lote")))
     if accion == "FINAL":
         return _sanear_resultado(arg, texto), traza
     traza["error"] = "sin_final"
@@ -138,6 +156,24 @@ def clasificar_variable_baseline(
             "evidencias": []}, traza
 
 
+def clasificar_variable_baseline(
+    variable: str,
+    texto: str,
+    modelo: str = "claude-haiku-4-5-20251001",
+    temperature: float = 0.1,
+    verbose: bool = False,
+) -> tuple[dict, dict]:
+    """
+    Nivel B0: misma tarea y mismas 5 llamadas, pero la metodología va INYECTADA en el
+    prompt (sin progressive disclosure, sin tools). Única diferencia frente a B1.
+    """
+    salida = consultar_ollama(prompt_baseline(variable, texto), modelo=modelo,
+                              temperature=temperature,
+                              cortar_en="final" if CORTE_TEMPRANO else None)
+    return interpretar_baseline(variable, texto, modelo, salida,
+                                get_consumo_llamada(), verbose=verbose)
+
+
 def _catalogo_ids(variable: str) -> list[str]:
     ids = [variable] + list(tools.SKILLS_AUXILIARES)
     if INCLUIR_RESUMENES_GUIAS:
@@ -191,24 +227,55 @@ def clasificar_variable(
         variable=variable, catalogo=_construir_catalogo(variable),
         bloque_guia=_BLOQUE_GUIA if HABILITAR_CONSULTAR_GUIA else "")
     permitidas = _permitidas(variable)
-    historial = [f"=== TEXTO A CLASIFICAR ===\n{texto}\n=== FIN TEXTO ==="]
+    texto_bloque = f"=== TEXTO A CLASIFICAR ===\n{texto}\n=== FIN TEXTO ==="
+    historial = [texto_bloque]   # prompt plano: todo lo visto, se reenvía en cada turno
+    pendiente = [texto_bloque]   # chat: observaciones aún no enviadas al modelo
+    mensajes: list[dict] = []
 
     traza = {"skills_cargadas": [], "guias_consultadas": [], "n_tools": 0,
              "verifico": False, "colapso_b0": False, "iters": 0, "error": None,
              "prompt_tokens": 0, "completion_tokens": 0, "cache_read_tokens": 0,
-             "cache_creation_tokens": 0, "n_llamadas": 0, "coste_usd": None}
-
-    def _llamar(prompt_txt: str) -> str:
-        """Llama al modelo y acumula el consumo de tokens en la traza."""
-        salida = consultar_ollama(prompt_txt, modelo=modelo, temperature=temperature)
+             "cache_creation_tokens": 0, "n_llamadas": 0, "coste_usd": None, "turnos": [],
+             "skills_precargadas": []}
+
+    def _llamar(instruccion: str) -> str:
+        """Un turno del modelo; acumula su consumo de tokens en la traza."""
+        if TRANSPORTE_CHAT:
+            mensajes.append({"role": "user", "content": "\n\n".join(pendiente) + instruccion})
+            pendiente.clear()
+            salida = consultar_chat(system, mensajes, modelo=modelo, temperature=temperature,
+                                    cache=USAR_PROMPT_CACHE)
+            # Las APIs rechazan turnos vacíos: un fallo de llamada queda registrado así.
+            mensajes.append({"role": "assistant", "content": salida or "(sin respuesta)"})
+        else:
+            # Prompt caching: el corte va al final del historial acumulado. Cada iteración
+            # reutiliza como prefijo cacheado todo lo anterior (system + texto + SKILL.md
+            # ya cargados), que es donde está el grueso de tokens.
+            salida = consultar_ollama(system + "\n\n" + "\n\n".join(historial)
+                                      + _cache_break() + instruccion,
+                                      modelo=modelo, temperature=temperature)
         c = get_consumo_llamada()
-        traza["prompt_tokens"] += c.get("prompt_tokens", 0)
-        traza["completion_tokens"] += c.get("completion_tokens", 0)
-        traza["cache_read_tokens"] += c.get("cache_read_tokens", 0)
-        traza["cache_creation_tokens"] += c.get("cache_creation_tokens", 0)
+        turno = {k: c.get(k, 0) for k in ("prompt_tokens", "completion_tokens",
+                                          "cache_read_tokens", "cache_creation_tokens")}
+        for k, v in turno.items():
+            traza[k] += v
+        traza["turnos"].append(turno)
         traza["n_llamadas"] += 1
         return salida
 
+    def _anotar(accion: str, resultado: str) -> None:
+        # En chat la acción ya está en el turno del modelo: sólo se añade el resultado.
+        historial.extend([accion, resultado] if accion else [resultado])
+        pendiente.append(resultado)
+
+    precargadas = [sk for sk in (PRECARGA or {}).get(variable, []) if sk in permitidas]
+    if precargadas:
+        for sk in precargadas:
+            _anotar(f"[Acción] LEER_SKILL: {sk}", f"[Resultado skill {sk}]\n{tools.read_skill(sk)}")
+        _anotar("", f"[Sistema] Ya tienes cargadas: {', '.join(precargadas)}. No hace falta "
+                    "volver a pedirlas.")
+        traza["skills_precargadas"] = precargadas
+
     def _cerrar(resultado_raw):
         traza["coste_usd"] = costes.calcular_coste(
             modelo, traza["prompt_tokens"], traza["completion_tokens"],
@@ -222,48 +289,40 @@ def clasificar_variable(
         if i >= MAX_ITERS - 2:
             cierre = ("\n\n[Sistema] Te quedan pocos turnos. Con lo que ya sabes, responde "
                       "AHORA únicamente con `FINAL: {...}`. No cargues más skills.")
-        # Prompt caching: el corte va al final del historial acumulado. Cada iteración
-        # reutiliza como prefijo cacheado todo lo anterior (system + texto + SKILL.md
-        # ya cargados), que es donde está el grueso de tokens.
-        prompt = (system + "\n\n" + "\n\n".join(historial)
-                  + _cache_break() + cierre + "\n\nTu acción:")
-        salida = _llamar(prompt)
+        salida = _llamar(cierre + "\n\nTu acción:")
         if verbose:
             print(f"[{variable} iter {i}] {salida[:200]}")
         accion, arg = _parse_accion(salida)
 
         if accion == "LEER_SKILL":
             traza["n_tools"] += 1
-            cuerpo = tools.read_skill(arg, permitidas=permitidas)
+            if arg in precargadas:
+                cuerpo = "(ya está más arriba en la conversación)"
+            else:
+                cuerpo = tools.read_skill(arg, permitidas=permitidas)
             traza["skills_cargadas"].append(arg)
-            historial.append(f"[Acción] LEER_SKILL: {arg}")
-            historial.append(f"[Resultado skill {arg}]\n{cuerpo}")
+            _anotar(f"[Acción] LEER_SKILL: {arg}", f"[Resultado skill {arg}]\n{cuerpo}")
         elif accion == "CONSULTAR_GUIA" and HABILITAR_CONSULTAR_GUIA:
             traza["n_tools"] += 1
             traza["guias_consultadas"].append(arg)
             pasajes = guias.consultar_guia(arg, k=2)
-            historial.append(f"[Acción] CONSULTAR_GUIA: {arg}")
-            historial.append(f"[Pasajes de guías]\n{pasajes}")
+            _anotar(f"[Acción] CONSULTAR_GUIA: {arg}", f"[Pasajes de guías]\n{pasajes}")
         elif accion == "VERIFICAR":
             traza["n_tools"] += 1
             traza["verifico"] = True
             res = tools.verificar_evidencias(arg, texto)
-            historial.append(f"[Acción] VERIFICAR")
-            historial.append(f"[Resultado] válidas={res['validas']} inválidas={res['invalidas']}")
+            _anotar("[Acción] VERIFICAR",
+                    f"[Resultado] válidas={res['validas']} inválidas={res['invalidas']}")
         elif accion == "FINAL":
-            if traza["n_tools"] == 0:  # cerró sin usar ninguna tool → equivalente a B0
+            if traza["n_tools"] == 0 and not precargadas:  # sin tools ni precarga → B0
                 traza["colapso_b0"] = True
             return _cerrar(arg)
         else:  # FINAL_MALO / DESCONOCIDO
-            historial.append(
-                "[Sistema] Acción no reconocida. Responde con LEER_SKILL:, VERIFICAR: o FINAL:."
-            )
+            _anotar("", "[Sistema] Acción no reconocida. Responde con LEER_SKILL:, VERIFICAR: o FINAL:.")
 
     # Presupuesto agotado sin FINAL: un último intento que SOLO pide el veredicto.
-    prompt = (system + "\n\n" + "\n\n".join(historial) + _cache_break() +
-              "\n\n[Sistema] Cierra ya. Responde EXCLUSIVAMENTE con "
-              "`FINAL: {\"codigo\": <n>, \"explicacion\": \"...\", \"evidencias\": [...]}`.")
-    salida = _llamar(prompt)
+    salida = _llamar("\n\n[Sistema] Cierra ya. Responde EXCLUSIVAMENTE con "
+                     "`FINAL: {\"codigo\": <n>, \"explicacion\": \"...\", \"evidencias\": [...]}`.")
     accion, arg = _parse_accion(salida)
     if accion == "FINAL":
         return _cerrar(arg)
@@ -280,11 +339,13 @@ def _sanear_resultado(res: Any, texto: str) -> dict:
     evidencias = res.get("evidencias") or []
     if not isinstance(evidencias, list):
         evidencias = [str(evidencias)]
-    # Evidencias contra el MISMO texto que vio el modelo (corrige bug exp16).
-    evidencias = [e for e in evidencias if e and e in texto]
+    # Evidencias contra el MISMO texto que vio el modelo (corrige bug exp16); se
+    # guardan como fragmento literal del texto, con sus offsets para resaltarlas.
+    verificadas = evidencias_idx.verificar(evidencias, texto)
     if codigo == 1:
-        evidencias = []
-    return {"codigo": codigo, "explicacion": res.get("explicacion", ""), "evidencias": evidencias}
+        verificadas = {"validas": [], "spans": []}
+    return {"codigo": codigo, "explicacion": res.get("explicacion", ""),
+            "evidencias": verificadas["validas"], "spans": verificadas["spans"]}
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ por artículo del Experimento 21. Editar según tarifas vigentes.
 
 `cache_read` se factura como input con descuento; si no se conoce, se asimila a input.
 Modelos locales (Ollama): coste 0 (self-hosted).
+Modo lote (batch API de OpenAI/Anthropic): se aplica DESCUENTO_LOTE sobre todo.
 """
 from __future__ import annotations
 
@@ -22,6 +23,8 @@ PRECIOS = {
     "gemini-3.1-flash-lite":  (0.25, 1.50, 0.025),
     "gemini-2.5-flash":       (0.30, 2.50, 0.075),
 }
+# Batch API: OpenAI y Anthropic facturan los lotes al 50 % de la tarifa interactiva.
+DESCUENTO_LOTE = 0.5
 LOCAL_HINTS = ("gemma", "qwen", "llama", "mistral", "deepseek", "phi")
 
 
@@ -34,8 +37,10 @@ def _tarifa(modelo: str) -> tuple[float, float, float] | None:
 
 
 def calcular_coste(modelo: str, prompt_tokens: int, completion_tokens: int,
-                   cache_read_tokens: int = 0, cache_creation_tokens: int = 0) -> float | None:
-    """Coste en USD de una acumulación de tokens. None si el modelo no tiene tarifa."""
+                   cache_read_tokens: int = 0, cache_creation_tokens: int = 0,
+                   lote: bool = False) -> float | None:
+    """Coste en USD de una acumulación de tokens. None si el modelo no tiene tarifa.
+    `lote`: tokens servidos por la batch API (se aplica DESCUENTO_LOTE)."""
     tarifa = _tarifa(modelo)
     if tarifa is None:
         return None
@@ -47,4 +52,6 @@ def calcular_coste(modelo: str, prompt_tokens: int, completion_tokens: int,
         + cache_creation_tokens * p_in
         + completion_tokens * p_out
     ) / 1_000_000
+    if lote:
+        coste *= DESCUENTO_LOTE
     return round(coste, 6)
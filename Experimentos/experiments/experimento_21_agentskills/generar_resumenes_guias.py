@@ -3,7 +3,7 @@
 Genera skills-resumen de las guías de lenguaje (Experimento 21).
 
 Para cada guía de `Experimentos/methodology/` relevante al sexismo lingüístico:
-  1. recupera pasajes representativos con el índice TF-IDF de guias.py,
+  1. recupera pasajes representativos con el índice BM25 de guias.py,
   2. los resume con un LLM a un SKILL.md auxiliar (reglas + ejemplos + recomendaciones),
   3. lo escribe en skills/<slug>/SKILL.md con frontmatter (name+description).
 
@@ -27,6 +27,7 @@ for p in (str(EXPERIMENTOS_DIR), str(EXP_DIR)):
 
 from utils import consultar_ollama  # noqa: E402
 import guias  # noqa: E402
+import tools  # noqa: E402
 from tools import SKILLS_DIR  # noqa: E402
 
 # Guías centradas en lenguaje no sexista (las de violencia/infancia se excluyen).
@@ -127,6 +128,7 @@ def main() -> int:
         destino.write_text(render_skill(slug, desc, cuerpo), encoding="utf-8")
         print(f"  · {destino.relative_to(EXP_DIR)}  ({len(cuerpo)} chars)")
     print("Recuerda: añade los slugs a SKILLS_AUXILIARES en tools.py si quieres que el agente los vea.")
+    print(f"Snapshot del registro: {tools.escribir_snapshot().relative_to(EXP_DIR)}")
     return 0
 
 
@@ -29,6 +29,7 @@ from utils import (  # noqa: E402
     cargar_variables_desde_json,
     obtener_config_variable,
 )
+import tools  # noqa: E402
 from tools import SKILLS_DIR, SKILLS_VARIABLE  # noqa: E402
 
 
@@ -99,6 +100,7 @@ def main() -> int:
         destino.write_text(render_skill_md(config, args.json.name), encoding="utf-8")
         print(f"  · {destino.relative_to(EXP_DIR)}")
     print("Skills auxiliares (guia_*, verificar_evidencias) NO se tocan (manuales).")
+    print(f"Snapshot del registro: {tools.escribir_snapshot().relative_to(EXP_DIR)}")
     return 0
 
 
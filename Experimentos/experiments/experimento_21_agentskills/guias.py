@@ -2,18 +2,38 @@
 Recuperación (RAG ligero) sobre las guías de lenguaje reales de
 Experimentos/methodology/ (las listadas en methodology_manifest.json).
 
-Sin dependencias externas: índice TF-IDF en memoria sobre trozos de las guías,
+Sin dependencias externas: índice invertido BM25 sobre trozos de las guías,
 troceados por encabezados Markdown. Permite que el agente consulte pasajes
 literales de las guías expertas en runtime (tool `consultar_guia`), con cita
 de fichero + sección. La tesis NO se indexa (no está en el manifest `guides`).
+
+CONSULTAR_GUIA está en el camino crítico de cada turno B1, y antes cada proceso
+(shard, worker) re-tokenizaba todo methodology/ al arrancar y cada consulta
+recorría todos los trozos. Ahora:
+  - el índice se construye una vez y se guarda en DIR_INDICE/guias_<huella>.bm25,
+    con la huella calculada sobre el manifest, el contenido de las guías y los
+    parámetros (cualquier cambio genera otro fichero);
+  - cada lista de postings guarda (trozo, peso BM25 ya calculado): idf y
+    normalización por longitud van precalculados, y puntuar es sólo sumar;
+  - el fichero se abre con mmap: los procesos comparten las páginas y una
+    consulta sólo lee las postings de sus términos.
+
+Formato: MAGIA · uint32 longitud · cabecera JSON (vocabulario {término: [inicio,
+n]}, trozos) · relleno a 8 bytes · ids uint32 · pesos float32 (orden nativo).
 """
 from __future__ import annotations
 
+import array
+import hashlib
 import json
 import math
+import mmap
+import os
 import re
+import struct
+import sys
+import threading
 import unicodedata
-from functools import lru_cache
 from pathlib import Path
 
 METHODOLOGY_DIR = Path(__file__).resolve().parent.parent.parent / "methodology"
@@ -21,6 +41,12 @@ MANIFEST = METHODOLOGY_DIR / "methodology_manifest.json"
 
 MAX_CHUNK_CHARS = 1500
 
+# BM25 (Robertson/Spärck Jones) con los parámetros habituales.
+K1 = 1.2
+B = 0.75
+DIR_INDICE = Path(__file__).resolve().parent / ".cache"
+_MAGIA = b"GUIASBM25v1\0"
+
 _STOPWORDS = {
     "para", "como", "pero", "sus", "con", "una", "uno", "los", "las", "del",
     "que", "por", "mas", "muy", "sin", "sobre", "entre", "cuando", "donde",
@@ -64,42 +90,123 @@ def _trocear(texto: str, fuente: str) -> list[dict]:
     return chunks
 
 
-@lru_cache(maxsize=1)
-def _indice() -> tuple:
-    """Construye (chunks, tokens_por_chunk, idf) una sola vez."""
-    guides = json.loads(MANIFEST.read_text(encoding="utf-8")).get("guides", [])
+def _guias() -> list[str]:
+    return json.loads(MANIFEST.read_text(encoding="utf-8")).get("guides", [])
+
+
+def _huella() -> str:
+    """Manifest + contenido de cada guía + parámetros que afectan al índice."""
+    h = hashlib.blake2b(digest_size=12)
+    h.update(MANIFEST.read_bytes())
+    for nombre in _guias():
+        path = METHODOLOGY_DIR / nombre
+        h.update(nombre.encode("utf-8"))
+        h.update(path.read_bytes() if path.is_file() else b"")
+    h.update(json.dumps([MAX_CHUNK_CHARS, K1, B, sorted(_STOPWORDS), sys.byteorder]).encode())
+    return h.hexdigest()
+
+
+def construir_indice(ruta: Path) -> None:
+    """Trocea y tokeniza las guías y escribe el índice BM25 en `ruta` (atómico)."""
     chunks: list[dict] = []
-    for nombre in guides:
+    for nombre in _guias():
         path = METHODOLOGY_DIR / nombre
         if path.is_file():
             chunks.extend(_trocear(path.read_text(encoding="utf-8"), nombre))
-    tokens = [_tokenizar(c["texto"]) for c in chunks]
-    df: dict[str, int] = {}
-    for toks in tokens:
-        for t in set(toks):
-            df[t] = df.get(t, 0) + 1
-    n = len(chunks) or 1
-    idf = {t: math.log(1 + n / freq) for t, freq in df.items()}
-    return chunks, tokens, idf
+    postings: dict[str, list[tuple[int, int]]] = {}
+    longitudes = []
+    for i, c in enumerate(chunks):
+        toks = _tokenizar(c["texto"])
+        longitudes.append(len(toks))
+        tf: dict[str, int] = {}
+        for t in toks:
+            tf[t] = tf.get(t, 0) + 1
+        for t, f in tf.items():
+            postings.setdefault(t, []).append((i, f))
+    n = len(chunks)
+    media = (sum(longitudes) / n) if n else 1.0
+    ids, pesos = array.array("I"), array.array("f")
+    vocabulario = {}
+    for t in sorted(postings):
+        lista = postings[t]
+        idf = math.log(1 + (n - len(lista) + 0.5) / (len(lista) + 0.5))
+        vocabulario[t] = [len(ids), len(lista)]
+        for i, f in lista:
+            norma = K1 * (1 - B + B * longitudes[i] / media)
+            ids.append(i)
+            pesos.append(idf * f * (K1 + 1) / (f + norma))
+    cabecera = json.dumps({"vocabulario": vocabulario, "chunks": chunks},
+                          ensure_ascii=False).encode("utf-8")
+    relleno = (-(len(_MAGIA) + 4 + len(cabecera))) % 8
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    tmp = ruta.with_suffix(f".tmp{os.getpid()}")
+    with open(tmp, "wb") as f:
+        f.write(_MAGIA + struct.pack("<I", len(cabecera)) + cabecera + b"\0" * relleno)
+        ids.tofile(f)
+        pesos.tofile(f)
+    os.replace(tmp, ruta)
+
+
+class _Indice:
+    """Índice BM25 abierto con mmap: vocabulario y trozos en memoria, postings en el fichero."""
+
+    def __init__(self, ruta: Path):
+        with open(ruta, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(_MAGIA)] != _MAGIA:
+            raise ValueError(f"{ruta}: no es un índice de guías")
+        inicio = len(_MAGIA) + 4
+        (largo,) = struct.unpack("<I", self._mm[len(_MAGIA):inicio])
+        cabecera = json.loads(self._mm[inicio:inicio + largo].decode("utf-8"))
+        self.vocabulario: dict = cabecera["vocabulario"]
+        self.chunks: list[dict] = cabecera["chunks"]
+        base = inicio + largo
+        base += (-base) % 8
+        total = sum(n for _, n in self.vocabulario.values())
+        vista = memoryview(self._mm)
+        self._ids = vista[base:base + 4 * total].cast("I")
+        self._pesos = vista[base + 4 * total:base + 8 * total].cast("f")
+
+    def buscar(self, terminos: list[str], k: int) -> list[tuple[float, int]]:
+        acumulado: dict[int, float] = {}
+        for t in terminos:
+            entrada = self.vocabulario.get(t)
+            if entrada is None:
+                continue
+            inicio, n = entrada
+            for i, w in zip(self._ids[inicio:inicio + n], self._pesos[inicio:inicio + n]):
+                acumulado[i] = acumulado.get(i, 0.0) + w
+        return sorted(((s, i) for i, s in acumulado.items()), reverse=True)[:k]
+
+
+_indice_abierto = None
+_lock = threading.Lock()
+
+
+def _indice() -> _Indice:
+    """Abre (o construye la primera vez) el índice de la huella actual; uno por proceso."""
+    global _indice_abierto
+    with _lock:
+        if _indice_abierto is None:
+            ruta = DIR_INDICE / f"guias_{_huella()}.bm25"
+            if not ruta.is_file():
+                try:
+                    construir_indice(ruta)
+                except OSError:  # directorio de sólo lectura (p. ej. checkout compartido)
+                    import tempfile
+                    ruta = Path(tempfile.gettempdir()) / ruta.name
+                    if not ruta.is_file():
+                        construir_indice(ruta)
+            _indice_abierto = _Indice(ruta)
+        return _indice_abierto
 
 
 def buscar(query: str, k: int = 3) -> list[dict]:
-    chunks, tokens, idf = _indice()
     q = _tokenizar(query)
-    if not q or not chunks:
+    if not q:
         return []
-    puntuados = []
-    for i, toks in enumerate(tokens):
-        if not toks:
-            continue
-        tf: dict[str, int] = {}
-        for t in toks:
-            tf[t] = tf.get(t, 0) + 1
-        score = sum(tf.get(t, 0) * idf.get(t, 0.0) for t in q) / math.sqrt(len(toks))
-        if score > 0:
-            puntuados.append((score, i))
-    puntuados.sort(reverse=True)
-    return [{**chunks[i], "score": round(s, 3)} for s, i in puntuados[:k]]
+    indice = _indice()
+    return [{**indice.chunks[i], "score": round(s, 3)} for s, i in indice.buscar(q, k)]
 
 
 def consultar_guia(query: str, k: int = 3) -> str:
@@ -4,15 +4,20 @@ Experimento 21 — Agent Skills (nivel B1).
 
 Por cada artículo lanza 5 agentes especializados (uno por variable), cada uno con
 progressive disclosure de su SKILL.md (+ auxiliares). Escribe, por variable:
-  <var>, <var>_explicacion, <var>_evidencias
+  <var>, <var>_explicacion, <var>_evidencias, <var>_evidencias_spans ([[ini, fin], ...])
 y columnas de traza del agente:
-  <var>_n_tools, <var>_skills, <var>_colapso_b0
+  <var>_n_tools, <var>_skills, <var>_colapso_b0, <var>_precargadas, <var>_turnos
 
-Escritura incremental + reanudable por COLUMNA_ID (como exp 15).
+Escritura incremental (diario <salida>.jsonl, CSV al terminar) y reanudable por
+COLUMNA_ID (como exp 15).
 
 Uso:
     python3 main.py --input ../../<corpus>.csv --modelo claude-haiku-4-5-20251001 \
         --output-dir results/claude-haiku [--limit 20]
+
+Modo lote (B0, batch API de OpenAI/Anthropic; más barato, sin latencia interactiva):
+    python3 main.py --input ../../<corpus>.csv --modelo gpt-4o-mini --baseline \
+        --batch results/lotes --output-dir results/gpt-4o-mini-b0
 """
 from __future__ import annotations
 
@@ -28,6 +33,12 @@ EXP_DIR = Path(__file__).resolve().parent
 sys.path.insert(0, str(EXP_DIR))
 
 import agente  # noqa: E402
+import utils  # noqa: E402  (agente ya añadió Experimentos/ al sys.path)
+import lotes  # noqa: E402
+import corpus  # noqa: E402
+import cortacircuitos  # noqa: E402
+import planificador  # noqa: E402
+from escritor_resultados import EscritorResultados  # noqa: E402
 from tools import SKILLS_VARIABLE  # noqa: E402
 
 COLUMNA_ID = "IdNoticia"
@@ -37,18 +48,26 @@ MAX_FALLOS_SEGUIDOS = 3
 
 
 MODO_BASELINE = False  # True → B0 (metodología inyectada, sin tools)
+# Planificador de las variables de cada artículo (--paralelo); None → en serie.
+PLAN: planificador.Planificador | None = None
 
 
-def procesar_fila(texto: str, modelo: str) -> dict:
+def procesar_fila(texto: str, modelo: str, clasificar=None) -> dict:
     fila: dict = {}
     coste_total = 0.0
     coste_estimable = True
     tokens_total = 0
     n_error = 0
-    clasificar = (agente.clasificar_variable_baseline if MODO_BASELINE
-                  else agente.clasificar_variable)
-    for variable in SKILLS_VARIABLE:
-        res, traza = clasificar(variable, texto, modelo=modelo)
+    if clasificar is None:
+        clasificar = (agente.clasificar_variable_baseline if MODO_BASELINE
+                      else agente.clasificar_variable)
+    if PLAN is None:
+        por_variable = [(v, *clasificar(v, texto, modelo=modelo)) for v in SKILLS_VARIABLE]
+    else:
+        # Los 5 agentes del artículo a la vez: hasta 8 turnos cada uno, ya no en cadena.
+        por_variable = PLAN.repartir(
+            lambda v: (v, *clasificar(v, texto, modelo=modelo)), list(SKILLS_VARIABLE))
+    for variable, res, traza in por_variable:
         fila[f"{variable}_error"] = traza.get("error") or ""
         if traza.get("error"):
             n_error += 1
@@ -56,14 +75,19 @@ def procesar_fila(texto: str, modelo: str) -> dict:
         fila[f"modelo_{variable}"] = res["codigo"]
         fila[f"{variable}_explicacion"] = res["explicacion"]
         fila[f"{variable}_evidencias"] = json.dumps(res["evidencias"], ensure_ascii=False)
+        fila[f"{variable}_evidencias_spans"] = json.dumps(res.get("spans", []))
         fila[f"{variable}_n_tools"] = traza["n_tools"]
         fila[f"{variable}_skills"] = "|".join(traza["skills_cargadas"])
+        fila[f"{variable}_precargadas"] = "|".join(traza.get("skills_precargadas", []))
+        fila[f"{variable}_turnos"] = traza["n_llamadas"]
         fila[f"{variable}_guias"] = "|".join(traza["guias_consultadas"])
         fila[f"{variable}_colapso_b0"] = int(traza["colapso_b0"])
         tks = traza["prompt_tokens"] + traza["completion_tokens"]
         fila[f"{variable}_tokens"] = tks
         fila[f"{variable}_prompt_tokens"] = traza["prompt_tokens"]
         fila[f"{variable}_cache_read"] = traza["cache_read_tokens"]
+        fila[f"{variable}_prompt_tokens_turnos"] = "|".join(
+            str(t["prompt_tokens"]) for t in traza.get("turnos", []))
         fila[f"{variable}_coste_usd"] = traza["coste_usd"]
         tokens_total += tks
         if traza["coste_usd"] is None:
@@ -80,6 +104,14 @@ def procesar_fila(texto: str, modelo: str) -> dict:
     return fila
 
 
+def _clasificador_lote(rid: str, respuestas: dict):
+    """Clasificador B0 que lee la respuesta ya obtenida por la batch API."""
+    def clasificar(variable, texto, modelo):
+        salida, consumo = respuestas[f"{rid}::{variable}"]
+        return agente.interpretar_baseline(variable, texto, modelo, salida, consumo)
+    return clasificar
+
+
 def main() -> int:
     ap = argparse.ArgumentParser(description=__doc__)
     ap.add_argument("--input", required=True, help="CSV del corpus")
@@ -94,11 +126,37 @@ def main() -> int:
                     help="Ablación: desactivar la tool RAG en vivo CONSULTAR_GUIA")
     ap.add_argument("--sin-cache", action="store_true",
                     help="Ablación: desactivar prompt caching (prompt en un único mensaje)")
+    ap.add_argument("--sin-multiturno", action="store_true",
+                    help="Ablación: reenviar system + historial entero como un único prompt en "
+                         "cada turno del agente (transporte anterior, coste cuadrático)")
+    ap.add_argument("--precarga", default=None, metavar="JSON",
+                    help="Política de precarga (precarga.py): las skills que el agente casi "
+                         "siempre lee van ya en el primer turno")
     ap.add_argument("--baseline", action="store_true",
                     help="Nivel B0: metodología inyectada en el prompt, sin tools ni "
                          "progressive disclosure (comparación contra B1 skills)")
+    ap.add_argument("--cache-respuestas", default=None, metavar="SQLITE",
+                    help="Caché en disco de respuestas: prompts idénticos (reruns, "
+                         "ablaciones) no vuelven a pagar la API")
+    ap.add_argument("--rpm", type=float, default=None,
+                    help="Cuota de peticiones/minuto (p. ej. Gemini, que no la envía en cabeceras)")
+    ap.add_argument("--tpm", type=float, default=None, help="Cuota de tokens/minuto")
+    ap.add_argument("--batch", default=None, metavar="DIR",
+                    help="Modo lote (sólo B0, OpenAI/Anthropic): envía todas las llamadas "
+                         "por la batch API, espera y vuelca el CSV. DIR guarda el estado "
+                         "de los lotes para reanudar")
+    ap.add_argument("--sin-corte-temprano", action="store_true",
+                    help="B0 en Ollama: no cortar la generación al cerrar el FINAL")
+    ap.add_argument("--paralelo", type=int, default=len(SKILLS_VARIABLE), metavar="N",
+                    help="Llamadas al modelo en vuelo: las variables de cada artículo van en "
+                         "paralelo hasta N (1 = una tras otra)")
     args = ap.parse_args()
 
+    if args.batch and not args.baseline:
+        ap.error("--batch requiere --baseline (el bucle de agentes B1 es multi-turno).")
+    if args.batch and not lotes.proveedor_soporta_lote(args.modelo):
+        ap.error(f"--batch sólo admite modelos de OpenAI o Anthropic (no {args.modelo}).")
+
     if args.sin_resumenes_guias:
         agente.INCLUIR_RESUMENES_GUIAS = False
         print("Ablación: catálogo SIN skills-resumen de guías.")
@@ -108,16 +166,30 @@ def main() -> int:
     if args.sin_cache:
         agente.USAR_PROMPT_CACHE = False
         print("Ablación: SIN prompt caching (prompt en un único mensaje).")
+    if args.sin_multiturno:
+        agente.TRANSPORTE_CHAT = False
+        print("Ablación: SIN conversación multi-turno (historial reenviado en cada turno).")
+    if args.precarga:
+        import precarga
+        agente.PRECARGA = precarga.cargar_politica(args.precarga)
+        print(f"Precarga de skills: {args.precarga} "
+              f"({sum(map(len, agente.PRECARGA.values()))} skills en {len(agente.PRECARGA)} variables).")
+    if args.sin_corte_temprano:
+        agente.CORTE_TEMPRANO = False
     if args.baseline:
         global MODO_BASELINE
         MODO_BASELINE = True
         print("Nivel B0: metodología INYECTADA, sin tools (baseline sin skills).")
+    if args.cache_respuestas:
+        utils.activar_cache_respuestas(args.cache_respuestas)
+    if args.rpm or args.tpm:
+        utils.configurar_limites(rpm=args.rpm, tpm=args.tpm, modelo=args.modelo)
+    if args.paralelo > 1 and not args.batch:
+        global PLAN
+        PLAN = planificador.Planificador(args.paralelo)
 
-    df = pd.read_csv(args.input)
-    if args.only_labeled:
-        cols_gt = [v for v in SKILLS_VARIABLE if v in df.columns]
-        if cols_gt:
-            df = df.dropna(subset=cols_gt)
+    # Sólo id, texto y GT; --only-labeled (GT en las 5) se filtra en el lector.
+    df = corpus.cargar_corpus(args.input, etiquetados="todas" if args.only_labeled else None)
     if args.limit:
         df = df.head(args.limit)
 
@@ -125,21 +197,48 @@ def main() -> int:
     out_dir.mkdir(parents=True, exist_ok=True)
     salida = out_dir / f"exp21_{args.modelo.replace('/', '_')}.csv"
 
-    procesados: set = set()
-    if salida.is_file():
-        prev = pd.read_csv(salida)
-        if COLUMNA_ID in prev.columns:
-            procesados = set(prev[COLUMNA_ID].astype(str))
+    # Diario <salida>.jsonl a prueba de caídas; el CSV se exporta al terminar.
+    escritor = EscritorResultados(salida, columna_id=COLUMNA_ID)
+    procesados = escritor.ids()
+    if procesados:
         print(f"Reanudando: {len(procesados)} filas ya procesadas.")
+    try:
+        return _procesar(args, df, escritor, procesados, salida)
+    finally:
+        escritor.cerrar()
+        if PLAN is not None:
+            PLAN.cerrar()
+            print(f"Variables en paralelo: {PLAN.estadisticas()}")
+
+
+def _procesar(args, df, escritor: EscritorResultados, procesados: set, salida: Path) -> int:
+    """Bucle por artículo; las filas van al escritor (diario + CSV al cerrar)."""
+    respuestas_lote: dict = {}
+    if args.batch:
+        peticiones = {}
+        for _, row in df.iterrows():
+            rid = str(row.get(COLUMNA_ID, ""))
+            if rid in procesados:
+                continue
+            texto = str(row[COLUMNA_TEXTO]) if pd.notna(row.get(COLUMNA_TEXTO)) else ""
+            for variable in SKILLS_VARIABLE:
+                peticiones[f"{rid}::{variable}"] = agente.prompt_baseline(variable, texto)
+        respuestas_lote = lotes.ejecutar_lote(peticiones, args.modelo, dir_trabajo=args.batch)
 
-    primera = not salida.is_file()
     fallos_seguidos = 0
     for _, row in tqdm(df.iterrows(), total=df.shape[0]):
         rid = str(row.get(COLUMNA_ID, ""))
         if rid in procesados:
             continue
         texto = str(row[COLUMNA_TEXTO]) if pd.notna(row.get(COLUMNA_TEXTO)) else ""
-        fila = {COLUMNA_ID: rid, **procesar_fila(texto, args.modelo)}
+        clasificar = _clasificador_lote(rid, respuestas_lote) if args.batch else None
+        try:
+            fila = {COLUMNA_ID: rid, **procesar_fila(texto, args.modelo, clasificar)}
+        except cortacircuitos.CircuitoAbierto as e:
+            # El router ya tuvo los hilos en pausa MAX_PAUSA segundos antes de rendirse.
+            print(f"\n❌ ABORTADO (corta-circuitos): {e}\n"
+                  f"   Progreso guardado en {salida}. Relanza el mismo comando para reanudar.")
+            return 2
 
         # Corta-circuitos: si varios artículos fallan íntegros (saldo agotado, API caída,
         # clave revocada), abortar SIN escribir — si no, quedarían como negativos falsos
@@ -148,17 +247,21 @@ def main() -> int:
             fallos_seguidos += 1
             print(f"\n⚠️  Artículo {rid}: fallaron las {len(SKILLS_VARIABLE)} variables "
                   f"({fallos_seguidos}/{MAX_FALLOS_SEGUIDOS}). No se escribe la fila.")
-            if fallos_seguidos >= MAX_FALLOS_SEGUIDOS:
+            # En modo lote las respuestas ya están pagadas: se omite la fila pero no se aborta.
+            if fallos_seguidos >= MAX_FALLOS_SEGUIDOS and not args.batch:
                 print("\n❌ ABORTADO: demasiados fallos consecutivos. Revisa saldo/API key.\n"
                       f"   Progreso guardado en {salida}. Relanza el mismo comando para reanudar.")
                 return 2
             continue
         fallos_seguidos = 0
 
-        df_row = pd.DataFrame([fila])
-        df_row.to_csv(salida, mode="w" if primera else "a",
-                      header=primera, index=False, encoding="utf-8")
-        primera = False
+        escritor.escribir(fila, etiqueta="error" if fila["n_variables_error"] else "")
+    if args.cache_respuestas:
+        print(f"Caché respuestas: {utils.estadisticas_cache_respuestas()}")
+    utils.imprimir_estadisticas_limitador()
+    utils.imprimir_estadisticas_cache_prompt()
+    utils.imprimir_estadisticas_streaming()
+    utils.imprimir_estadisticas_cortacircuitos()
     print(f"Hecho → {salida}")
     return 0
 
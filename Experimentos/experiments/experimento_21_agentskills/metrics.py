@@ -14,11 +14,15 @@ Uso:
 from __future__ import annotations
 
 import argparse
+import sys
 from pathlib import Path
 
 import pandas as pd
 from sklearn.metrics import accuracy_score, cohen_kappa_score, f1_score
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))  # Experimentos/
+import corpus  # noqa: E402
+
 VARIABLES = [
     "lenguaje_sexista", "masc_generico", "sexismo_discurso",
     "asimetria_mujer_hombre", "denominacion_sexualizada",
@@ -48,11 +52,11 @@ def main() -> int:
     args = ap.parse_args()
 
     pred = pd.read_csv(args.pred)
-    corpus = pd.read_csv(args.corpus)
+    # Del corpus sólo hacen falta el id y las columnas GT (sin el texto de los artículos).
+    gt = corpus.cargar_corpus(args.corpus, columnas=[ID] + VARIABLES)
     pred[ID] = pred[ID].astype(str)
-    corpus[ID] = corpus[ID].astype(str)
+    gt[ID] = gt[ID].astype(str)
 
-    gt = corpus[[ID] + [v for v in VARIABLES if v in corpus.columns]]
     df = pred.merge(gt, on=ID, how="inner", suffixes=("", "_gt"))
     print(f"Filas predichas: {len(pred)} | con GT (merge): {len(df)}\n")
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Política de precarga de skills aprendida de trazas anteriores (Experimento 21).
+
+Las columnas de traza (<var>_skills, <var>_n_tools, <var>_colapso_b0) muestran que
+el agente casi siempre abre con `LEER_SKILL: <su variable>` y suele cargar después
+las mismas auxiliares. Cada una de esas acciones es un turno entero (ida y vuelta
+al modelo más el reenvío del contexto). Aquí:
+
+  1. aprender(): lee CSVs de corridas B1 y calcula, por variable, la fracción de
+     artículos en que el agente cargó cada skill; las que superan `umbral` forman
+     la política, ordenadas por su posición media en la secuencia de cargas. Las
+     precargadas de corridas con --precarga (<var>_precargadas) cuentan como las
+     primeras cargas, así que la política se puede reaprender sobre esas corridas.
+  2. agente.py (con agente.PRECARGA = cargar_politica(ruta)) inserta esas skills
+     en el primer turno, como si el agente ya las hubiera leído. La traza anota
+     `skills_precargadas` para medir el efecto (turnos, tokens, calidad).
+
+Uso:
+    python3 precarga.py results/claude-haiku/exp21_*.csv --umbral 0.6 \
+        --salida results/precarga.json
+    python3 main.py ... --precarga results/precarga.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from tools import SKILLS_VARIABLE
+
+UMBRAL = 0.6
+
+
+def aprender(rutas: list, umbral: float = UMBRAL) -> dict:
+    """Política {variables: {var: {precargar, frecuencias, n}}} a partir de CSVs de B1."""
+    cargas: dict[str, list[list[str]]] = {v: [] for v in SKILLS_VARIABLE}
+    for ruta in rutas:
+        df = pd.read_csv(ruta)
+        for variable in SKILLS_VARIABLE:
+            col = f"{variable}_skills"
+            if col not in df.columns:
+                continue
+            filas = df
+            if f"{variable}_error" in df.columns:
+                filas = df[df[f"{variable}_error"].fillna("").astype(str) == ""]
+            # En corridas con --precarga las skills precargadas no pasan por LEER_SKILL
+            # (no están en <var>_skills): cuentan como cargadas al principio.
+            col_pre = f"{variable}_precargadas"
+            precargadas = filas[col_pre].fillna("").astype(str) if col_pre in df.columns \
+                else [""] * len(filas)
+            for pre, valor in zip(precargadas, filas[col].fillna("").astype(str)):
+                # Sólo la primera carga de cada skill cuenta (re-lecturas no suman).
+                cargas[variable].append(list(dict.fromkeys(
+                    s for s in pre.split("|") + valor.split("|") if s)))
+
+    variables = {}
+    for variable, secuencias in cargas.items():
+        n = len(secuencias)
+        if not n:
+            continue
+        veces: dict[str, int] = {}
+        posiciones: dict[str, int] = {}
+        for seq in secuencias:
+            for pos, skill in enumerate(seq):
+                veces[skill] = veces.get(skill, 0) + 1
+                posiciones[skill] = posiciones.get(skill, 0) + pos
+        frecuencias = {s: round(c / n, 3) for s, c in sorted(veces.items(), key=lambda x: -x[1])}
+        precargar = sorted((s for s, f in frecuencias.items() if f >= umbral),
+                           key=lambda s: posiciones[s] / veces[s])
+        variables[variable] = {"precargar": precargar, "frecuencias": frecuencias, "n": n}
+    return {"umbral": umbral, "fuentes": [str(r) for r in rutas], "variables": variables}
+
+
+def cargar_politica(ruta) -> dict[str, list[str]]:
+    """{variable: [skills a precargar, en orden]} desde el JSON de aprender()."""
+    datos = json.loads(Path(ruta).read_text(encoding="utf-8"))
+    return {v: list(d.get("precargar", [])) for v, d in datos.get("variables", {}).items()}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Aprende la política de precarga de skills.")
+    ap.add_argument("csv", nargs="+", help="CSVs de corridas B1 con columnas <var>_skills")
+    ap.add_argument("--umbral", type=float, default=UMBRAL,
+                    help="Fracción mínima de artículos que cargaron la skill")
+    ap.add_argument("--salida", default="precarga.json")
+    args = ap.parse_args()
+    politica = aprender(args.csv, args.umbral)
+    Path(args.salida).write_text(json.dumps(politica, ensure_ascii=False, indent=2),
+                                 encoding="utf-8")
+    for variable, d in politica["variables"].items():
+        print(f"  {variable:<26} n={d['n']:<6} precargar={d['precargar']}")
+    print(f"Política → {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,14 +5,35 @@ Progressive disclosure: el agente sólo ve `name` + `description` (metadatos) v
 `list_skills`; el cuerpo del SKILL.md se carga bajo demanda con `read_skill`.
 No depende de LangChain ni de un proveedor concreto: las tools se exponen como
 acciones de texto que agente.py enruta (ver protocolo en agente.py).
+
+Las skills se cargan una sola vez por proceso en un Registro inmutable
+(metadatos, cuerpos, huella de contenido y catálogos ya renderizados): con 5
+agentes × miles de artículos × varios turnos, releer skills/ en cada
+list_skills/LEER_SKILL era E/S pura, y peor en los home NFS del cluster. Si existe
+SNAPSHOT (lo escriben generar_skills.py y generar_resumenes_guias.py) y coincide
+con los SKILL.md en disco (nombre, tamaño, mtime), se carga de ahí sin leerlos.
 """
 
 from __future__ import annotations
 
+import hashlib
+import pickle
 import re
+import sys
+import threading
+from dataclasses import dataclass
 from pathlib import Path
+from types import MappingProxyType
+
+EXPERIMENTOS_DIR = Path(__file__).resolve().parent.parent.parent
+if str(EXPERIMENTOS_DIR) not in sys.path:
+    sys.path.insert(0, str(EXPERIMENTOS_DIR))
+
+import evidencias as _evidencias  # noqa: E402
 
 SKILLS_DIR = Path(__file__).resolve().parent / "skills"
+SNAPSHOT = SKILLS_DIR / "registro.pickle"
+_VERSION_SNAPSHOT = 1
 
 # Skills de variable (una por variable objetivo) — el agente carga la suya.
 SKILLS_VARIABLE = {
@@ -41,9 +62,8 @@ SKILLS_RESUMEN_GUIAS = (
 )
 
 
-def _leer_frontmatter(path: Path) -> dict:
+def _frontmatter(texto: str, nombre_dir: str) -> dict:
     """Extrae name/description del frontmatter YAML simple de un SKILL.md."""
-    texto = path.read_text(encoding="utf-8")
     m = re.match(r"^---\s*\n(.*?)\n---", texto, re.DOTALL)
     campos: dict[str, str] = {}
     if m:
@@ -51,7 +71,7 @@ def _leer_frontmatter(path: Path) -> dict:
             if ":" in linea:
                 k, _, v = linea.partition(":")
                 campos[k.strip()] = v.strip()
-    campos.setdefault("name", path.parent.name)
+    campos.setdefault("name", nombre_dir)
     campos.setdefault("description", "")
     return campos
 
@@ -60,13 +80,124 @@ def _skill_path(skill_id: str) -> Path:
     return SKILLS_DIR / skill_id / "SKILL.md"
 
 
-def skills_disponibles() -> list[str]:
+@dataclass(frozen=True)
+class Skill:
+    id: str
+    name: str
+    description: str
+    cuerpo: str      # SKILL.md sin frontmatter (lo que devuelve read_skill)
+    huella: str      # blake2b del SKILL.md completo (claves de caché aguas abajo)
+
+
+def _leer_skill(skill_id: str) -> Skill:
+    datos = _skill_path(skill_id).read_bytes()
+    texto = datos.decode("utf-8")
+    campos = _frontmatter(texto, skill_id)
+    cuerpo = re.sub(r"^---\s*\n.*?\n---\s*\n", "", texto, count=1, flags=re.DOTALL).strip()
+    return Skill(skill_id, campos["name"], campos["description"], cuerpo,
+                 hashlib.blake2b(datos, digest_size=16).hexdigest())
+
+
+def _firma_disco() -> tuple:
+    """(id, tamaño, mtime_ns) de cada SKILL.md: decide si el snapshot sigue valiendo."""
     if not SKILLS_DIR.is_dir():
-        return []
-    return sorted(
-        p.name for p in SKILLS_DIR.iterdir()
-        if p.is_dir() and (p / "SKILL.md").is_file()
-    )
+        return ()
+    firma = []
+    for p in sorted(SKILLS_DIR.iterdir()):
+        st = (p / "SKILL.md").stat() if (p / "SKILL.md").is_file() else None
+        if p.is_dir() and st is not None:
+            firma.append((p.name, st.st_size, st.st_mtime_ns))
+    return tuple(firma)
+
+
+class Registro:
+    """Skills del proceso, de sólo lectura, con catálogos renderizados bajo demanda."""
+
+    def __init__(self, skills: dict, firma: tuple = ()):
+        self.skills = MappingProxyType(dict(sorted(skills.items())))
+        self.firma = firma
+        self._catalogos: dict[tuple, str] = {}
+        self._lock = threading.Lock()
+        # Catálogos de cada agente de variable (con y sin resúmenes de guías).
+        for variable in SKILLS_VARIABLE:
+            base = (variable, *SKILLS_AUXILIARES)
+            self.catalogo(base)
+            self.catalogo(base + SKILLS_RESUMEN_GUIAS)
+
+    @classmethod
+    def desde_disco(cls) -> "Registro":
+        firma = _firma_disco()
+        return cls({sid: _leer_skill(sid) for sid, _, _ in firma}, firma)
+
+    @classmethod
+    def cargar(cls) -> "Registro":
+        """Del SNAPSHOT si está al día; si no, de skills/."""
+        firma = _firma_disco()
+        try:
+            with open(SNAPSHOT, "rb") as f:
+                datos = pickle.load(f)
+            if datos.get("version") == _VERSION_SNAPSHOT and tuple(datos["firma"]) == firma:
+                return cls({sid: Skill(*campos) for sid, campos in datos["skills"].items()}, firma)
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+            pass
+        return cls.desde_disco()
+
+    def guardar(self, ruta: Path = SNAPSHOT) -> Path:
+        datos = {"version": _VERSION_SNAPSHOT, "firma": self.firma,
+                 "skills": {sid: (sk.id, sk.name, sk.description, sk.cuerpo, sk.huella)
+                            for sid, sk in self.skills.items()}}
+        tmp = ruta.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(datos, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(ruta)
+        return ruta
+
+    def catalogo(self, ids=None) -> str:
+        clave = None if ids is None else tuple(ids)
+        with self._lock:
+            if clave not in self._catalogos:
+                self._catalogos[clave] = self._renderizar(clave)
+            return self._catalogos[clave]
+
+    def _renderizar(self, ids) -> str:
+        disponibles = [s for s in self.skills if ids is None or s in ids]
+        if not disponibles:
+            return "(no hay skills disponibles)"
+        lineas = ["Skills disponibles (usa LEER_SKILL: <id>):"]
+        for sid in disponibles:
+            lineas.append(f"- {sid}: {self.skills[sid].description}")
+        return "\n".join(lineas)
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+
+def registro() -> Registro:
+    """Registro del proceso (se construye en la primera llamada)."""
+    global _registro
+    with _registro_lock:
+        if _registro is None:
+            _registro = Registro.cargar()
+        return _registro
+
+
+def escribir_snapshot() -> Path:
+    """Relee skills/ y escribe SNAPSHOT (tras generar o editar SKILL.md)."""
+    global _registro
+    with _registro_lock:
+        _registro = Registro.desde_disco()
+        return _registro.guardar()
+
+
+def skills_disponibles() -> list[str]:
+    return list(registro().skills)
+
+
+def huella_skill(skill_id: str) -> str | None:
+    """Hash del contenido de la skill (None si no existe)."""
+    sk = registro().skills.get(skill_id)
+    return sk.huella if sk is not None else None
 
 
 def list_skills(ids: list[str] | None = None) -> str:
@@ -74,16 +205,7 @@ def list_skills(ids: list[str] | None = None) -> str:
     Devuelve metadatos (id + description) de las skills visibles para el agente.
     `ids`: subconjunto a mostrar (p.ej. la skill de la variable + auxiliares).
     """
-    disponibles = skills_disponibles()
-    if ids is not None:
-        disponibles = [s for s in disponibles if s in ids]
-    if not disponibles:
-        return "(no hay skills disponibles)"
-    lineas = ["Skills disponibles (usa LEER_SKILL: <id>):"]
-    for sid in disponibles:
-        desc = _leer_frontmatter(_skill_path(sid)).get("description", "")
-        lineas.append(f"- {sid}: {desc}")
-    return "\n".join(lineas)
+    return registro().catalogo(ids)
 
 
 def read_skill(skill_id: str, permitidas: list[str] | None = None) -> str:
@@ -93,18 +215,18 @@ def read_skill(skill_id: str, permitidas: list[str] | None = None) -> str:
             f"Error: '{skill_id}' no está permitida aquí. "
             f"Permitidas: {', '.join(permitidas)}"
         )
-    path = _skill_path(skill_id)
-    if not path.is_file():
+    sk = registro().skills.get(skill_id)
+    if sk is None:
         return f"Error: no existe la skill '{skill_id}'."
-    texto = path.read_text(encoding="utf-8")
-    return re.sub(r"^---\s*\n.*?\n---\s*\n", "", texto, count=1, flags=re.DOTALL).strip()
+    return sk.cuerpo
 
 
 def verificar_evidencias(evidencias: list[str], texto: str) -> dict:
     """
     Tool de verificación: separa evidencias que SON literales del texto de las
     que no. `texto` debe ser el MISMO que vio el modelo (no un texto alterado).
+    Las válidas vuelven como el fragmento literal del texto (con sus comillas,
+    tildes y espacios), aunque el modelo las citara con pequeñas diferencias.
     """
-    validas = [e for e in evidencias if e and e in texto]
-    invalidas = [e for e in evidencias if e and e not in texto]
-    return {"validas": validas, "invalidas": invalidas}
+    res = _evidencias.verificar(evidencias, texto)
+    return {"validas": res["validas"], "invalidas": res["invalidas"]}
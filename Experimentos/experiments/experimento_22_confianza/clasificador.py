@@ -26,6 +26,7 @@ for p in (str(EXPERIMENTOS_DIR), str(EXP21_DIR)):
 
 from utils import consultar_ollama, get_consumo_llamada  # noqa: E402
 import tools   # noqa: E402  (de exp21: read_skill, SKILLS_VARIABLE)
+import evidencias as evidencias_idx  # noqa: E402
 import costes  # noqa: E402  (de exp21: calcular_coste)
 
 # Mismo texto de metodología que el B0 del exp21, más la petición de prob_si.
@@ -46,6 +47,9 @@ con independencia del `codigo` que asignes: 0 = con seguridad NO; 100 = con segu
 SÍ; 50 = caso fronterizo. Sé sincera y usa valores intermedios cuando dudes.
 No añadas nada más ni mezcles otras variables."""
 
+# En Ollama, streaming cortado en cuanto se cierra el objeto FINAL (ver utils.consultar_ollama).
+CORTE_TEMPRANO = True
+
 
 def _parse_final(salida: str) -> dict | None:
     m = re.search(r"FINAL:\s*(\{.*\})", salida, re.DOTALL)
@@ -57,14 +61,24 @@ def _parse_final(salida: str) -> dict | None:
         return None
 
 
+def construir_prompt(variable: str, texto: str) -> str:
+    """Prompt de `variable` (B0 + prob_si). Compartido con el modo lote."""
+    system = SYSTEM.format(variable=variable, metodologia=tools.read_skill(variable))
+    return (system + "\n\n=== TEXTO A CLASIFICAR ===\n" + texto
+            + "\n=== FIN TEXTO ===\n\nTu respuesta:")
+
+
 def clasificar(variable: str, texto: str, modelo: str,
                temperature: float = 0.1) -> tuple[dict, dict]:
     """Clasifica una variable pidiendo codigo + prob_si. Devuelve (resultado, traza)."""
-    system = SYSTEM.format(variable=variable, metodologia=tools.read_skill(variable))
-    prompt = (system + "\n\n=== TEXTO A CLASIFICAR ===\n" + texto
-              + "\n=== FIN TEXTO ===\n\nTu respuesta:")
-    salida = consultar_ollama(prompt, modelo=modelo, temperature=temperature)
-    c = get_consumo_llamada()
+    salida = consultar_ollama(construir_prompt(variable, texto), modelo=modelo,
+                              temperature=temperature,
+                              cortar_en="final" if CORTE_TEMPRANO else None)
+    return interpretar(texto, modelo, salida, get_consumo_llamada())
+
+
+def interpretar(texto: str, modelo: str, salida: str, c: dict) -> tuple[dict, dict]:
+    """Respuesta del modelo + consumo de la llamada → (resultado, traza)."""
     traza = {
         "prompt_tokens": c.get("prompt_tokens", 0),
         "completion_tokens": c.get("completion_tokens", 0),
@@ -73,7 +87,7 @@ def clasificar(variable: str, texto: str, modelo: str,
     }
     traza["coste_usd"] = costes.calcular_coste(
         modelo, traza["prompt_tokens"], traza["completion_tokens"],
-        traza["cache_read_tokens"], 0)
+        traza["cache_read_tokens"], 0, lote=bool(c.get("lote")))
 
     data = _parse_final(salida)
     if not isinstance(data, dict):
@@ -89,11 +103,11 @@ def clasificar(variable: str, texto: str, modelo: str,
     evid = data.get("evidencias") or []
     if not isinstance(evid, list):
         evid = [str(evid)]
-    evid = [e for e in evid if e and e in texto]
+    verificadas = evidencias_idx.verificar(evid, texto)
     if codigo == 1:
-        evid = []
-    return {"codigo": codigo, "prob_si": prob,
-            "explicacion": data.get("explicacion", ""), "evidencias": evid}, traza
+        verificadas = {"validas": [], "spans": []}
+    return {"codigo": codigo, "prob_si": prob, "explicacion": data.get("explicacion", ""),
+            "evidencias": verificadas["validas"], "spans": verificadas["spans"]}, traza
 
 
 if __name__ == "__main__":
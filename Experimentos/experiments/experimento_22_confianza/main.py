@@ -7,6 +7,8 @@ modelo_<var>_prob_si. Escritura incremental + reanudable por IdNoticia.
 Uso:
     python3 main.py --input ../../<corpus>.csv --modelo gpt-4o-mini \
         --output-dir results/gpt-4o-mini [--only-labeled] [--limit N]
+
+Modo lote (batch API de OpenAI/Anthropic): añadir --batch results/lotes.
 """
 from __future__ import annotations
 
@@ -21,6 +23,10 @@ from tqdm import tqdm
 EXP22_DIR = Path(__file__).resolve().parent
 sys.path.insert(0, str(EXP22_DIR))
 import clasificador  # noqa: E402
+import utils  # noqa: E402  (clasificador ya añadió Experimentos/ al sys.path)
+import lotes  # noqa: E402
+import corpus  # noqa: E402
+from escritor_resultados import EscritorResultados  # noqa: E402
 
 VARIABLES = ["lenguaje_sexista", "masc_generico", "sexismo_discurso",
              "asimetria_mujer_hombre", "denominacion_sexualizada"]
@@ -29,12 +35,16 @@ COLUMNA_TEXTO = "contenido_articulo"
 MAX_FALLOS_SEGUIDOS = 3
 
 
-def procesar_fila(texto: str, modelo: str) -> dict:
+def procesar_fila(texto: str, modelo: str, respuestas: dict | None = None) -> dict:
+    """`respuestas`: {variable: (salida, consumo)} ya obtenidas en modo lote."""
     fila: dict = {}
     coste = 0.0
     n_err = 0
     for v in VARIABLES:
-        res, tz = clasificador.clasificar(v, texto, modelo)
+        if respuestas is not None:
+            res, tz = clasificador.interpretar(texto, modelo, *respuestas[v])
+        else:
+            res, tz = clasificador.clasificar(v, texto, modelo)
         fila[f"modelo_{v}"] = res["codigo"]
         fila[f"modelo_{v}_prob_si"] = res["prob_si"]
         fila[f"{v}_explicacion"] = res["explicacion"]
@@ -55,13 +65,28 @@ def main() -> int:
     ap.add_argument("--output-dir", default="results")
     ap.add_argument("--limit", type=int, default=None)
     ap.add_argument("--only-labeled", action="store_true")
+    ap.add_argument("--cache-respuestas", default=None, metavar="SQLITE",
+                    help="Caché en disco de respuestas (reruns sin volver a pagar la API)")
+    ap.add_argument("--rpm", type=float, default=None,
+                    help="Cuota de peticiones/minuto (p. ej. Gemini, que no la envía en cabeceras)")
+    ap.add_argument("--tpm", type=float, default=None, help="Cuota de tokens/minuto")
+    ap.add_argument("--batch", default=None, metavar="DIR",
+                    help="Modo lote (OpenAI/Anthropic): todas las llamadas por la batch API; "
+                         "DIR guarda el estado de los lotes para reanudar")
+    ap.add_argument("--sin-corte-temprano", action="store_true",
+                    help="Ollama: no cortar la generación al cerrar el FINAL (respuesta completa)")
     args = ap.parse_args()
-
-    df = pd.read_csv(args.input)
-    if args.only_labeled:
-        cols = [v for v in VARIABLES if v in df.columns]
-        if cols:
-            df = df.dropna(subset=cols)
+    if args.batch and not lotes.proveedor_soporta_lote(args.modelo):
+        ap.error(f"--batch sólo admite modelos de OpenAI o Anthropic (no {args.modelo}).")
+    if args.cache_respuestas:
+        utils.activar_cache_respuestas(args.cache_respuestas)
+    if args.sin_corte_temprano:
+        clasificador.CORTE_TEMPRANO = False
+    if args.rpm or args.tpm:
+        utils.configurar_limites(rpm=args.rpm, tpm=args.tpm, modelo=args.modelo)
+
+    # Sólo id, texto y GT; --only-labeled (GT en las 5) se filtra en el lector.
+    df = corpus.cargar_corpus(args.input, etiquetados="todas" if args.only_labeled else None)
     if args.limit:
         df = df.head(args.limit)
 
@@ -69,34 +94,55 @@ def main() -> int:
     out_dir.mkdir(parents=True, exist_ok=True)
     salida = out_dir / f"exp22_{args.modelo.replace('/', '_')}.csv"
 
-    procesados: set = set()
-    if salida.is_file():
-        prev = pd.read_csv(salida)
-        if COLUMNA_ID in prev.columns:
-            procesados = set(prev[COLUMNA_ID].astype(str))
+    # Reanudación desde el índice <salida>.ids (no se relee el CSV de resultados).
+    escritor = EscritorResultados(salida, columna_id=COLUMNA_ID)
+    procesados = escritor.ids()
+    if procesados:
         print(f"Reanudando: {len(procesados)} filas ya hechas.")
+    try:
+        return _procesar(args, df, escritor, procesados, salida)
+    finally:
+        escritor.cerrar()
+
+
+def _procesar(args, df, escritor: EscritorResultados, procesados: set, salida: Path) -> int:
+    """Bucle por artículo; las filas van al escritor (diario + CSV al cerrar)."""
+    lote: dict = {}
+    if args.batch:
+        peticiones = {}
+        for _, row in df.iterrows():
+            rid = str(row.get(COLUMNA_ID, ""))
+            if rid in procesados:
+                continue
+            texto = str(row[COLUMNA_TEXTO]) if pd.notna(row.get(COLUMNA_TEXTO)) else ""
+            for v in VARIABLES:
+                peticiones[f"{rid}::{v}"] = clasificador.construir_prompt(v, texto)
+        lote = lotes.ejecutar_lote(peticiones, args.modelo, dir_trabajo=args.batch)
 
-    primera = not salida.is_file()
     fallos = 0
     for _, row in tqdm(df.iterrows(), total=df.shape[0]):
         rid = str(row.get(COLUMNA_ID, ""))
         if rid in procesados:
             continue
         texto = str(row[COLUMNA_TEXTO]) if pd.notna(row.get(COLUMNA_TEXTO)) else ""
-        fila = {COLUMNA_ID: rid, **procesar_fila(texto, args.modelo)}
+        respuestas = {v: lote[f"{rid}::{v}"] for v in VARIABLES} if args.batch else None
+        fila = {COLUMNA_ID: rid, **procesar_fila(texto, args.modelo, respuestas)}
 
         if fila["n_variables_error"] == len(VARIABLES):
             fallos += 1
             print(f"\n⚠️  {rid}: fallaron las {len(VARIABLES)} variables ({fallos}/{MAX_FALLOS_SEGUIDOS}).")
-            if fallos >= MAX_FALLOS_SEGUIDOS:
+            if fallos >= MAX_FALLOS_SEGUIDOS and not args.batch:
                 print(f"\n❌ ABORTADO: revisa saldo/API. Progreso en {salida} (reanudable).")
                 return 2
             continue
         fallos = 0
 
-        pd.DataFrame([fila]).to_csv(salida, mode="w" if primera else "a",
-                                    header=primera, index=False, encoding="utf-8")
-        primera = False
+        escritor.escribir(fila, etiqueta="error" if fila["n_variables_error"] else "")
+    if args.cache_respuestas:
+        print(f"Caché respuestas: {utils.estadisticas_cache_respuestas()}")
+    utils.imprimir_estadisticas_limitador()
+    utils.imprimir_estadisticas_cache_prompt()
+    utils.imprimir_estadisticas_streaming()
     print(f"Hecho → {salida}")
     return 0
 
@@ -11,13 +11,29 @@ import glob # <-- Importamos glob para escanear carpetas
 # Importamos la función que generamos en metrics.py
 from metrics import generar_metricas_y_summary
 
-import threading # <-- Para evitar errores al escribir en el CSV
+import sys
+import atexit
+import argparse
 from concurrent.futures import ThreadPoolExecutor, as_completed # <-- Para el paralelismo
 
+# Escritor de resultados compartido (Experimentos/escritor_resultados.py). Se añade al
+# final del path para que utils/variables sigan siendo los de esta carpeta.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from escritor_resultados import EscritorResultados
+
 # ==========================================
 # 0. CONFIGURACIÓN DEL GRID SEARCH Y MÉTRICAS
 # ==========================================
 
+# Ablaciones por línea de comandos (modelos y prompts se configuran aquí debajo).
+parser = argparse.ArgumentParser(description="Grid search Interspeech: modelos × prompts.")
+parser.add_argument("--sin-esquema", action="store_true",
+                    default=os.environ.get("SIN_ESQUEMA", "").lower() in ("1", "true", "yes"),
+                    help="Ablación: las variables no piden a Ollama salida restringida por su "
+                         "esquema JSON (sólo prompt + json_repair). Env: SIN_ESQUEMA=1")
+args = parser.parse_args()
+variables.USAR_ESQUEMA = not args.sin_esquema
+
 # 1. Define aquí tu lista de modelos
 MODELOS = [
     # "gemma3:1b",
@@ -197,10 +213,7 @@ def guardar_matrices_confusion(archivo_resultados, nombre_exp, carpeta_salida):
 # 4. PARALLEL
 # ==========================================
 
-# Lock para escribir en el archivo de forma segura
-csv_lock = threading.Lock()
-
-def tarea_hilo(row, modelo_actual, prompt_actual, nombre_output):
+def tarea_hilo(row, modelo_actual, prompt_actual, escritor):
     """Encapsula el proceso de una fila para el ThreadPool"""
     start_time = time.time()
     res_fila = procesar_fila(row, modelo_actual, prompt_actual)
@@ -210,17 +223,33 @@ def tarea_hilo(row, modelo_actual, prompt_actual, nombre_output):
     fila_completa.update(res_fila)
     fila_completa['modelo_tiempo_procesamiento_seg'] = duration
     
-    df_temp = pd.DataFrame([fila_completa])
-    
-    # Escritura segura con Lock
-    with csv_lock:
-        header_necesario = not os.path.exists(nombre_output)
-        df_temp.to_csv(nombre_output, index=False, mode='a', header=header_necesario, encoding='utf-8')
+    # Sin lock ni DataFrame por fila: el escritor vuelca en segundo plano
+    escritor.escribir(fila_completa)
+
+
+def prompt_mas_largo(prompts, df) -> str:
+    """El prompt real más largo del grid: artículo más largo × cada template × cada variable."""
+    vars_data = utils.cargar_variables_desde_json("variables.json")
+    texto = max(df['contenido_articulo'].fillna('').astype(str), key=len, default='').replace('"', "'")
+    candidatos = [""]
+    for prompt in prompts:
+        for config in vars_data:
+            try:
+                candidatos.append(utils.generar_prompt_dinamico(config, texto, prompt))
+            except Exception:
+                pass  # variables que este template no sabe rellenar
+    return max(candidatos, key=len)
 
 
 # ==========================================
 # 5. BUCLE PRINCIPAL (GRID SEARCH)
 # ==========================================
+# Plan por modelo: cada modelo se carga UNA vez (con el num_ctx del prompt más largo
+# del grid ya reservado, para que no se recargue a mitad), se le dan TODOS sus
+# prompts a la vez y se descarga al terminar, antes de cargar el siguiente.
+# Las tareas van en orden artículo → prompt: las llamadas de un mismo artículo salen
+# seguidas y el modelo reaprovecha su KV cache (prefijo estable de utils) mientras
+# el artículo sigue caliente. Cada (modelo, prompt) mantiene su fichero de salida.
 
 FOLDER_RESULTS = "../../results"
 FOLDER_METRICS = "../../metrics"
@@ -232,38 +261,52 @@ os.makedirs(FOLDER_METRICS, exist_ok=True)
 os.makedirs(FOLDER_METRICS_DETAILS, exist_ok=True)
 os.makedirs(FOLDER_MATRICES, exist_ok=True) # <-- Aseguramos que exista
 
-for modelo_actual in MODELOS:
-    for prompt_actual in lista_prompts:
-        
-        modelo_limpio = modelo_actual.replace(':', '_').replace('-', '_').replace('/', '_')
-        prompt_limpio = os.path.splitext(os.path.basename(prompt_actual))[0]
-        nombre_exp = f"Experimento-Interspeech-{modelo_limpio}_{prompt_limpio}"
+COLUMNA_ID = "IdNoticia"
+DESCARGAR_AL_TERMINAR = True  # False → el modelo sigue en VRAM hasta que venza KEEP_ALIVE
 
-        print(f"\n{'='*60}")
-        print(f"🚀 INICIANDO EXPERIMENTO: {nombre_exp}")
-        print(f"\n🚀 EJECUTANDO EN PARALELO ({MAX_WORKERS} hilos): {nombre_exp}")
-        print(f"   🤖 Modelo: {modelo_actual}")
-        print(f"   📄 Prompt: {prompt_actual}")
-        print(f"{'='*60}")
 
+def ejecutar_modelo(modelo_actual, prompts, df):
+    """Todos los prompts de un modelo en un único pool de MAX_WORKERS hilos."""
+    modelo_limpio = modelo_actual.replace(':', '_').replace('-', '_').replace('/', '_')
+    experimentos = []
+    for prompt_actual in prompts:
+        prompt_limpio = os.path.splitext(os.path.basename(prompt_actual))[0]
+        nombre_exp = f"Experimento-Interspeech-{modelo_limpio}_{prompt_limpio}"
         nombre_output = f"{FOLDER_RESULTS}/{nombre_exp}_resultados_2024_{SUFFIX}.csv"
-        archivo_metricas = f"{FOLDER_METRICS_DETAILS}/metrics_{nombre_exp}_2024.csv"
-
-        es_primera_vez = True
-
-        print(f"Los datos se guardarán en tiempo real en: {nombre_output}")
-
-       # Ejecución en paralelo de las filas del DataFrame
+        escritor = EscritorResultados(nombre_output, columna_id=COLUMNA_ID)
+        atexit.register(escritor.cerrar)  # Ctrl-C/excepción: no perder el búfer
+        # Reanudación desde el índice de completados de esa salida.
+        experimentos.append((prompt_actual, nombre_exp, nombre_output, escritor, escritor.ids()))
+
+    print(f"\n{'='*60}")
+    print(f"🚀 MODELO: {modelo_actual} · {len(prompts)} prompts en paralelo ({MAX_WORKERS} hilos)")
+    for prompt_actual, nombre_exp, _, escritor, hechos in experimentos:
+        print(f"   📄 {nombre_exp} → {escritor.ruta_diario}"
+              + (f" ({len(hechos)} ya hechos)" if hechos else ""))
+    print(f"{'='*60}")
+
+    tareas = [
+        (row, prompt_actual, escritor)
+        for _, row in df.iterrows()
+        for prompt_actual, _, _, escritor, hechos in experimentos
+        if str(row.get(COLUMNA_ID)) not in hechos
+    ]
+    if tareas:
+        num_ctx = utils.reservar_num_ctx(modelo_actual, prompt_mas_largo(prompts, df))
+        print(f"⏳ Cargando {modelo_actual} (num_ctx={num_ctx})...", end=" ", flush=True)
+        print(f"{utils.cargar_modelo(modelo_actual):.1f}s")
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            # Creamos la lista de tareas
             futures = [
-                executor.submit(tarea_hilo, row, modelo_actual, prompt_actual, nombre_output) 
-                for _, row in df_procesar.iterrows()
+                executor.submit(tarea_hilo, row, modelo_actual, prompt_actual, escritor)
+                for row, prompt_actual, escritor in tareas
             ]
-            
-            # tqdm envuelve as_completed para ver el progreso real
-            for _ in tqdm(as_completed(futures), total=len(futures), desc=f"Procesando {prompt_limpio}"):
+            for _ in tqdm(as_completed(futures), total=len(futures), desc=modelo_limpio):
                 pass
+        if DESCARGAR_AL_TERMINAR:
+            utils.descargar_modelo(modelo_actual)
+
+    for prompt_actual, nombre_exp, nombre_output, escritor, _ in experimentos:
+        escritor.cerrar()  # vacía el búfer y exporta el CSV que leen las métricas
 
         # Métricas al finalizar el experimento
         print(f"📊 Generando métricas para {nombre_exp}...")
@@ -279,4 +322,10 @@ for modelo_actual in MODELOS:
         print("📊 Generando matrices de confusión...")
         guardar_matrices_confusion(nombre_output, nombre_exp, FOLDER_MATRICES)
 
-print("\n🎉 TODOS LOS EXPERIMENTOS DEL GRID SEARCH HAN FINALIZADO.")
\ No newline at end of file
+    print(f"✂️  Truncados Ollama acumulados (prompt estimado/salida): {utils.truncados}")
+
+
+for modelo_actual in MODELOS:
+    ejecutar_modelo(modelo_actual, lista_prompts, df_procesar)
+
+print("\n🎉 TODOS LOS EXPERIMENTOS DEL GRID SEARCH HAN FINALIZADO.")
@@ -5,31 +5,65 @@ import re
 import ollama
 from pathlib import Path
 import json
+import sys
+import threading
+import time
 
 # =====================================================================================
 # 0. Ollama
 # =====================================================================================
+# num_ctx por buckets según el tamaño del prompt (antes fijo a 8192), con el mismo
+# cálculo que Experimentos/utils.py (Experimentos/contexto_ollama.py). El bucket por
+# modelo sólo crece, porque Ollama recarga el modelo si cambia num_ctx.
+_EXPERIMENTOS_DIR = Path(__file__).resolve().parent.parent.parent
+if str(_EXPERIMENTOS_DIR) not in sys.path:
+    sys.path.append(str(_EXPERIMENTOS_DIR))  # al final: variables/utils de aquí siguen primero
+import contexto_ollama  # noqa: E402
+from prefijo_estable import IRIS_CACHE_BREAK, maquetar_prefijo_estable  # noqa: E402
+
+KEEP_ALIVE = "30m"  # modelo cargado durante todo el grid de prompts
+_truncados_lock = threading.Lock()
+# "prompt" es una estimación: el prompt no deja hueco a num_predict en num_ctx
+# (Ollama no informa de si recortó); "salida" sí es real (done_reason == "length").
+truncados = {"prompt_estimado": 0, "salida": 0}
+
+
+def _num_ctx(modelo: str, prompt: str, num_predict: int) -> int:
+    return contexto_ollama.num_ctx_para(modelo, prompt, num_predict)
+
+
 def consultar_ollama(
     prompt: str, 
     modelo: str = "gemma3:4b", 
-    temperature: float = 0.1 # Bajo para ser preciso/determinista
+    temperature: float = 0.1, # Bajo para ser preciso/determinista
+    num_predict: int = 1024,  # Reservamos espacio suficiente para la respuesta JSON
+    esquema: Optional[type[BaseModel]] = None,
 ) -> str:
     """
     Envía un prompt a Ollama con soporte para formato JSON y temperatura.
+    Con `esquema` (modelo Pydantic) se pide salida restringida a su JSON Schema
+    (`format` de Ollama).
     """
     try:
         # Configuramos las opciones avanzadas
         opciones = {
             'temperature': temperature,
-            'num_ctx': 8192,       # <--- ESTO ES LO IMPORTANTE. Ampliamos la memoria a ~32k caracteres.
-            'num_predict': 1024,   # Reservamos espacio suficiente para la respuesta JSON
+            'num_ctx': _num_ctx(modelo, prompt, num_predict),
+            'num_predict': num_predict,
         }
 
         response = ollama.chat(
             model=modelo,
             messages=[{'role': 'user', 'content': prompt}],
-            options=opciones
+            options=opciones,
+            keep_alive=KEEP_ALIVE,
+            format=esquema.model_json_schema() if esquema is not None else None,
         )
+        with _truncados_lock:
+            if (response.get('prompt_eval_count') or 0) + num_predict > opciones['num_ctx']:
+                truncados["prompt_estimado"] += 1
+            if response.get('done_reason') == 'length':
+                truncados["salida"] += 1
         return response['message']['content'].strip()
     
     except Exception as e:
@@ -37,6 +71,31 @@ def consultar_ollama(
         return ""
 
 
+def reservar_num_ctx(modelo: str, prompt_mas_largo: str, num_predict: int = 1024) -> int:
+    """
+    Fija de antemano el bucket de num_ctx del modelo para el prompt más largo del
+    grid: así no cambia a mitad de corrida (cada cambio recarga el modelo en Ollama).
+    """
+    return _num_ctx(modelo, prompt_mas_largo, num_predict)
+
+
+def cargar_modelo(modelo: str) -> float:
+    """Carga el modelo en VRAM (petición vacía) con el num_ctx reservado; devuelve segundos."""
+    t0 = time.time()
+    ctx = contexto_ollama.num_ctx_actual()
+    opciones = {'num_ctx': ctx[modelo]} if modelo in ctx else {}
+    ollama.generate(model=modelo, prompt="", options=opciones, keep_alive=KEEP_ALIVE)
+    return time.time() - t0
+
+
+def descargar_modelo(modelo: str) -> None:
+    """Libera la VRAM del modelo al terminar su trabajo (el siguiente carga sin esperar)."""
+    try:
+        ollama.generate(model=modelo, prompt="", keep_alive=0)
+    except Exception as e:
+        print(f"No se pudo descargar {modelo}: {e}")
+
+
 # =====================================================================================
 # 7a. Nombre Propio Titular
 # =====================================================================================
@@ -225,11 +284,20 @@ def obtener_config_variable(datos_json: list, codigo_buscado: str) -> dict:
 def cargar_texto_template(ruta: str) -> str:
     return Path(ruta).read_text(encoding="utf-8")
 
+# Artículo primero, datos de la variable al final: las N variables de un artículo
+# comparten prefijo byte a byte y Ollama reaprovecha su KV cache entre llamadas.
+# False → template tal cual (ablación).
+USAR_PREFIJO_ESTABLE = True
+
 def generar_prompt_dinamico(config: Dict, texto: str, ruta_template: str) -> str:
     """
     Rellena el template .md con los datos de la variable y calcula las opciones.
     """
     template = cargar_texto_template(ruta_template)
+    if USAR_PREFIJO_ESTABLE:
+        # Aquí (sólo Ollama) el marcador no parte el prompt: se quita.
+        partes = maquetar_prefijo_estable(template).split(IRIS_CACHE_BREAK, 1)
+        template = "\n\n".join(p.strip() for p in partes) + "\n"
     
     # 1. Generar la lista de opciones (1 = X, 2 = Y, ...)
     # Esto toma ["No", "Sí", "Salto..."] y crea el string formateado
@@ -13,6 +13,11 @@ import json
 # ==========================================
 import json_repair 
 
+# Esquema JSON de salida (BloqueAnalisis*) que las variables de lenguaje pasan a
+# consultar_ollama (format de Ollama). Ablación: False → sólo las instrucciones del
+# prompt + json_repair (main_parallel.py --sin-esquema).
+USAR_ESQUEMA = True
+
 # ==========================================
 # IMPORTANTE: Importamos TODAS las funciones necesarias de utils.py
 # ==========================================
@@ -1640,7 +1645,8 @@ def clasificar_var_lenguaje_sexista(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -1699,7 +1705,8 @@ def clasificar_var_masc_generico(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -1756,7 +1763,8 @@ def clasificar_var_hombre_denominar_humanidad(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -1813,7 +1821,8 @@ def clasificar_var_uso_dual_zorr(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -1870,7 +1879,8 @@ def clasificar_var_uso_cargo_mujer(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -1927,7 +1937,8 @@ def clasificar_var_sexismo_discurso(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -1984,7 +1995,8 @@ def clasificar_var_androcentrismo(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2041,7 +2053,8 @@ def clasificar_var_mencion_nombre_investigadora(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2098,7 +2111,8 @@ def clasificar_var_asimetria_mujer_hombre(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2155,7 +2169,8 @@ def clasificar_var_diminutivos_infantilizacion(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2212,7 +2227,8 @@ def clasificar_var_denominacion_sexualizada(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2269,7 +2285,8 @@ def clasificar_var_denominacion_redundante(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2326,7 +2343,8 @@ def clasificar_var_denominacion_dependiente(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2383,7 +2401,8 @@ def clasificar_var_criterios_excepcion(
 
     # C. Llamada a Ollama
     # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2440,7 +2459,8 @@ def clasificar_var_comparacion_mujer_hombre(
 
     # C. Llamada a Ollama
     # # print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                    esquema=BloqueAnalisisLenguajeSexista if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
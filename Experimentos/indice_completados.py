@@ -0,0 +1,121 @@
+"""
+Índice de artículos completados junto a cada salida (`<salida>.ids`).
+
+Reanudar y consultar el estado releyendo el fichero de resultados completo
+(cientos de MB de explicaciones) acaba costando más que el trabajo que se
+comprueba. El índice es un log append-only con una línea por fila confirmada:
+
+    <id>\\t<offset del diario tras la fila>\\t<etiqueta opcional>
+
+EscritorResultados lo actualiza tras cada tanda, después del fsync del diario:
+una fila está confirmada si y sólo si su línea está en el índice. Al reabrir, lo
+que el diario tenga más allá del último offset indexado (caída entre ambos
+fsync) se trunca y se vuelve a procesar. Leer el índice cuesta lo que ocupan
+los ids, no los resultados: lo usan los runners (reanudación), merge_shards.py
+(salidas(), contar_confirmadas() y escritor_resultados.leer_salida()) y los
+scripts de estado (`grep -c '' salida.ids`).
+"""
+from __future__ import annotations
+
+import glob
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+_TAM_COLA = 4096  # bytes leídos del final para encontrar la última entrada
+
+
+def ruta_indice(ruta_salida: str | Path) -> Path:
+    return Path(ruta_salida).with_suffix(".ids")
+
+
+def leer_ids(ruta_salida: str | Path) -> set:
+    """Ids completados de una salida (conjunto vacío si aún no hay índice)."""
+    return IndiceCompletados(ruta_indice(ruta_salida)).ids()
+
+
+def contar_confirmadas(ruta_salida: str | Path) -> Optional[int]:
+    """Nº de filas confirmadas de una salida (None si no tiene índice)."""
+    indice = IndiceCompletados(ruta_indice(ruta_salida))
+    return indice.contar() if indice.existe() else None
+
+
+def salidas(patron: str) -> list[str]:
+    """Salidas `*.csv` que casan con `patron`, incluidas las que sólo tienen índice (sin CSV aún)."""
+    if not patron.endswith(".csv"):
+        return sorted(glob.glob(patron))
+    con_indice = [str(Path(f).with_suffix(".csv")) for f in glob.glob(patron[:-len(".csv")] + ".ids")]
+    return sorted(set(glob.glob(patron)) | set(con_indice))
+
+
+class IndiceCompletados:
+    """Log `<id>\\t<offset>\\t<etiqueta>`; lo escribe un único hilo (el del escritor)."""
+
+    def __init__(self, ruta: str | Path):
+        self.ruta = Path(ruta)
+
+    def existe(self) -> bool:
+        return self.ruta.exists()
+
+    def _entradas(self) -> Iterable[list[str]]:
+        if not self.ruta.exists():
+            return
+        with open(self.ruta, encoding="utf-8") as f:
+            for linea in f:
+                if not linea.endswith("\n"):
+                    break  # entrada que se está escribiendo ahora mismo
+                campos = linea.rstrip("\n").split("\t")
+                if campos[0]:
+                    yield campos
+
+    def ids(self) -> set:
+        return {campos[0] for campos in self._entradas()}
+
+    def contar(self, etiqueta: Optional[str] = None) -> int:
+        return sum(1 for campos in self._entradas()
+                   if etiqueta is None or (len(campos) > 2 and campos[2] == etiqueta))
+
+    def reparar(self) -> int:
+        """Trunca una última entrada incompleta y devuelve el offset del diario confirmado."""
+        if not self.ruta.exists():
+            return 0
+        with open(self.ruta, "rb+") as f:
+            tam = f.seek(0, os.SEEK_END)
+            f.seek(max(0, tam - _TAM_COLA))
+            cola = f.read()
+            fin = cola.rfind(b"\n") + 1
+            if fin < len(cola):
+                f.truncate(tam - len(cola) + fin)
+        return _offset_final(cola[:fin])
+
+    def offset_confirmado(self) -> int:
+        """Offset del diario tras la última entrada completa, sin tocar el fichero."""
+        if not self.ruta.exists():
+            return 0
+        with open(self.ruta, "rb") as f:
+            tam = f.seek(0, os.SEEK_END)
+            f.seek(max(0, tam - _TAM_COLA))
+            cola = f.read()
+        return _offset_final(cola[:cola.rfind(b"\n") + 1])
+
+    def anotar(self, entradas: list[tuple[str, int, str]]) -> None:
+        """Añade (id, offset, etiqueta) de una tanda ya escrita en el diario, con fsync."""
+        if not entradas:
+            return
+        with open(self.ruta, "a", encoding="utf-8") as f:
+            f.write("".join(f"{_limpiar(i)}\t{off}\t{_limpiar(et)}\n" for i, off, et in entradas))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _offset_final(bloque: bytes) -> int:
+    lineas = bloque.splitlines()
+    if not lineas:
+        return 0
+    campos = lineas[-1].decode("utf-8").split("\t")
+    return int(campos[1]) if len(campos) > 1 and campos[1].isdigit() else 0
+
+
+def _limpiar(valor) -> str:
+    # Un tabulador o salto de línea en el id rompería el formato de línea.
+    return str(valor if valor is not None else "").replace("\t", " ").replace("\n", " ")
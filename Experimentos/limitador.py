@@ -0,0 +1,293 @@
+"""
+Limitador de tasa adaptativo por (proveedor, modelo) para utils.consultar_ollama.
+
+Sustituye al backoff exponencial ciego ante 429: con 8–16 workers todos los hilos
+chocaban a la vez con el límite y se retiraban a la vez (throughput en diente de
+sierra). Aquí todos los hilos/tareas de un mismo modelo comparten dos token
+buckets —peticiones/minuto (RPM) y tokens/minuto (TPM)— y esperan ANTES de la
+llamada, así que el proceso se mantiene justo por debajo de la cuota.
+
+Los límites se obtienen, por orden de preferencia:
+  1. Cabeceras de rate limit de cada respuesta (OpenAI `x-ratelimit-*`,
+     Anthropic `anthropic-ratelimit-*`), que además resincronizan lo restante.
+  2. configurar_limites(rpm=..., tpm=...) desde el runner (Gemini no envía cabeceras).
+  3. AIMD: ante un 429 sin límite conocido, el límite RPM se fija a una fracción
+     de la tasa observada en el último minuto y después crece +1 RPM por minuto
+     de éxitos (aumento aditivo / disminución multiplicativa).
+
+`Retry-After` (y el retryDelay de Gemini) pausa a todos los hilos del modelo, no
+sólo al que recibió el 429. El consumo de tokens se estima antes de la llamada y
+se corrige con el real que registra utils._registrar_consumo.
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+# Disminución multiplicativa del límite RPM aprendido ante un 429.
+FACTOR_DISMINUCION = 0.7
+# Pausa por defecto tras un 429 sin Retry-After (segundos).
+PAUSA_POR_DEFECTO = 2.0
+
+_RE_RETRY_DELAY = re.compile(r"retry[_ ]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+_RE_DURACION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+
+class _Cubo:
+    """Token bucket con capacidad = límite por minuto y recarga continua."""
+
+    def __init__(self):
+        self.limite: Optional[float] = None
+        self.nivel = 0.0
+        self.t = time.monotonic()
+
+    def _recargar(self, ahora: float) -> None:
+        if self.limite is not None:
+            self.nivel = min(self.limite, self.nivel + (ahora - self.t) * self.limite / 60)
+        self.t = ahora
+
+    def espera(self, n: float, ahora: float) -> float:
+        """Segundos hasta que haya `n` unidades (0 si ya las hay o no hay límite)."""
+        self._recargar(ahora)
+        if self.limite is None:
+            return 0.0
+        n = min(n, self.limite)  # una petición mayor que el límite no debe bloquear para siempre
+        return 0.0 if self.nivel >= n else (n - self.nivel) * 60 / self.limite
+
+    def consumir(self, n: float) -> None:
+        self.nivel -= n  # puede quedar negativo: deuda de una estimación corta
+
+    def fijar_limite(self, limite: float, ahora: float) -> None:
+        self._recargar(ahora)
+        if self.limite is None:
+            self.nivel = limite
+        self.limite = float(limite)
+        self.nivel = min(self.nivel, self.limite)
+
+    def fijar_restante(self, restante: float, ahora: float) -> None:
+        self._recargar(ahora)
+        self.nivel = min(self.nivel, float(restante))
+
+
+def _segundos(valor: str) -> Optional[float]:
+    """'1.5' | '6m0s' | '250ms' | fecha RFC 3339 → segundos desde ahora."""
+    valor = (valor or "").strip()
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    partes = _RE_DURACION.findall(valor)
+    if partes and "".join(n + u for n, u in partes) == valor:
+        mult = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * mult[u] for n, u in partes)
+    try:
+        fecha = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+        return max(0.0, (fecha - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        return None
+
+
+def retry_after_de(cabeceras) -> Optional[float]:
+    """Segundos de espera pedidos por el servidor (retry-after-ms / retry-after)."""
+    if not cabeceras:
+        return None
+    ms = cabeceras.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    return _segundos(cabeceras.get("retry-after", ""))
+
+
+def retry_after_de_error(e: Exception) -> Optional[float]:
+    """Retry-After de la respuesta de un error de SDK, o retryDelay de Gemini."""
+    espera = retry_after_de(getattr(getattr(e, "response", None), "headers", None))
+    if espera is None:
+        m = _RE_RETRY_DELAY.search(str(e))
+        if m:
+            espera = float(m.group(1))
+    return espera
+
+
+def es_limite_de_tasa(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    texto = f"{type(e).__name__} {e}".lower()
+    return status == 429 or any(
+        t in texto for t in ("ratelimit", "rate limit", "resource_exhausted", "429"))
+
+
+class Limitador:
+    """RPM + TPM compartidos por todos los hilos/tareas de un (proveedor, modelo)."""
+
+    def __init__(self, proveedor: str, modelo: str):
+        self.proveedor = proveedor
+        self.modelo = modelo
+        self._lock = threading.Lock()
+        self.rpm = _Cubo()
+        self.tpm = _Cubo()
+        self.origen_rpm: Optional[str] = None  # "cabeceras" | "config" | "aimd"
+        self.pausa_hasta = 0.0
+        self._recientes: deque = deque()
+        self.stats = {"peticiones": 0, "esperas": 0, "segundos_espera": 0.0, "limitadas_429": 0}
+
+    # --- configuración ---
+    def configurar(self, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+        ahora = time.monotonic()
+        with self._lock:
+            if rpm:
+                self.rpm.fijar_limite(rpm, ahora)
+                self.origen_rpm = "config"
+            if tpm:
+                self.tpm.fijar_limite(tpm, ahora)
+
+    # --- antes de la llamada ---
+    def _reservar(self, tokens: int) -> float:
+        with self._lock:
+            ahora = time.monotonic()
+            espera = max(self.pausa_hasta - ahora,
+                         self.rpm.espera(1, ahora), self.tpm.espera(tokens, ahora))
+            if espera > 0:
+                return espera
+            self.rpm.consumir(1)
+            self.tpm.consumir(tokens)
+            self._recientes.append(ahora)
+            while self._recientes and self._recientes[0] < ahora - 60:
+                self._recientes.popleft()
+            self.stats["peticiones"] += 1
+            return 0.0
+
+    def _anotar_espera(self, espera: float) -> float:
+        # Jitter pequeño para que los hilos despierten escalonados, no en bloque.
+        espera += random.uniform(0, min(0.25, espera * 0.05))
+        with self._lock:
+            self.stats["esperas"] += 1
+            self.stats["segundos_espera"] += espera
+        return espera
+
+    def adquirir(self, tokens: int = 0) -> None:
+        """Bloquea hasta que la petición cabe en RPM/TPM y no hay pausa por 429."""
+        while True:
+            espera = self._reservar(tokens)
+            if espera <= 0:
+                return
+            time.sleep(self._anotar_espera(espera))
+
+    async def aadquirir(self, tokens: int = 0) -> None:
+        while True:
+            espera = self._reservar(tokens)
+            if espera <= 0:
+                return
+            await asyncio.sleep(self._anotar_espera(espera))
+
+    # --- después de la llamada ---
+    def corregir_tokens(self, real: int, estimado: int) -> None:
+        with self._lock:
+            self.tpm.consumir(real - estimado)
+
+    def exito(self) -> None:
+        """Aumento aditivo: +1 RPM por cada minuto de éxitos (sólo límite aprendido)."""
+        with self._lock:
+            if self.origen_rpm == "aimd" and self.rpm.limite:
+                self.rpm.limite += 1.0 / self.rpm.limite
+
+    def limitado(self, retry_after: Optional[float]) -> None:
+        """429 recibido: pausa global del modelo + disminución multiplicativa."""
+        with self._lock:
+            ahora = time.monotonic()
+            self.stats["limitadas_429"] += 1
+            pausa = retry_after if retry_after is not None else PAUSA_POR_DEFECTO
+            self.pausa_hasta = max(self.pausa_hasta, ahora + pausa)
+            if self.origen_rpm in (None, "aimd"):
+                observado = len([t for t in self._recientes if t >= ahora - 60])
+                base = self.rpm.limite or max(observado, 1)
+                self.rpm.fijar_limite(max(1.0, base * FACTOR_DISMINUCION), ahora)
+                self.rpm.nivel = min(self.rpm.nivel, 0.0)
+                self.origen_rpm = "aimd"
+
+    def actualizar_cabeceras(self, cabeceras) -> None:
+        """Aprende límites y restante de las cabeceras de rate limit de la respuesta."""
+        def _num(*nombres):
+            for n in nombres:
+                v = cabeceras.get(n)
+                if v not in (None, ""):
+                    try:
+                        return float(v)
+                    except ValueError:
+                        pass
+            return None
+
+        lim_req = _num("x-ratelimit-limit-requests", "anthropic-ratelimit-requests-limit")
+        rest_req = _num("x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining")
+        lim_tok = _num("x-ratelimit-limit-tokens", "anthropic-ratelimit-tokens-limit",
+                       "anthropic-ratelimit-input-tokens-limit")
+        rest_tok = _num("x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining",
+                        "anthropic-ratelimit-input-tokens-remaining")
+        if lim_req is None and lim_tok is None:
+            return
+        ahora = time.monotonic()
+        with self._lock:
+            if lim_req:
+                self.rpm.fijar_limite(lim_req, ahora)
+                self.origen_rpm = "cabeceras"
+            if lim_tok:
+                self.tpm.fijar_limite(lim_tok, ahora)
+            if rest_req is not None and self.rpm.limite:
+                self.rpm.fijar_restante(rest_req, ahora)
+            if rest_tok is not None and self.tpm.limite:
+                self.tpm.fijar_restante(rest_tok, ahora)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "segundos_espera": round(self.stats["segundos_espera"], 1),
+                "rpm": round(self.rpm.limite, 1) if self.rpm.limite else None,
+                "tpm": int(self.tpm.limite) if self.tpm.limite else None,
+                "origen_rpm": self.origen_rpm,
+            }
+
+
+_limitadores: dict = {}
+_config: dict = {}
+_lock = threading.Lock()
+
+
+def configurar_limites(proveedor: Optional[str] = None, modelo: Optional[str] = None,
+                       rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+    """
+    Fija RPM/TPM conocidos de antemano (p. ej. la cuota de Gemini, que no envía
+    cabeceras). Sin `proveedor`/`modelo` aplica a todos. Las cabeceras, si llegan,
+    prevalecen sobre estos valores.
+    """
+    with _lock:
+        _config[(proveedor, modelo)] = (rpm, tpm)
+        existentes = [l for (p, m), l in _limitadores.items()
+                      if (proveedor is None or p == proveedor) and (modelo is None or m == modelo)]
+    for lim in existentes:
+        lim.configurar(rpm, tpm)
+
+
+def limitador_de(proveedor: str, modelo: str) -> Limitador:
+    with _lock:
+        lim = _limitadores.get((proveedor, modelo))
+        if lim is None:
+            lim = _limitadores[(proveedor, modelo)] = Limitador(proveedor, modelo)
+            # Configuración más específica al final: modelo > proveedor > global.
+            for clave in ((None, None), (proveedor, None), (None, modelo), (proveedor, modelo)):
+                if clave in _config:
+                    lim.configurar(*_config[clave])
+        return lim
+
+
+def estadisticas() -> dict:
+    with _lock:
+        return {f"{p}/{m}": l.estadisticas() for (p, m), l in _limitadores.items()}
@@ -0,0 +1,243 @@
+"""
+Modo lote (batch API) para corridas offline del corpus completo.
+
+Los benchmarks de 1.313 y ~7k artículos no necesitan latencia interactiva: las
+batch APIs de OpenAI (/v1/batches, JSONL) y Anthropic (Message Batches) tienen
+límites de uso mucho más altos y cuestan la mitad. Este módulo recibe todos los
+prompts (artículo × variable) ya construidos, los sube en uno o varios lotes,
+sondea hasta que terminan y devuelve, por id, la respuesta y el consumo con el
+mismo formato que utils.get_consumo_llamada().
+
+Las peticiones se construyen con los mismos helpers que consultar_ollama
+(utils._peticion_openai / _peticion_anthropic), así que el prompt caching por
+IRIS_CACHE_BREAK y los parámetros de razonamiento son idénticos al modo normal.
+
+Reanudable: los ids de lote enviados (y cuántos lotes hay en total) se guardan en
+`dir_trabajo/lote_<huella>.json`; relanzar el mismo conjunto de prompts sube sólo los
+lotes que faltaran y retoma el sondeo en lugar de reenviar.
+
+Pruebas locales: los SDK respetan OPENAI_BASE_URL / ANTHROPIC_BASE_URL, de modo que
+basta un servidor HTTP local que imite los endpoints de lotes.
+
+Uso:
+    resultados = lotes.ejecutar_lote({"123::masc_generico": prompt, ...}, "gpt-4o-mini",
+                                     dir_trabajo="results/lotes")
+    respuesta, consumo = resultados["123::masc_generico"]
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import time
+from pathlib import Path
+from typing import Optional
+
+import utils
+
+# Límites de cada proveedor por lote (nº de peticiones, bytes del fichero/cuerpo).
+# Se deja margen bajo los máximos documentados (50k/200 MB y 100k/256 MB).
+LIMITES_LOTE = {
+    "openai": (50_000, 190 * 1024 * 1024),
+    "anthropic": (100_000, 240 * 1024 * 1024),
+}
+INTERVALO_SONDEO = 30  # segundos entre consultas de estado
+
+_ESTADOS_FINALES_OPENAI = {"completed", "failed", "expired", "cancelled"}
+
+
+def proveedor_soporta_lote(modelo: str) -> bool:
+    return utils._proveedor_de(modelo) in LIMITES_LOTE
+
+
+def _huella(modelo: str, temperature: float, peticiones: dict[str, str],
+            esquemas: Optional[dict] = None) -> str:
+    h = hashlib.sha256(f"{modelo}\x00{float(temperature)}".encode("utf-8"))
+    for pid in sorted(peticiones):
+        h.update(b"\x00" + pid.encode("utf-8") + b"\x00" + peticiones[pid].encode("utf-8"))
+        if esquemas and pid in esquemas:
+            h.update(b"\x00" + json.dumps(esquemas[pid], sort_keys=True).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _trocear(lineas: list[tuple[str, dict]], proveedor: str) -> list[list[tuple[str, dict]]]:
+    """Parte las peticiones en lotes que respetan los límites del proveedor."""
+    max_n, max_bytes = LIMITES_LOTE[proveedor]
+    trozos, actual, tam = [], [], 0
+    for cid, cuerpo in lineas:
+        b = len(json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")) + 200
+        if actual and (len(actual) >= max_n or tam + b > max_bytes):
+            trozos.append(actual)
+            actual, tam = [], 0
+        actual.append((cid, cuerpo))
+        tam += b
+    if actual:
+        trozos.append(actual)
+    return trozos
+
+
+# -------------------------------------------------------------------------------------
+# OpenAI (/v1/batches sobre /v1/chat/completions)
+# -------------------------------------------------------------------------------------
+def _enviar_openai(client, trozo: list[tuple[str, dict]]) -> str:
+    jsonl = "\n".join(
+        json.dumps({"custom_id": cid, "method": "POST", "url": "/v1/chat/completions",
+                    "body": cuerpo}, ensure_ascii=False)
+        for cid, cuerpo in trozo
+    )
+    fichero = client.files.create(
+        file=("lote.jsonl", io.BytesIO(jsonl.encode("utf-8"))), purpose="batch")
+    lote = client.batches.create(
+        input_file_id=fichero.id, endpoint="/v1/chat/completions", completion_window="24h")
+    return lote.id
+
+
+def _estado_openai(client, lote_id: str) -> tuple[bool, str]:
+    lote = client.batches.retrieve(lote_id)
+    rc = getattr(lote, "request_counts", None)
+    progreso = f"{getattr(rc, 'completed', 0)}/{getattr(rc, 'total', 0)}" if rc else "?"
+    return lote.status in _ESTADOS_FINALES_OPENAI, f"{lote.status} {progreso}"
+
+
+def _recoger_openai(client, lote_id: str) -> dict[str, tuple[str, dict]]:
+    from openai.types.chat import ChatCompletion
+
+    lote = client.batches.retrieve(lote_id)
+    salida = {}
+    for fichero_id in (lote.output_file_id, lote.error_file_id):
+        if not fichero_id:
+            continue
+        for linea in client.files.content(fichero_id).text.splitlines():
+            if not linea.strip():
+                continue
+            item = json.loads(linea)
+            resp = item.get("response") or {}
+            if item.get("error") or resp.get("status_code") != 200:
+                print(f"[lote] {item.get('custom_id')}: error {item.get('error') or resp.get('status_code')}")
+                salida[item["custom_id"]] = ("", dict(utils._CONSUMO_VACIO))
+                continue
+            utils.reset_consumo_llamada()
+            texto = utils._leer_openai(ChatCompletion.model_validate(resp["body"]))
+            salida[item["custom_id"]] = (texto, utils.get_consumo_llamada())
+    return salida
+
+
+# -------------------------------------------------------------------------------------
+# Anthropic (Message Batches)
+# -------------------------------------------------------------------------------------
+def _enviar_anthropic(client, trozo: list[tuple[str, dict]]) -> str:
+    lote = client.messages.batches.create(
+        requests=[{"custom_id": cid, "params": cuerpo} for cid, cuerpo in trozo])
+    return lote.id
+
+
+def _estado_anthropic(client, lote_id: str) -> tuple[bool, str]:
+    lote = client.messages.batches.retrieve(lote_id)
+    rc = lote.request_counts
+    progreso = f"ok={rc.succeeded} err={rc.errored} proc={rc.processing}"
+    return lote.processing_status == "ended", f"{lote.processing_status} {progreso}"
+
+
+def _recoger_anthropic(client, lote_id: str) -> dict[str, tuple[str, dict]]:
+    salida = {}
+    for item in client.messages.batches.results(lote_id):
+        if item.result.type != "succeeded":
+            print(f"[lote] {item.custom_id}: {item.result.type}")
+            salida[item.custom_id] = ("", dict(utils._CONSUMO_VACIO))
+            continue
+        utils.reset_consumo_llamada()
+        texto = utils._leer_anthropic(item.result.message)
+        salida[item.custom_id] = (texto, utils.get_consumo_llamada())
+    return salida
+
+
+_PROVEEDORES = {
+    "openai": (utils._peticion_openai, _enviar_openai, _estado_openai, _recoger_openai),
+    "anthropic": (utils._peticion_anthropic, _enviar_anthropic, _estado_anthropic, _recoger_anthropic),
+}
+
+
+def ejecutar_lote(
+    peticiones: dict[str, str],
+    modelo: str,
+    temperature: float = 0.1,
+    dir_trabajo: str | Path = "lotes",
+    intervalo: float = INTERVALO_SONDEO,
+    max_espera: Optional[float] = None,
+    esquemas: Optional[dict] = None,
+) -> dict[str, tuple[str, dict]]:
+    """
+    Ejecuta `peticiones` ({id: prompt}) por la batch API del proveedor de `modelo`.
+    `esquemas` ({id: modelo Pydantic o JSON Schema}) pide salida estructurada, como
+    el parámetro `esquema` de consultar_ollama.
+    Devuelve {id: (respuesta, consumo)}; las peticiones fallidas quedan con "" (igual
+    que un error en consultar_ollama). Bloquea hasta que todos los lotes terminan o
+    se supera `max_espera` segundos (TimeoutError; relanzar reanuda el sondeo).
+    """
+    proveedor = utils._proveedor_de(modelo)
+    if proveedor not in _PROVEEDORES:
+        raise ValueError(f"El modo lote sólo está disponible para OpenAI y Anthropic (modelo: {modelo}).")
+    if not peticiones:
+        return {}
+    construir, enviar, estado, recoger = _PROVEEDORES[proveedor]
+    client = utils._cliente(proveedor)
+
+    dir_trabajo = Path(dir_trabajo)
+    dir_trabajo.mkdir(parents=True, exist_ok=True)
+    esquemas = {pid: utils._esquema_json(e) for pid, e in (esquemas or {}).items()}
+    ruta_estado = dir_trabajo / f"lote_{_huella(modelo, temperature, peticiones, esquemas)}.json"
+
+    # custom_id propio y corto: Anthropic sólo admite [a-zA-Z0-9_-]{1,64}.
+    ids = sorted(peticiones)
+    mapa = {f"r{i}": pid for i, pid in enumerate(ids)}
+
+    # El estado guarda los lotes subidos y cuántos trozos hay en total: si el proceso
+    # muere entre dos envíos, al reanudar se suben sólo los trozos que faltan.
+    previo = json.loads(ruta_estado.read_text(encoding="utf-8")) if ruta_estado.is_file() else {}
+    lotes_enviados = previo.get("lotes", [])
+    n_trozos = previo.get("n_trozos")
+    if previo:
+        print(f"[lote] Reanudando {len(lotes_enviados)} lote(s) de {ruta_estado.name}")
+    # Sin "n_trozos" (estado de una versión anterior) se vuelve a trocear: el reparto es
+    # determinista, así que un estado completo no reenvía nada.
+    if n_trozos is None or len(lotes_enviados) < n_trozos:
+        lineas = [(cid, construir(peticiones[pid], modelo, temperature, esquemas.get(pid)))
+                  for cid, pid in mapa.items()]
+        trozos = _trocear(lineas, proveedor)
+        for trozo in trozos[len(lotes_enviados):]:
+            lotes_enviados.append(utils._con_reintentos(
+                lambda: enviar(client, trozo), proveedor=proveedor))
+            # Se persiste tras cada envío: un corte a mitad no duplica lotes ya subidos.
+            ruta_estado.write_text(json.dumps(
+                {"modelo": modelo, "proveedor": proveedor, "n_trozos": len(trozos),
+                 "lotes": lotes_enviados}, indent=2), encoding="utf-8")
+        print(f"[lote] {len(peticiones)} peticiones enviadas en {len(lotes_enviados)} lote(s) "
+              f"({proveedor}, {modelo}).")
+
+    t0 = time.time()
+    pendientes = list(lotes_enviados)
+    while pendientes:
+        for lote_id in list(pendientes):
+            terminado, resumen = utils._con_reintentos(
+                lambda: estado(client, lote_id), proveedor=proveedor)
+            print(f"[lote] {lote_id}: {resumen}")
+            if terminado:
+                pendientes.remove(lote_id)
+        if pendientes:
+            if max_espera is not None and time.time() - t0 > max_espera:
+                raise TimeoutError(f"Lotes sin terminar tras {max_espera:.0f}s: {pendientes}. "
+                                   "Relanza el mismo comando para seguir esperando.")
+            time.sleep(intervalo)
+
+    resultados: dict[str, tuple[str, dict]] = {}
+    for lote_id in lotes_enviados:
+        for cid, valor in utils._con_reintentos(
+                lambda: recoger(client, lote_id), proveedor=proveedor).items():
+            if cid in mapa:
+                resultados[mapa[cid]] = valor
+    # Lo que el proveedor no devolvió (lote expirado/cancelado) cuenta como error.
+    for pid in ids:
+        resultados.setdefault(pid, ("", dict(utils._CONSUMO_VACIO)))
+    for valor in resultados.values():
+        valor[1]["lote"] = True
+    return resultados
@@ -0,0 +1,137 @@
+"""
+Planificador de dos niveles: artículos en orden, variables en paralelo, tope global.
+
+Los runners clasificaban las 5 variables de cada artículo una tras otra y sólo
+paralelizaban entre artículos: cada artículo tardaba 5 llamadas seguidas (en el
+agente del Exp 21, hasta 5 × MAX_ITERS turnos), las llamadas de un mismo
+artículo se separaban lo bastante como para salirse del TTL de la caché de
+prompts del proveedor y el progreso avanzaba a saltos.
+
+Aquí el hilo de cada artículo reparte sus variables en un pool común de
+`max_en_vuelo` hilos, que es el tope global de llamadas al modelo en vuelo del
+proceso (lo que antes era --workers). La cola del pool es FIFO, así que las
+variables de los artículos admitidos antes se sirven antes, y basta con admitir
+articulos_en_vuelo(n) artículos para mantener el pool lleno.
+
+Con CALENTAR_PREFIJO la primera variable de cada artículo sale sola y el resto
+en paralelo al terminar ella: la primera escribe en la caché del proveedor el
+prefijo estable del artículo (utils.maquetar_prefijo_estable) y las demás lo
+leen, en lugar de pagarlo las cinco a la vez.
+
+Uso:
+    plan = Planificador(max_en_vuelo=8)
+    with ThreadPoolExecutor(plan.articulos_en_vuelo(5)) as ex:
+        ...  # en el hilo de cada artículo:
+        resultados = plan.repartir(lambda v: clasificar(v, texto), variables)
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+CALENTAR_PREFIJO = True
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class Planificador:
+    """Reparte las tareas de cada artículo en un pool compartido de `max_en_vuelo` hilos."""
+
+    def __init__(self, max_en_vuelo: int, calentar: bool = CALENTAR_PREFIJO):
+        if max_en_vuelo < 1:
+            raise ValueError("max_en_vuelo debe ser >= 1")
+        self.max_en_vuelo = max_en_vuelo
+        self.calentar = calentar
+        self._pool = ThreadPoolExecutor(max_workers=max_en_vuelo, thread_name_prefix="variable")
+        self._semaforos = weakref.WeakKeyDictionary()   # bucle de eventos → Semaphore
+        self._lock = threading.Lock()
+        self._en_vuelo = 0
+        self._stats = {"articulos": 0, "tareas": 0, "pico_en_vuelo": 0}
+
+    def articulos_en_vuelo(self, tareas_por_articulo: int) -> int:
+        """Artículos a admitir a la vez para llenar el pool (+1 que espera turno)."""
+        n = max(1, tareas_por_articulo)
+        return -(-self.max_en_vuelo // n) + (1 if n > 1 else 0)
+
+    # --- hilos ---
+    def _ejecutar(self, fn: Callable[[T], R], item: T) -> R:
+        with self._lock:
+            self._en_vuelo += 1
+            self._stats["tareas"] += 1
+            self._stats["pico_en_vuelo"] = max(self._stats["pico_en_vuelo"], self._en_vuelo)
+        try:
+            return fn(item)
+        finally:
+            with self._lock:
+                self._en_vuelo -= 1
+
+    def _enviar(self, fn, item):
+        # Cada tarea corre en una copia del contexto del artículo (ContextVars de utils).
+        return self._pool.submit(contextvars.copy_context().run, self._ejecutar, fn, item)
+
+    def repartir(self, fn: Callable[[T], R], items: Iterable[T]) -> list[R]:
+        """
+        fn(item) para cada item en el pool; devuelve los resultados en el orden de
+        `items`. Espera a todas las tareas antes de propagar la primera excepción.
+        """
+        items = list(items)
+        with self._lock:
+            self._stats["articulos"] += 1
+        if not items:
+            return []
+        resultados = []
+        if self.calentar and len(items) > 1:
+            resultados.append(self._enviar(fn, items[0]).result())
+            items = items[1:]
+        futuros = [self._enviar(fn, item) for item in items]
+        wait(futuros)
+        return resultados + [f.result() for f in futuros]
+
+    # --- asyncio ---
+    def _semaforo(self) -> asyncio.Semaphore:
+        # Un semáforo por bucle de eventos (asyncio.run crea uno nuevo cada vez); el
+        # semáforo retiene su bucle, así que los de bucles cerrados se descartan aquí.
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._semaforos:
+                for viejo in [b for b in list(self._semaforos.keys()) if b.is_closed()]:
+                    del self._semaforos[viejo]
+                self._semaforos[loop] = asyncio.Semaphore(self.max_en_vuelo)
+            return self._semaforos[loop]
+
+    async def arepartir(self, afn: Callable[[T], Awaitable[R]], items: Iterable[T]) -> list[R]:
+        """Versión asyncio de repartir(): el tope es un semáforo en lugar del pool."""
+        items = list(items)
+        with self._lock:
+            self._stats["articulos"] += 1
+        semaforo = self._semaforo()
+
+        async def _una(item):
+            async with semaforo:
+                with self._lock:
+                    self._en_vuelo += 1
+                    self._stats["tareas"] += 1
+                    self._stats["pico_en_vuelo"] = max(self._stats["pico_en_vuelo"], self._en_vuelo)
+                try:
+                    return await afn(item)
+                finally:
+                    with self._lock:
+                        self._en_vuelo -= 1
+
+        resultados = []
+        if self.calentar and len(items) > 1:
+            resultados.append(await _una(items[0]))
+            items = items[1:]
+        return resultados + list(await asyncio.gather(*(_una(i) for i in items)))
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"max_en_vuelo": self.max_en_vuelo, **self._stats}
+
+    def cerrar(self) -> None:
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,47 @@
+"""
+Prefijo estable de los templates: artículo primero, datos de la variable al final.
+
+Las N variables de un artículo comparten así el prefijo byte a byte: las APIs lo
+reutilizan con prompt caching (utils parte el prompt por IRIS_CACHE_BREAK) y Ollama
+reaprovecha su KV cache entre llamadas.
+
+Lo comparten Experimentos/utils.py y los utils de los experimentos que construyen
+sus propios prompts (experimento_interspeech).
+"""
+from __future__ import annotations
+
+import re
+
+# Separador en prompts (p. ej. prompt_clara.md): prefijo cacheable (artículo) + sufijo por variable.
+# Debe coincidir literalmente con el marcador del template.
+IRIS_CACHE_BREAK = "<<<IRIS_CACHE_BREAK>>>"
+
+_RE_PLACEHOLDER = re.compile(r"(?<!\{)\{(\w+)\}(?!\})")
+_RE_BLOQUES = re.compile(r"\n[ \t]*\n")
+
+
+def maquetar_prefijo_estable(template: str) -> str:
+    """
+    Reordena un template para que todo lo común a las N variables de un artículo
+    vaya primero y lo específico de la variable al final, separados por
+    IRIS_CACHE_BREAK (el mismo contrato que prompt_clara.md).
+
+    Por bloques (separados por línea en blanco): el prefijo son los bloques
+    estáticos iniciales (rol, mentalidad) más el bloque de {texto_input}; el resto
+    va después del marcador en su orden original. Los templates que ya llevan el
+    marcador, o en los que {texto_input} comparte bloque con datos de la variable,
+    se devuelven sin tocar.
+    """
+    if IRIS_CACHE_BREAK in template:
+        return template
+    bloques = _RE_BLOQUES.split(template.strip())
+    campos = [set(_RE_PLACEHOLDER.findall(b)) for b in bloques]
+    i_texto = next((i for i, c in enumerate(campos) if "texto_input" in c), None)
+    if i_texto is None or campos[i_texto] != {"texto_input"}:
+        return template
+    n_estaticos = next((i for i, c in enumerate(campos) if c), len(bloques))
+    prefijo = bloques[:n_estaticos] + [bloques[i_texto]]
+    sufijo = [b for i, b in enumerate(bloques) if i >= n_estaticos and i != i_texto]
+    if not sufijo:
+        return template
+    return "\n\n".join(prefijo + [IRIS_CACHE_BREAK] + sufijo) + "\n"
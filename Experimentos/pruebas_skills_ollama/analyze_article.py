@@ -30,6 +30,9 @@ from langchain_ollama import ChatOllama
 from pydantic import BaseModel, Field
 
 _ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(_ROOT.parent))
+import evidencias  # noqa: E402  (Experimentos/evidencias.py: offsets de los excerpts)
+
 # Las guías de lenguaje se movieron a Experimentos/methodology/ (antes en esta carpeta de pruebas).
 _METHODOLOGY_DIR = _ROOT.parent / "methodology"
 _DEFAULT_MANIFEST = _METHODOLOGY_DIR / "methodology_manifest.json"
@@ -114,6 +117,22 @@ def limpiar_json(texto: str | dict) -> dict:
     return {"raw": texto, "error": "No se pudo parsear el JSON"}
 
 
+def anclar_findings(findings: list, article_text: str) -> None:
+    """Recoloca start/end de cada hallazgo donde su excerpt aparece en el artículo.
+
+    Los offsets que devuelve el modelo no son fiables; el excerpt sí suele serlo
+    (salvo comillas, tildes o espacios). Si no se encuentra, se dejan los del modelo.
+    """
+    idx = evidencias.indice(article_text)
+    for f in findings:
+        if not isinstance(f, dict):
+            continue
+        c = idx.buscar(f.get("excerpt") or "")
+        if c is not None:
+            f["start"], f["end"] = c.ini, c.fin
+            f["excerpt"] = idx.literal(c)
+
+
 def _safe_guide_path(methodology_dir: Path, name: str) -> Path:
     """Evita path traversal; name es relativo (solo nombre o subruta bajo methodology)."""
     methodology_dir = methodology_dir.resolve()
@@ -352,6 +371,8 @@ def main() -> None:
 
     if isinstance(parsed, dict) and isinstance(parsed.get("article_meta"), dict):
         parsed["article_meta"]["longitud_caracteres"] = len(article_text)
+    if isinstance(parsed, dict) and isinstance(parsed.get("findings"), list):
+        anclar_findings(parsed["findings"], article_text)
 
     out_json = json.dumps(parsed, indent=2, ensure_ascii=False)
     print(out_json)
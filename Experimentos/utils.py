@@ -1,18 +1,29 @@
 
+import copy
+import functools
 import json
 import configparser
+import contextvars
 import threading
+import weakref
 from pydantic import BaseModel, Field, ValidationError
 from typing import Optional, Any, List, Dict, Union
 import re
 import ollama
 from pathlib import Path
 
+import contexto_ollama
+import cortacircuitos
+from prefijo_estable import IRIS_CACHE_BREAK, maquetar_prefijo_estable
+import limitador
+
 # Ruta al config.ini (junto a este utils.py) con la sección [API-KEYS].
 _CONFIG_PATH = Path(__file__).resolve().parent / "config.ini"
 
-# Consumo de la última llamada a consultar_ollama (thread-local, para CSV/métricas).
-_tls_consumo = threading.local()
+# Consumo de la última llamada a consultar_ollama (para CSV/métricas). ContextVar en
+# lugar de threading.local: aísla igual cada hilo y, además, cada tarea de asyncio
+# (aconsultar), donde muchos artículos comparten un mismo hilo.
+_consumo_ctx: contextvars.ContextVar = contextvars.ContextVar("consumo_llamada", default=None)
 _CONSUMO_VACIO = {
     "prompt_tokens": 0,
     "completion_tokens": 0,
@@ -24,12 +35,18 @@ _CONSUMO_VACIO = {
 
 def reset_consumo_llamada() -> None:
     """Pone a cero el consumo de la última llamada (llamar antes de cada variable)."""
-    _tls_consumo.last = dict(_CONSUMO_VACIO)
+    _consumo_ctx.set(dict(_CONSUMO_VACIO))
 
 
 def get_consumo_llamada() -> dict:
     """Devuelve el consumo de la última consulta (prompt/completion/cache_*)."""
-    return dict(getattr(_tls_consumo, "last", None) or _CONSUMO_VACIO)
+    return dict(_consumo_ctx.get() or _CONSUMO_VACIO)
+
+
+# (Limitador, tokens estimados) de la llamada en curso: lo fija _con_reintentos y lo
+# consumen el hook de respuesta httpx (cabeceras de rate limit) y _registrar_consumo
+# (corrección de la estimación de tokens con el consumo real).
+_limitacion_ctx: contextvars.ContextVar = contextvars.ContextVar("limitacion_llamada", default=None)
 
 
 def _registrar_consumo(
@@ -39,14 +56,91 @@ def _registrar_consumo(
     cache_read_tokens: int = 0,
     cache_creation_tokens: int = 0,
     proveedor: str = "",
+    contabilizar: bool = True,
 ) -> None:
-    _tls_consumo.last = {
+    """`contabilizar=False`: consumo reexpuesto (caché de respuestas), no una llamada real."""
+    en_curso = _limitacion_ctx.get()
+    if en_curso is not None:
+        lim, estimado = en_curso
+        lim.corregir_tokens(int(prompt_tokens or 0) + int(completion_tokens or 0), estimado)
+        _limitacion_ctx.set(None)
+    _consumo_ctx.set({
         "prompt_tokens": int(prompt_tokens or 0),
         "completion_tokens": int(completion_tokens or 0),
         "cache_read_tokens": int(cache_read_tokens or 0),
         "cache_creation_tokens": int(cache_creation_tokens or 0),
         "proveedor": proveedor or "",
-    }
+    })
+    if contabilizar and proveedor in _PROVEEDORES_CON_CACHE:
+        _anotar_cache_prompt(proveedor, int(prompt_tokens or 0),
+                             int(cache_read_tokens or 0), int(cache_creation_tokens or 0))
+
+
+# =====================================================================================
+# Informe de eficiencia del prompt caching (por proveedor, toda la corrida)
+# =====================================================================================
+# El caché de prefijo de los proveedores cobra los tokens leídos a una fracción del
+# precio de entrada, pero sólo si el prefijo es idéntico byte a byte entre llamadas.
+# Aquí se acumula, por proveedor, qué parte de la entrada salió de caché.
+_PROVEEDORES_CON_CACHE = ("openai", "anthropic", "gemini")
+_stats_cache_prompt: dict = {}
+_cache_prompt_lock = threading.Lock()
+
+
+def _anotar_cache_prompt(proveedor: str, prompt_tokens: int, leidos: int, creados: int) -> None:
+    # Anthropic cuenta aparte los tokens leídos/escritos en caché (input_tokens no
+    # los incluye); OpenAI y Gemini los incluyen dentro de prompt_tokens.
+    entrada = prompt_tokens + (leidos + creados if proveedor == "anthropic" else 0)
+    with _cache_prompt_lock:
+        st = _stats_cache_prompt.setdefault(proveedor, {
+            "llamadas": 0, "con_acierto": 0, "tokens_entrada": 0,
+            "tokens_leidos_cache": 0, "tokens_escritos_cache": 0})
+        st["llamadas"] += 1
+        st["con_acierto"] += int(leidos > 0)
+        st["tokens_entrada"] += entrada
+        st["tokens_leidos_cache"] += leidos
+        st["tokens_escritos_cache"] += creados
+
+
+def estadisticas_cache_prompt() -> dict:
+    """
+    Por proveedor: llamadas, llamadas con acierto de caché, tokens de entrada totales,
+    leídos de caché, escritos en caché y ratio_acierto_tokens (leídos / entrada).
+    """
+    with _cache_prompt_lock:
+        return {
+            proveedor: {**st, "ratio_acierto_tokens": (
+                round(st["tokens_leidos_cache"] / st["tokens_entrada"], 3)
+                if st["tokens_entrada"] else None)}
+            for proveedor, st in _stats_cache_prompt.items()
+        }
+
+
+def imprimir_estadisticas_cache_prompt() -> None:
+    """Resumen legible de estadisticas_cache_prompt() para el final de los runners."""
+    for proveedor, st in estadisticas_cache_prompt().items():
+        print(f"  Caché de prompt {proveedor:<9}: {st['con_acierto']}/{st['llamadas']} llamadas con acierto · "
+              f"{st['tokens_leidos_cache']}/{st['tokens_entrada']} tokens de entrada desde caché "
+              f"(ratio={st['ratio_acierto_tokens']}) · escritos={st['tokens_escritos_cache']}")
+
+
+# config.ini parseado una sola vez; se relee sólo si cambia su mtime.
+_config_cache: dict = {"mtime": None, "parser": None}
+_config_lock = threading.Lock()
+
+
+def _leer_config() -> Optional[configparser.ConfigParser]:
+    try:
+        mtime = _CONFIG_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+    with _config_lock:
+        if _config_cache["mtime"] != mtime:
+            parser = configparser.ConfigParser()
+            parser.read(_CONFIG_PATH, encoding="utf-8")
+            _config_cache["parser"] = parser
+            _config_cache["mtime"] = mtime
+        return _config_cache["parser"]
 
 
 def _get_api_key(nombre: str) -> Optional[str]:
@@ -56,8 +150,8 @@ def _get_api_key(nombre: str) -> Optional[str]:
     use la variable de entorno correspondiente como fallback.
     """
     try:
-        parser = configparser.ConfigParser()
-        if not parser.read(_CONFIG_PATH, encoding="utf-8"):
+        parser = _leer_config()
+        if parser is None:
             return None
         valor = parser.get("API-KEYS", nombre, fallback="").strip()
         return valor or None
@@ -65,43 +159,368 @@ def _get_api_key(nombre: str) -> Optional[str]:
         return None
 
 
-def _con_reintentos(fn, *, intentos: int = 5, base: float = 1.0, proveedor: str = ""):
+# =====================================================================================
+# Pool de clientes de proveedor (uno por proveedor y credencial, keep-alive)
+# =====================================================================================
+# Crear un OpenAI/Anthropic/genai.Client por llamada paga handshake TLS y
+# construcción del SDK en cada artículo×variable. Aquí se crea uno por
+# (proveedor, api_key) y se reutiliza desde todos los hilos (los tres SDK son
+# thread-safe). El pool HTTP se dimensiona con configurar_pool(--workers).
+_POOL_MAX_CONEXIONES = 8
+_clientes: dict = {}
+_clientes_http: dict = {}
+_clientes_lock = threading.Lock()
+_stats_pool: dict = {}
+_stats_lock = threading.Lock()
+
+
+def configurar_pool(max_conexiones: int) -> None:
+    """
+    Fija el tamaño del pool keep-alive por proveedor (normalmente = --workers).
+    Llamar antes de la primera consulta: los clientes ya creados no se redimensionan.
+    """
+    global _POOL_MAX_CONEXIONES
+    _POOL_MAX_CONEXIONES = max(1, int(max_conexiones))
+
+
+def _stats_de(proveedor: str) -> dict:
+    with _stats_lock:
+        return _stats_pool.setdefault(
+            proveedor, {"peticiones": 0, "conexiones_nuevas": 0})
+
+
+def _opciones_httpx(proveedor: str, n: Optional[int] = None, asincrono: bool = False) -> dict:
+    """
+    kwargs de httpx.Client/AsyncClient: límites del pool + hooks de estadísticas.
+    Con `asincrono` los hooks son corrutinas (httpx/httpcore async las esperan).
+    """
+    import httpx
+
+    stats = _stats_de(proveedor)
+
+    def _contar(evento):
+        # httpcore emite 'connection.connect_tcp.complete' sólo al abrir conexión nueva.
+        if evento == "connection.connect_tcp.complete":
+            with _stats_lock:
+                stats["conexiones_nuevas"] += 1
+
+    def _traza(evento, info):
+        _contar(evento)
+
+    async def _atraza(evento, info):
+        _contar(evento)
+
+    def _al_pedir(request):
+        request.extensions["trace"] = _atraza if asincrono else _traza
+        with _stats_lock:
+            stats["peticiones"] += 1
+
+    async def _al_pedir_async(request):
+        _al_pedir(request)
+
+    def _al_responder(response):
+        # Cabeceras x-ratelimit-* / anthropic-ratelimit-* → límites del modelo en curso.
+        en_curso = _limitacion_ctx.get()
+        if en_curso is not None:
+            en_curso[0].actualizar_cabeceras(response.headers)
+
+    async def _al_responder_async(response):
+        _al_responder(response)
+
+    n = n or _POOL_MAX_CONEXIONES
+    return {
+        "limits": httpx.Limits(
+            max_connections=n, max_keepalive_connections=n, keepalive_expiry=120),
+        "event_hooks": {
+            "request": [_al_pedir_async if asincrono else _al_pedir],
+            "response": [_al_responder_async if asincrono else _al_responder],
+        },
+    }
+
+
+def _crear_cliente(proveedor: str, api_key: Optional[str]):
+    if proveedor == "openai":
+        from openai import OpenAI, DefaultHttpxClient
+        http = DefaultHttpxClient(**_opciones_httpx(proveedor))
+        return OpenAI(api_key=api_key, http_client=http), http
+    if proveedor == "anthropic":
+        from anthropic import Anthropic, DefaultHttpxClient
+        http = DefaultHttpxClient(**_opciones_httpx(proveedor))
+        return Anthropic(api_key=api_key, http_client=http), http
+    if proveedor == "gemini":
+        from google import genai
+        from google.genai import types
+        try:
+            opciones = types.HttpOptions(client_args=_opciones_httpx(proveedor))
+            return genai.Client(api_key=api_key, http_options=opciones), None
+        except Exception:
+            # google-genai antiguo sin client_args: se reutiliza igual, sin stats.
+            return genai.Client(api_key=api_key), None
+    raise ValueError(f"Proveedor desconocido: {proveedor!r}")
+
+
+def _cliente(proveedor: str):
+    """Devuelve el cliente compartido del proveedor para la credencial vigente."""
+    api_key = _get_api_key(f"{proveedor}_api_key")
+    clave = (proveedor, api_key)
+    cliente = _clientes.get(clave)
+    if cliente is not None:
+        return cliente
+    with _clientes_lock:
+        if clave not in _clientes:
+            cliente, http = _crear_cliente(proveedor, api_key)
+            _clientes[clave] = cliente
+            _clientes_http[clave] = http
+        return _clientes[clave]
+
+
+def _conexiones_abiertas(http) -> Optional[int]:
+    """Conexiones en el pool de un cliente httpx; None si su API interna (privada) cambia."""
+    pool = getattr(getattr(http, "_transport", None), "_pool", None)
+    conexiones = getattr(pool, "connections", None)
+    return len(conexiones) if hasattr(conexiones, "__len__") else None
+
+
+def estadisticas_pool() -> dict:
+    """
+    Estadísticas por proveedor: peticiones HTTP, conexiones nuevas, conexiones
+    abiertas ahora mismo y ratio de reutilización (1 - nuevas/peticiones).
+    """
+    abiertas: dict = {}
+    with _clientes_lock:
+        for (proveedor, _), http in _clientes_http.items():
+            n = _conexiones_abiertas(http)
+            if n is not None:
+                abiertas[proveedor] = abiertas.get(proveedor, 0) + n
+    salida = {}
+    with _stats_lock:
+        for proveedor, st in _stats_pool.items():
+            pet = st["peticiones"]
+            salida[proveedor] = {
+                "peticiones": pet,
+                "conexiones_nuevas": st["conexiones_nuevas"],
+                "conexiones_abiertas": abiertas.get(proveedor),
+                "ratio_reutilizacion": (
+                    round(1 - st["conexiones_nuevas"] / pet, 3) if pet else None),
+            }
+    return salida
+
+
+def imprimir_estadisticas_pool() -> None:
+    """Resumen legible de estadisticas_pool() para el final de los runners."""
+    for proveedor, st in estadisticas_pool().items():
+        print(f"  Pool {proveedor:<9}: {st['peticiones']} peticiones · "
+              f"{st['conexiones_nuevas']} conexiones nuevas · "
+              f"abiertas={st['conexiones_abiertas']} · "
+              f"reutilización={st['ratio_reutilizacion']}")
+
+
+def _es_transitorio(e: Exception) -> bool:
+    """¿Es un error que merece reintento? (rate limit, sobrecarga, red)"""
+    nombre_err = type(e).__name__.lower()
+    texto_err = str(e).lower()
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    return (
+        status in (408, 409, 425, 429, 500, 502, 503, 504)
+        or any(t in nombre_err for t in ("ratelimit", "timeout", "connection", "overloaded", "apierror", "serviceunavailable", "internalserver"))
+        or any(t in texto_err for t in ("rate limit", "overloaded", "timeout", "temporarily", "try again", "503", "429"))
+    )
+
+
+# Ablación: False → sin limitador compartido (sólo backoff exponencial por hilo).
+USAR_LIMITADOR = True
+
+
+def configurar_limites(rpm: Optional[float] = None, tpm: Optional[float] = None,
+                       proveedor: Optional[str] = None, modelo: Optional[str] = None) -> None:
+    """RPM/TPM conocidos de antemano (ver limitador.configurar_limites)."""
+    limitador.configurar_limites(proveedor, modelo, rpm=rpm, tpm=tpm)
+
+
+def estadisticas_limitador() -> dict:
+    return limitador.estadisticas()
+
+
+def imprimir_estadisticas_limitador() -> None:
+    """Resumen legible del limitador (esperas previas frente a 429 recibidos)."""
+    for clave, st in estadisticas_limitador().items():
+        print(f"  Limitador {clave}: {st['peticiones']} peticiones · "
+              f"{st['esperas']} esperas ({st['segundos_espera']}s) · "
+              f"429={st['limitadas_429']} · rpm={st['rpm']} ({st['origen_rpm']}) · tpm={st['tpm']}")
+
+
+# Ablación: False → sin corta-circuitos (cada llamada fallida acaba en una fila codigo=1).
+USAR_CORTACIRCUITOS = True
+
+
+def configurar_cortacircuitos(max_pausa: Optional[float] = None,
+                              umbral_error: Optional[float] = None) -> None:
+    """Pausa máxima antes de abortar y tasa de error que abre (ver cortacircuitos.py)."""
+    cortacircuitos.configurar(max_pausa=max_pausa, umbral_error=umbral_error)
+
+
+def estadisticas_cortacircuitos() -> dict:
+    return cortacircuitos.estadisticas()
+
+
+def imprimir_estadisticas_cortacircuitos() -> None:
+    """Aperturas y tiempo en pausa por proveedor/endpoint (final de los runners)."""
+    for clave, st in estadisticas_cortacircuitos().items():
+        print(f"  Circuito {clave}: {st['llamadas']} llamadas · {st['fallos']} fallos · "
+              f"{st['aperturas']} aperturas · pausa={st['segundos_pausa']}s · {st['estado']}")
+
+
+def _circuitos_para(proveedor: str, modelo: str) -> list:
+    if not USAR_CORTACIRCUITOS or not proveedor:
+        return []
+    return cortacircuitos.circuitos_de(proveedor, modelo)
+
+
+def _soltar_sondeos(admitidos: list) -> None:
+    """Devuelve los sondeos admitidos sin resultado (cancelación, Ctrl-C, otro circuito cerrado)."""
+    for c, sondeo in admitidos:
+        if sondeo:
+            c.liberar()
+
+
+def _protegido(fn, proveedor: str, modelo: str):
+    """fn() tras pasar los circuitos del proveedor y del endpoint (bloquea si están abiertos)."""
+    admitidos = []
+    try:
+        for c in _circuitos_para(proveedor, modelo):
+            admitidos.append((c, c.permitir()))
+    except BaseException:           # CircuitoAbierto en el endpoint tras admitir al proveedor
+        _soltar_sondeos(admitidos)
+        raise
+    try:
+        resultado = fn()
+    except Exception as e:
+        for c, _ in admitidos:
+            c.fallo(e)
+        raise
+    except BaseException:           # KeyboardInterrupt: la llamada no dice nada del proveedor
+        _soltar_sondeos(admitidos)
+        raise
+    for c, _ in admitidos:
+        c.exito()
+    return resultado
+
+
+async def _aprotegido(fn, proveedor: str, modelo: str):
+    """Como _protegido, pero `fn()` devuelve un awaitable."""
+    admitidos = []
+    try:
+        for c in _circuitos_para(proveedor, modelo):
+            admitidos.append((c, await c.apermitir()))
+    except BaseException:
+        _soltar_sondeos(admitidos)
+        raise
+    try:
+        resultado = await fn()
+    except Exception as e:
+        for c, _ in admitidos:
+            c.fallo(e)
+        raise
+    except BaseException:           # asyncio.CancelledError, KeyboardInterrupt
+        _soltar_sondeos(admitidos)
+        raise
+    for c, _ in admitidos:
+        c.exito()
+    return resultado
+
+
+def _estimar_tokens(prompt: str) -> int:
+    """Estimación previa para el bucket TPM (~4 caracteres/token + margen de salida)."""
+    return len(prompt) // 4 + 256
+
+
+def _limitador_para(proveedor: str, modelo: str):
+    if not USAR_LIMITADOR or not modelo or proveedor in ("", "ollama"):
+        return None
+    return limitador.limitador_de(proveedor, modelo)
+
+
+def _espera_reintento(e: Exception, n: int, base: float, lim) -> float:
+    """
+    Segundos a esperar antes del reintento `n`. Un 429 con limitador activo se
+    delega en él (pausa compartida por todos los hilos del modelo): aquí no se duerme.
+    """
+    import random
+    if lim is not None and limitador.es_limite_de_tasa(e):
+        lim.limitado(limitador.retry_after_de_error(e))
+        return 0.0
+    return base * (2 ** n) + random.uniform(0, base)
+
+
+def _con_reintentos(fn, *, intentos: int = 5, base: float = 1.0, proveedor: str = "",
+                    modelo: str = "", tokens: int = 0):
     """
     Ejecuta `fn()` reintentando ante errores transitorios (rate limit / 5xx /
-    timeouts) con backoff exponencial + jitter. Pensado para saturar las APIs con
-    muchos workers sin que un 429 tumbe el artículo.
+    timeouts). Con `modelo`, la llamada pasa antes por el limitador compartido del
+    (proveedor, modelo), que reparte RPM/TPM entre todos los hilos y pausa a todos
+    ante un 429; los 5xx/timeouts siguen con backoff exponencial + jitter. Cada
+    intento pasa por los corta-circuitos del proveedor y del modelo.
 
     - `intentos`: nº máximo de intentos totales.
     - `base`: segundos base del backoff (espera ~ base * 2**n + jitter).
+    - `tokens`: estimación de tokens de la llamada (bucket TPM).
     Reeleva la excepción si se agotan los intentos.
     """
     import time
-    import random
 
+    lim = _limitador_para(proveedor, modelo)
     for n in range(intentos):
+        if lim is not None:
+            lim.adquirir(tokens)
+            _limitacion_ctx.set((lim, tokens))
         try:
-            return fn()
+            resultado = _protegido(fn, proveedor, modelo)
         except Exception as e:
-            # ¿Es un error que merece reintento? (rate limit, sobrecarga, red)
-            nombre_err = type(e).__name__.lower()
-            texto_err = str(e).lower()
-            status = getattr(e, "status_code", None) or getattr(e, "code", None)
-            transitorio = (
-                status in (408, 409, 425, 429, 500, 502, 503, 504)
-                or any(t in nombre_err for t in ("ratelimit", "timeout", "connection", "overloaded", "apierror", "serviceunavailable", "internalserver"))
-                or any(t in texto_err for t in ("rate limit", "overloaded", "timeout", "temporarily", "try again", "503", "429"))
-            )
-            if not transitorio or n == intentos - 1:
+            _limitacion_ctx.set(None)
+            if isinstance(e, cortacircuitos.CircuitoAbierto) or not _es_transitorio(e) \
+                    or n == intentos - 1:
                 raise
-            espera = base * (2 ** n) + random.uniform(0, base)
-            print(f"[reintento {n+1}/{intentos-1}] {proveedor} {type(e).__name__}: espero {espera:.1f}s")
+            espera = _espera_reintento(e, n, base, lim)
+            print(f"[reintento {n+1}/{intentos-1}] {proveedor} {type(e).__name__}"
+                  + (f": espero {espera:.1f}s" if espera else ": limitador"))
             time.sleep(espera)
+            continue
+        if lim is not None:
+            lim.exito()
+        return resultado
+
+
+async def _acon_reintentos(fn, *, intentos: int = 5, base: float = 1.0, proveedor: str = "",
+                           modelo: str = "", tokens: int = 0):
+    """Como _con_reintentos, pero `fn()` devuelve un awaitable y se espera sin bloquear."""
+    import asyncio
+
+    lim = _limitador_para(proveedor, modelo)
+    for n in range(intentos):
+        if lim is not None:
+            await lim.aadquirir(tokens)
+            _limitacion_ctx.set((lim, tokens))
+        try:
+            resultado = await _aprotegido(fn, proveedor, modelo)
+        except Exception as e:
+            _limitacion_ctx.set(None)
+            if isinstance(e, cortacircuitos.CircuitoAbierto) or not _es_transitorio(e) \
+                    or n == intentos - 1:
+                raise
+            espera = _espera_reintento(e, n, base, lim)
+            print(f"[reintento {n+1}/{intentos-1}] {proveedor} {type(e).__name__}"
+                  + (f": espero {espera:.1f}s" if espera else ": limitador"))
+            await asyncio.sleep(espera)
+            continue
+        if lim is not None:
+            lim.exito()
+        return resultado
+
 
 CLAUDE_API_MODEL_ID = "claude-haiku-4-5-20251001"
 
-# Separador en prompts (p. ej. prompt_clara.md): prefijo cacheable (artículo) + sufijo por variable.
-# Debe coincidir literalmente con el marcador del template.
-IRIS_CACHE_BREAK = "<<<IRIS_CACHE_BREAK>>>"
+# El separador IRIS_CACHE_BREAK (prefijo cacheable + sufijo por variable) y
+# maquetar_prefijo_estable viven en prefijo_estable.py.
 
 # IDs que deben ir a la API de Anthropic (no a Ollama). Ampliar aquí si añades más variantes Claude vía API.
 CLAUDE_API_MODEL_IDS = frozenset(
@@ -132,6 +551,11 @@ def _partir_prompt_cache(prompt: str) -> tuple[Optional[str], Optional[str]]:
         return None, None
     return prefijo, sufijo
 
+
+# Ablación: False → los templates sin IRIS_CACHE_BREAK se usan tal cual (el artículo
+# queda donde lo ponga el template y no hay prefijo cacheable).
+USAR_PREFIJO_ESTABLE = True
+
 # Modelos de razonamiento de OpenAI (familia GPT-5 / o*): NO aceptan `temperature`
 # distinto del valor por defecto y usan `max_completion_tokens`.
 OPENAI_REASONING_MODEL_IDS = frozenset(
@@ -197,7 +621,104 @@ GEMINI_API_MODEL_IDS = frozenset(
 
 
 
-def consultar_ollama(prompt: str, modelo: str = "gemma3:4b", temperature: float = 0) -> str:
+def _proveedor_de(modelo: str) -> str:
+    """Proveedor al que enruta consultar_ollama según el ID del modelo."""
+    if modelo in GEMINI_API_MODEL_IDS:
+        return "gemini"
+    if modelo in OPENAI_API_MODEL_IDS:
+        return "openai"
+    if modelo in CLAUDE_API_MODEL_IDS:
+        return "anthropic"
+    return "ollama"
+
+
+# Caché persistente de respuestas (opt-in, ver activar_cache_respuestas).
+_cache_respuestas = None
+
+
+def activar_cache_respuestas(ruta, max_mb: Optional[float] = None,
+                             max_dias: Optional[float] = None) -> None:
+    """
+    Activa la caché en disco delante de consultar_ollama (SQLite, ver
+    cache_respuestas.py). Un prompt byte-idéntico (mismo modelo, temperatura y
+    opciones) no vuelve a llamar al proveedor; el consumo guardado se reexpone en
+    get_consumo_llamada() para que el CSV siga teniendo tokens/coste.
+    """
+    global _cache_respuestas
+    from cache_respuestas import CacheRespuestas
+    _cache_respuestas = CacheRespuestas(ruta, max_mb=max_mb, max_dias=max_dias)
+
+
+def estadisticas_cache_respuestas() -> Optional[dict]:
+    return _cache_respuestas.estadisticas() if _cache_respuestas is not None else None
+
+
+def _opciones_proveedor(modelo: str, max_tokens: Optional[int] = None,
+                        esquema: Optional[dict] = None, cortar_en: Optional[str] = None) -> dict:
+    """Opciones de petición que, además del prompt, determinan la respuesta."""
+    opciones = {"proveedor": _proveedor_de(modelo)}
+    if opciones["proveedor"] == "ollama":
+        # num_ctx no entra: se elige por buckets y sólo afecta si hay truncado (se reporta).
+        opciones["num_predict"] = max_tokens or OLLAMA_NUM_PREDICT
+    if esquema:
+        opciones["esquema"] = esquema
+    if cortar_en and opciones["proveedor"] == "ollama":
+        opciones["cortar_en"] = cortar_en
+    return opciones
+
+
+def _clave_cache(prompt: str, modelo: str, temperature: float,
+                 max_tokens: Optional[int] = None, esquema: Optional[dict] = None,
+                 cortar_en: Optional[str] = None) -> str:
+    from cache_respuestas import clave_respuesta
+    prefijo, sufijo = _partir_prompt_cache(prompt)
+    partes = (prefijo, sufijo) if prefijo and sufijo else (prompt,)
+    return clave_respuesta(modelo, partes, temperature,
+                           _opciones_proveedor(modelo, max_tokens, esquema, cortar_en))
+
+
+def _obtener_cache(clave: str):
+    """(respuesta, consumo) de la caché o None; sólo E/S (se puede llevar a un hilo)."""
+    try:
+        return _cache_respuestas.obtener(clave)
+    except Exception as e:  # la caché nunca debe tumbar una clasificación
+        print(f"[cache] lectura fallida ({e}); se consulta al proveedor.")
+        return None
+
+
+def _leer_cache(clave: str) -> Optional[str]:
+    """Respuesta cacheada (y su consumo reexpuesto) o None."""
+    return _reexponer_cache(_obtener_cache(clave))
+
+
+async def _aleer_cache(clave: str) -> Optional[str]:
+    """Como _leer_cache, con la lectura SQLite fuera del bucle de eventos."""
+    import asyncio
+    # El consumo se reexpone aquí, en el contexto de la tarea (no en el del hilo).
+    return _reexponer_cache(await asyncio.to_thread(_obtener_cache, clave))
+
+
+def _reexponer_cache(guardada) -> Optional[str]:
+    if guardada is None:
+        return None
+    respuesta, consumo = guardada
+    _registrar_consumo(**{k: consumo.get(k, v) for k, v in _CONSUMO_VACIO.items()},
+                       contabilizar=False)
+    return respuesta
+
+
+def _escribir_cache(clave: str, modelo: str, respuesta: str) -> None:
+    if not respuesta:  # "" = error de proveedor: no se cachea
+        return
+    try:
+        _cache_respuestas.guardar(clave, modelo, respuesta, get_consumo_llamada())
+    except Exception as e:
+        print(f"[cache] escritura fallida: {e}")
+
+
+def consultar_ollama(prompt: str, modelo: str = "gemma3:4b", temperature: float = 0,
+                     max_tokens: Optional[int] = None, esquema=None,
+                     cortar_en: Optional[str] = None) -> str:
     """
     Envía el prompt a Ollama salvo que `modelo` sea una API externa:
       - Claude (Anthropic): usa `ANTHROPIC_API_KEY` en el entorno.
@@ -208,169 +729,840 @@ def consultar_ollama(prompt: str, modelo: str = "gemma3:4b", temperature: float
 
     Tras cada llamada, el consumo queda en get_consumo_llamada() (prompt/completion/
     cache_read/cache_creation tokens) para poder guardarlo en el CSV.
+
+    Los clientes de API se reutilizan entre llamadas e hilos (ver _cliente()).
+    Si se activó activar_cache_respuestas(), los prompts ya vistos salen de disco.
+
+    `max_tokens`: tope de salida en Ollama (num_predict; por defecto
+    OLLAMA_NUM_PREDICT). Las APIs conservan su configuración de benchmark.
+
+    `esquema`: modelo Pydantic (p. ej. BloqueAnalisisBinario) o JSON Schema; si se
+    da, se pide salida estructurada nativa al proveedor (ver USAR_SALIDA_ESTRUCTURADA).
+
+    `cortar_en` ("final" | "json"): en Ollama, genera en streaming y corta en cuanto
+    se cierra el objeto `FINAL: {...}` o el primer JSON (ver corte_temprano.py); el
+    TTFT y el tiempo hasta veredicto quedan en get_consumo_llamada(). Las APIs lo ignoran.
     """
-    reset_consumo_llamada()
+    esquema = _esquema_json(esquema)
+    if _cache_respuestas is None:
+        return _consultar_proveedor(prompt, modelo, temperature, max_tokens, esquema, cortar_en)
+    clave = _clave_cache(prompt, modelo, temperature, max_tokens, esquema, cortar_en)
+    respuesta = _leer_cache(clave)
+    if respuesta is None:
+        respuesta = _consultar_proveedor(prompt, modelo, temperature, max_tokens, esquema, cortar_en)
+        _escribir_cache(clave, modelo, respuesta)
+    return respuesta
+
+
+# -------------------------------------------------------------------------------------
+# Construcción de peticiones y lectura de respuestas (compartido sync / async)
+# -------------------------------------------------------------------------------------
+_SDK_PROVEEDOR = {
+    "gemini": ("google.genai", "google-genai"),
+    "openai": ("openai", "openai"),
+    "anthropic": ("anthropic", "anthropic"),
+}
 
-    if modelo in GEMINI_API_MODEL_IDS:
-        try:
-            from google import genai
-            from google.genai import types
-        except ImportError as e:
-            print(f"Para usar {modelo} instala google-genai: pip install google-genai ({e})")
-            return ""
-        try:
-            client = genai.Client(api_key=_get_api_key("gemini_api_key"))
-            prefijo, sufijo = _partir_prompt_cache(prompt)
-            # Prefijo (artículo) como system_instruction: idéntico en las 5 vars → cache implícito.
-            # thinking_budget=0 desactiva el razonamiento para que el benchmark sea
-            # comparable con los modelos sin reasoning.
-            _sin_thinking = types.ThinkingConfig(thinking_budget=0)
-            if prefijo and sufijo:
-                config = types.GenerateContentConfig(
-                    temperature=temperature,
-                    system_instruction=prefijo,
-                    thinking_config=_sin_thinking,
-                )
-                contents = sufijo
-            else:
-                config = types.GenerateContentConfig(
-                    temperature=temperature,
-                    thinking_config=_sin_thinking,
-                )
-                contents = prompt
+
+def _sdk_disponible(proveedor: str, modelo: str) -> bool:
+    if proveedor not in _SDK_PROVEEDOR:
+        return True
+    modulo, paquete = _SDK_PROVEEDOR[proveedor]
+    try:
+        __import__(modulo)
+    except ImportError as e:
+        print(f"Para usar {modelo} instala {paquete}: pip install {paquete} ({e})")
+        return False
+    return True
+
+
+# -------------------------------------------------------------------------------------
+# Salida estructurada: decodificación restringida por esquema JSON
+# -------------------------------------------------------------------------------------
+# Con `esquema` (modelo Pydantic o JSON Schema) cada proveedor genera JSON válido por
+# construcción: Ollama `format`, OpenAI `response_format` json_schema (strict),
+# Gemini `response_schema` y Anthropic una tool forzada cuyo input es el esquema.
+# Sin vallas markdown ni llaves sin cerrar, json_repair deja de ser la vía normal y
+# los modelos pequeños cortan en cuanto cierran el objeto.
+# Ablación: False → sólo instrucciones en el prompt (comportamiento anterior).
+USAR_SALIDA_ESTRUCTURADA = True
+NOMBRE_TOOL_RESPUESTA = "registrar_clasificacion"
+
+# Claves de JSON Schema que se conservan al simplificar el esquema de Pydantic.
+_CLAVES_ESQUEMA = ("type", "properties", "required", "items", "enum", "description")
+
+
+def _esquema_json(esquema) -> Optional[dict]:
+    """Esquema como dict: modelo Pydantic (model_json_schema) o JSON Schema tal cual."""
+    if esquema is None or not USAR_SALIDA_ESTRUCTURADA:
+        return None
+    if isinstance(esquema, dict):
+        return esquema
+    return _esquema_modelo(esquema)
+
+
+@functools.lru_cache(maxsize=None)
+def _esquema_modelo(modelo_pydantic) -> dict:
+    return _simplificar_esquema(modelo_pydantic.model_json_schema())
+
+
+def _simplificar_esquema(nodo: dict, defs: Optional[dict] = None) -> dict:
+    """
+    Subconjunto común a los cuatro proveedores: sin $ref/title, todos los campos
+    requeridos, additionalProperties=false y los enteros acotados (ge/le de
+    Pydantic) convertidos en enum, que OpenAI strict y Ollama sí aplican.
+    """
+    defs = defs if defs is not None else nodo.get("$defs", {})
+    if "$ref" in nodo:
+        nodo = defs[nodo["$ref"].split("/")[-1]]
+    salida = {k: v for k, v in nodo.items() if k in _CLAVES_ESQUEMA}
+    if salida.get("type") == "integer" and "minimum" in nodo and "maximum" in nodo \
+            and nodo["maximum"] - nodo["minimum"] <= 20:
+        salida["enum"] = list(range(int(nodo["minimum"]), int(nodo["maximum"]) + 1))
+    if "properties" in nodo:
+        salida["properties"] = {k: _simplificar_esquema(v, defs) for k, v in nodo["properties"].items()}
+        salida["required"] = list(salida["properties"])
+        salida["additionalProperties"] = False
+    if "items" in nodo:
+        salida["items"] = _simplificar_esquema(nodo["items"], defs)
+    return salida
+
+
+def _esquema_gemini(nodo: dict) -> dict:
+    """Gemini (response_schema, OpenAPI): sin additionalProperties y enum sólo de strings."""
+    salida = {k: v for k, v in nodo.items() if k not in ("additionalProperties", "enum")}
+    if "enum" in nodo and nodo.get("type") == "integer":
+        salida["minimum"], salida["maximum"] = min(nodo["enum"]), max(nodo["enum"])
+    if "properties" in nodo:
+        salida["properties"] = {k: _esquema_gemini(v) for k, v in nodo["properties"].items()}
+    if "items" in nodo:
+        salida["items"] = _esquema_gemini(nodo["items"])
+    return salida
+
+
+def esquema_variable(config: dict, esquema=None) -> dict:
+    """
+    Esquema del bloque {codigo, explicacion, evidencias} de una variable de
+    variables.json: el del modelo Pydantic (BloqueAnalisisLenguajeSexista por
+    defecto) con `codigo` acotado a los valores_posibles de la variable.
+    """
+    bloque = copy.deepcopy(_esquema_modelo(esquema or BloqueAnalisisLenguajeSexista))
+    bloque["properties"]["codigo"]["enum"] = list(range(1, len(config["valores_posibles"]) + 1))
+    return bloque
+
+
+def esquema_multivariable(configs: Dict[str, dict], esquemas: Optional[dict] = None) -> dict:
+    """Esquema de la respuesta de generar_prompt_multivariable: un bloque por código."""
+    esquemas = esquemas or {}
+    propiedades = {c: esquema_variable(config, esquemas.get(c)) for c, config in configs.items()}
+    return {"type": "object", "properties": propiedades,
+            "required": list(propiedades), "additionalProperties": False}
+
+
+def _peticion_gemini(prompt: str, modelo: str, temperature: float,
+                     esquema: Optional[dict] = None) -> dict:
+    from google.genai import types
+    prefijo, sufijo = _partir_prompt_cache(prompt)
+    # Prefijo (artículo) como system_instruction: idéntico en las 5 vars → cache implícito.
+    # thinking_budget=0 desactiva el razonamiento para que el benchmark sea
+    # comparable con los modelos sin reasoning.
+    _sin_thinking = types.ThinkingConfig(thinking_budget=0)
+    _estructurada = {"response_mime_type": "application/json",
+                     "response_schema": _esquema_gemini(esquema)} if esquema else {}
+    if prefijo and sufijo:
+        config = types.GenerateContentConfig(
+            temperature=temperature,
+            system_instruction=prefijo,
+            thinking_config=_sin_thinking,
+            **_estructurada,
+        )
+        contents = sufijo
+    else:
+        config = types.GenerateContentConfig(
+            temperature=temperature,
+            thinking_config=_sin_thinking,
+            **_estructurada,
+        )
+        contents = prompt
+    return {"model": modelo, "contents": contents, "config": config}
+
+
+def _leer_gemini(response) -> str:
+    um = getattr(response, "usage_metadata", None)
+    _registrar_consumo(
+        prompt_tokens=getattr(um, "prompt_token_count", 0) or 0,
+        completion_tokens=getattr(um, "candidates_token_count", 0) or 0,
+        cache_read_tokens=getattr(um, "cached_content_token_count", 0) or 0,
+        proveedor="gemini",
+    )
+    return (response.text or "").strip()
+
+
+def _peticion_openai(prompt: str, modelo: str, temperature: float,
+                     esquema: Optional[dict] = None) -> dict:
+    prefijo, sufijo = _partir_prompt_cache(prompt)
+    # system = artículo (prefijo estable); user = instrucciones de la variable.
+    if prefijo and sufijo:
+        messages = [
+            {"role": "system", "content": prefijo},
+            {"role": "user", "content": sufijo},
+        ]
+    else:
+        messages = [{"role": "user", "content": prompt}]
+    kwargs = {
+        "model": modelo,
+        "messages": messages,
+    }
+    # Los modelos de razonamiento (GPT-5) solo admiten la temperatura por
+    # defecto. Desactivamos el razonamiento para que el benchmark sea comparable
+    # con los modelos sin reasoning (gpt-4o-mini, Claude sin thinking, Gemini
+    # con thinking_budget=0). Los GPT-5 antiguos no aceptan 'none' → 'minimal'.
+    if modelo in OPENAI_REASONING_MODEL_IDS:
+        kwargs["reasoning_effort"] = (
+            "minimal" if modelo in OPENAI_REASONING_LEGACY_IDS else "none"
+        )
+    else:
+        kwargs["temperature"] = temperature
+    if esquema:
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": NOMBRE_TOOL_RESPUESTA, "strict": True, "schema": esquema},
+        }
+    return kwargs
+
+
+def _leer_openai(response) -> str:
+    u = response.usage
+    cached = 0
+    details = getattr(u, "prompt_tokens_details", None) if u else None
+    if details is not None:
+        cached = getattr(details, "cached_tokens", 0) or 0
+    _registrar_consumo(
+        prompt_tokens=getattr(u, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(u, "completion_tokens", 0) or 0,
+        cache_read_tokens=cached,
+        proveedor="openai",
+    )
+    return (response.choices[0].message.content or "").strip()
+
+
+def _peticion_anthropic(prompt: str, modelo: str, temperature: float,
+                        esquema: Optional[dict] = None) -> dict:
+    prefijo, sufijo = _partir_prompt_cache(prompt)
+    if prefijo and sufijo:
+        # Prompt caching explícito: el bloque del artículo se marca ephemeral
+        # (TTL ~5 min). Las vars 2–5 del mismo artículo reutilizan ese prefijo.
+        messages = [{
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prefijo,
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {"type": "text", "text": sufijo},
+            ],
+        }]
+    else:
+        messages = [{"role": "user", "content": prompt}]
+    kwargs = {
+        "model": modelo,
+        "max_tokens": 8192,
+        "temperature": temperature,
+        "messages": messages,
+    }
+    if esquema:
+        # Anthropic no tiene modo JSON: una única tool forzada cuyo input es el esquema.
+        kwargs["tools"] = [{
+            "name": NOMBRE_TOOL_RESPUESTA,
+            "description": "Registra la clasificación final con el formato exigido.",
+            "input_schema": esquema,
+        }]
+        kwargs["tool_choice"] = {"type": "tool", "name": NOMBRE_TOOL_RESPUESTA}
+    return kwargs
+
+
+def _leer_anthropic(response) -> str:
+    u = response.usage
+    _registrar_consumo(
+        prompt_tokens=getattr(u, "input_tokens", 0) or 0,
+        completion_tokens=getattr(u, "output_tokens", 0) or 0,
+        cache_read_tokens=getattr(u, "cache_read_input_tokens", 0) or 0,
+        cache_creation_tokens=getattr(u, "cache_creation_input_tokens", 0) or 0,
+        proveedor="anthropic",
+    )
+    for bloque in response.content:
+        if bloque.type == "tool_use" and bloque.name == NOMBRE_TOOL_RESPUESTA:
+            return json.dumps(bloque.input, ensure_ascii=False)
+    texto = "".join(
+        bloque.text for bloque in response.content if bloque.type == "text"
+    )
+    return texto.strip()
+
+
+# -------------------------------------------------------------------------------------
+# Ajuste de inferencia Ollama: num_ctx por buckets, tope de num_predict y keep_alive
+# -------------------------------------------------------------------------------------
+# Los buckets de num_ctx (y su estimación de tokens) viven en contexto_ollama.py,
+# compartido con los experimentos que llaman a Ollama por su cuenta.
+OLLAMA_NUM_PREDICT = 1024      # tope de salida por defecto (los clasificadores piden menos)
+OLLAMA_KEEP_ALIVE = "30m"      # el modelo queda cargado entre llamadas durante toda la corrida
+_num_ctx_para = contexto_ollama.num_ctx_para
+
+_stats_lock = threading.Lock()
+# truncado_prompt_estimado: el prompt no dejó hueco a num_predict dentro de num_ctx (Ollama
+# no informa de si recortó el prompt; es una estimación). truncado_salida sí es real.
+_stats_ollama = {"llamadas": 0, "truncado_prompt_estimado": 0, "truncado_salida": 0}
+
+
+def configurar_ollama(keep_alive: Optional[str] = None, num_predict: Optional[int] = None,
+                      buckets_ctx: Optional[tuple] = None) -> None:
+    """Ajusta keep_alive ('30m', '-1' = indefinido), el tope de salida y los buckets de num_ctx."""
+    global OLLAMA_KEEP_ALIVE, OLLAMA_NUM_PREDICT
+    if keep_alive is not None:
+        OLLAMA_KEEP_ALIVE = keep_alive
+    if num_predict:
+        OLLAMA_NUM_PREDICT = int(num_predict)
+    if buckets_ctx:
+        contexto_ollama.configurar(buckets_ctx)
+
+
+def estadisticas_ollama() -> dict:
+    with _stats_lock:
+        return {**_stats_ollama, **contexto_ollama.estadisticas()}
+
+
+def imprimir_estadisticas_ollama() -> None:
+    """Resumen de buckets de num_ctx y eventos de truncado (final de los runners)."""
+    st = estadisticas_ollama()
+    if not st["llamadas"]:
+        return
+    print(f"  Ollama: {st['llamadas']} llamadas · num_ctx={st['num_ctx_actual']} · "
+          f"buckets={st['buckets']}")
+    print(f"  Ollama truncados: prompt≈{st['truncado_prompt_estimado']} (estimado) · "
+          f"salida={st['truncado_salida']} · "
+          f"prompt>ctx_max={st['prompt_excede_ctx_max']}")
+
+
+def _peticion_ollama(prompt: str, modelo: str, temperature: float,
+                     max_tokens: Optional[int] = None, esquema: Optional[dict] = None) -> dict:
+    # Ollama no tiene prompt cache de API: quitamos el marcador y unimos las partes.
+    # Con el artículo delante, el servidor reaprovecha su KV cache entre variables.
+    prefijo, sufijo = _partir_prompt_cache(prompt)
+    prompt_local = f"{prefijo}\n\n{sufijo}" if prefijo and sufijo else prompt
+    num_predict = max_tokens or OLLAMA_NUM_PREDICT
+    kwargs = {
+        "model": modelo,
+        "messages": [{'role': 'user', 'content': prompt_local}],
+        "options": {
+            'temperature': temperature,
+            'num_ctx': _num_ctx_para(modelo, prompt_local, num_predict),
+            'num_predict': num_predict,
+        },
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+    if esquema:
+        kwargs["format"] = esquema
+    return kwargs
+
+
+def _campo_respuesta(response, nombre: str):
+    """Campo de una respuesta de Ollama (dict o ChatResponse), None si no está."""
+    try:
+        return response.get(nombre) if isinstance(response, dict) else getattr(response, nombre, None)
+    except Exception:
+        return None
+
+
+def _leer_ollama(response, opciones: Optional[dict] = None) -> str:
+    def _campo(nombre):
+        return _campo_respuesta(response, nombre)
+
+    prompt_tokens = _campo("prompt_eval_count") or 0
+    completion_tokens = _campo("eval_count") or 0
+    if opciones:
+        with _stats_lock:
+            _stats_ollama["llamadas"] += 1
+            # Sin hueco para la salida → probable recorte del prompt (estimación).
+            if prompt_tokens + opciones["num_predict"] > opciones["num_ctx"]:
+                _stats_ollama["truncado_prompt_estimado"] += 1
+            if _campo("done_reason") == "length":
+                _stats_ollama["truncado_salida"] += 1
+    _registrar_consumo(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                       proveedor="ollama")
+    return response['message']['content'].strip()
+
+
+# -------------------------------------------------------------------------------------
+# Streaming con corte temprano (Ollama): se deja de generar al cerrar el veredicto
+# -------------------------------------------------------------------------------------
+_stats_streaming = {"llamadas": 0, "cortadas": 0, "suma_ttft": 0.0, "suma_veredicto": 0.0,
+                    "con_veredicto": 0}
+_streaming_lock = threading.Lock()
+
+
+def _anotar_streaming(ttft: Optional[float], t_veredicto: Optional[float], cortada: bool) -> None:
+    with _streaming_lock:
+        _stats_streaming["llamadas"] += 1
+        _stats_streaming["cortadas"] += int(cortada)
+        if ttft is not None:
+            _stats_streaming["suma_ttft"] += ttft
+        if t_veredicto is not None:
+            _stats_streaming["con_veredicto"] += 1
+            _stats_streaming["suma_veredicto"] += t_veredicto
+    # Tiempos de ESTA llamada junto al consumo (get_consumo_llamada()).
+    consumo = _consumo_ctx.get()
+    if consumo is not None:
+        consumo["ttft_seg"] = round(ttft, 3) if ttft is not None else None
+        consumo["veredicto_seg"] = round(t_veredicto, 3) if t_veredicto is not None else None
+
+
+def estadisticas_streaming() -> dict:
+    with _streaming_lock:
+        st = dict(_stats_streaming)
+    n, nv = st.pop("llamadas"), st.pop("con_veredicto")
+    return {
+        "llamadas": n,
+        "cortadas": st["cortadas"],
+        "ttft_medio_seg": round(st["suma_ttft"] / n, 3) if n else None,
+        "veredicto_medio_seg": round(st["suma_veredicto"] / nv, 3) if nv else None,
+    }
+
+
+def imprimir_estadisticas_streaming() -> None:
+    """TTFT, tiempo hasta veredicto y llamadas cortadas (final de los runners)."""
+    st = estadisticas_streaming()
+    if not st["llamadas"]:
+        return
+    print(f"  Streaming: {st['llamadas']} llamadas · {st['cortadas']} cortadas tras el veredicto · "
+          f"TTFT medio={st['ttft_medio_seg']}s · veredicto medio={st['veredicto_medio_seg']}s")
+
+
+def _cerrar_stream_ollama(partes: list, ultimo, detector, kwargs: dict, n_trozos: int,
+                          ttft: Optional[float], t_veredicto: Optional[float]) -> str:
+    """Consumo y estadísticas de una llamada en streaming; devuelve el texto recibido."""
+    cortada = detector.completo and not (ultimo and _campo_respuesta(ultimo, "done"))
+    if cortada:
+        # Sin el trozo final no hay contadores del servidor: prompt estimado y un
+        # token por trozo recibido (Ollama emite un trozo por token).
+        respuesta = {
+            "prompt_eval_count": contexto_ollama.tokens_estimados(kwargs["messages"][-1]["content"]),
+            "eval_count": n_trozos,
+            "done_reason": "veredicto",
+        }
+    else:
+        respuesta = {k: _campo_respuesta(ultimo, k) for k in
+                     ("prompt_eval_count", "eval_count", "done_reason")} if ultimo else {}
+    respuesta["message"] = {"content": detector.texto if detector.completo else "".join(partes)}
+    texto = _leer_ollama(respuesta, kwargs["options"])
+    _anotar_streaming(ttft, t_veredicto, cortada)
+    return texto
+
+
+def _chat_ollama_stream(kwargs: dict, cortar_en: str) -> str:
+    from corte_temprano import DetectorVeredicto
+    import time
+    chat = _balanceador_ollama.chat if _balanceador_ollama is not None else ollama.chat
+    detector = DetectorVeredicto(cortar_en)
+    partes, ultimo, n_trozos, ttft, t_veredicto = [], None, 0, None, None
+    t0 = time.perf_counter()
+    flujo = chat(**kwargs, stream=True)
+    try:
+        for trozo in flujo:
+            ultimo = trozo
+            contenido = trozo["message"]["content"] or ""
+            if not contenido:
+                continue
+            n_trozos += 1
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            partes.append(contenido)
+            if detector.alimentar(contenido):
+                t_veredicto = time.perf_counter() - t0
+                break
+    finally:
+        # Cerrar el generador cierra la conexión HTTP: Ollama aborta la generación.
+        cerrar = getattr(flujo, "close", None)
+        if cerrar is not None:
+            cerrar()
+    return _cerrar_stream_ollama(partes, ultimo, detector, kwargs, n_trozos, ttft, t_veredicto)
+
+
+async def _achat_ollama_stream(client, kwargs: dict, cortar_en: str) -> str:
+    from corte_temprano import DetectorVeredicto
+    import time
+    detector = DetectorVeredicto(cortar_en)
+    partes, ultimo, n_trozos, ttft, t_veredicto = [], None, 0, None, None
+    t0 = time.perf_counter()
+    if _balanceador_ollama is not None:
+        flujo = await _balanceador_ollama.achat(**kwargs, stream=True)
+    else:
+        flujo = await client.chat(**kwargs, stream=True)
+    try:
+        async for trozo in flujo:
+            ultimo = trozo
+            contenido = trozo["message"]["content"] or ""
+            if not contenido:
+                continue
+            n_trozos += 1
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            partes.append(contenido)
+            if detector.alimentar(contenido):
+                t_veredicto = time.perf_counter() - t0
+                break
+    finally:
+        cerrar = getattr(flujo, "aclose", None)
+        if cerrar is not None:
+            await cerrar()
+    return _cerrar_stream_ollama(partes, ultimo, detector, kwargs, n_trozos, ttft, t_veredicto)
+
+
+# Balanceo entre varios servidores Ollama (opt-in, ver balanceador_ollama.py).
+_balanceador_ollama = None
+
+
+def configurar_hosts_ollama(hosts: list) -> None:
+    """
+    Reparte las llamadas a Ollama entre varios servidores (host:puerto): cada
+    petición va al sano menos cargado, con failover y expulsión de caídos. Con uno
+    o ningún host se vuelve al cliente por defecto (OLLAMA_HOST).
+    """
+    global _balanceador_ollama
+    if not hosts or len(hosts) < 2:
+        _balanceador_ollama = None
+        return
+    from balanceador_ollama import Balanceador
+    _balanceador_ollama = Balanceador(list(hosts))
+
+
+def estadisticas_balanceador() -> Optional[dict]:
+    return _balanceador_ollama.estadisticas() if _balanceador_ollama is not None else None
+
+
+def imprimir_estadisticas_balanceador() -> None:
+    """Reparto por servidor Ollama (final de los runners con --ollama-hosts)."""
+    for host, st in (estadisticas_balanceador() or {}).items():
+        print(f"  Ollama {host}: {st['peticiones']} peticiones · {st['fallos']} fallos · "
+              f"latencia_ewma={st['latencia_ewma_s']}s · expulsiones={st['expulsiones']}"
+              + (" · EXPULSADO" if st["expulsado"] else ""))
+
+
+def _consultar_proveedor(prompt: str, modelo: str, temperature: float,
+                         max_tokens: Optional[int] = None, esquema: Optional[dict] = None,
+                         cortar_en: Optional[str] = None) -> str:
+    """Llamada real al proveedor (sin caché). Ver consultar_ollama."""
+    reset_consumo_llamada()
+    proveedor = _proveedor_de(modelo)
+    if not _sdk_disponible(proveedor, modelo):
+        return ""
+    try:
+        if proveedor == "gemini":
+            client = _cliente("gemini")
+            kwargs = _peticion_gemini(prompt, modelo, temperature, esquema)
             response = _con_reintentos(
-                lambda: client.models.generate_content(
-                    model=modelo,
-                    contents=contents,
-                    config=config,
-                ),
-                proveedor="gemini",
-            )
-            um = getattr(response, "usage_metadata", None)
-            _registrar_consumo(
-                prompt_tokens=getattr(um, "prompt_token_count", 0) or 0,
-                completion_tokens=getattr(um, "candidates_token_count", 0) or 0,
-                cache_read_tokens=getattr(um, "cached_content_token_count", 0) or 0,
-                proveedor="gemini",
+                lambda: client.models.generate_content(**kwargs),
+                proveedor="gemini", modelo=modelo, tokens=_estimar_tokens(prompt),
             )
-            return (response.text or "").strip()
-        except Exception as e:
-            print(f"Error conectando con el modelo {modelo}: {e}")
-            return ""
+            return _leer_gemini(response)
 
-    if modelo in OPENAI_API_MODEL_IDS:
-        try:
-            from openai import OpenAI
-        except ImportError as e:
-            print(f"Para usar {modelo} instala openai: pip install openai ({e})")
-            return ""
-        try:
-            client = OpenAI(api_key=_get_api_key("openai_api_key"))
-            prefijo, sufijo = _partir_prompt_cache(prompt)
-            # system = artículo (prefijo estable); user = instrucciones de la variable.
-            if prefijo and sufijo:
-                messages = [
-                    {"role": "system", "content": prefijo},
-                    {"role": "user", "content": sufijo},
-                ]
-            else:
-                messages = [{"role": "user", "content": prompt}]
-            kwargs = {
-                "model": modelo,
-                "messages": messages,
-            }
-            # Los modelos de razonamiento (GPT-5) solo admiten la temperatura por
-            # defecto. Desactivamos el razonamiento para que el benchmark sea comparable
-            # con los modelos sin reasoning (gpt-4o-mini, Claude sin thinking, Gemini
-            # con thinking_budget=0). Los GPT-5 antiguos no aceptan 'none' → 'minimal'.
-            if modelo in OPENAI_REASONING_MODEL_IDS:
-                kwargs["reasoning_effort"] = (
-                    "minimal" if modelo in OPENAI_REASONING_LEGACY_IDS else "none"
-                )
-            else:
-                kwargs["temperature"] = temperature
+        if proveedor == "openai":
+            client = _cliente("openai")
+            kwargs = _peticion_openai(prompt, modelo, temperature, esquema)
             response = _con_reintentos(
                 lambda: client.chat.completions.create(**kwargs),
-                proveedor="openai",
-            )
-            u = response.usage
-            cached = 0
-            details = getattr(u, "prompt_tokens_details", None) if u else None
-            if details is not None:
-                cached = getattr(details, "cached_tokens", 0) or 0
-            _registrar_consumo(
-                prompt_tokens=getattr(u, "prompt_tokens", 0) or 0,
-                completion_tokens=getattr(u, "completion_tokens", 0) or 0,
-                cache_read_tokens=cached,
-                proveedor="openai",
+                proveedor="openai", modelo=modelo, tokens=_estimar_tokens(prompt),
             )
-            return (response.choices[0].message.content or "").strip()
-        except Exception as e:
-            print(f"Error conectando con el modelo {modelo}: {e}")
-            return ""
+            return _leer_openai(response)
 
-    if modelo in CLAUDE_API_MODEL_IDS:
-        try:
-            from anthropic import Anthropic
-        except ImportError as e:
-            print(f"Para usar {modelo} instala anthropic: pip install anthropic ({e})")
-            return ""
-        try:
-            client = Anthropic(api_key=_get_api_key("anthropic_api_key"))
-            prefijo, sufijo = _partir_prompt_cache(prompt)
-            if prefijo and sufijo:
-                # Prompt caching explícito: el bloque del artículo se marca ephemeral
-                # (TTL ~5 min). Las vars 2–5 del mismo artículo reutilizan ese prefijo.
-                messages = [{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prefijo,
-                            "cache_control": {"type": "ephemeral"},
-                        },
-                        {"type": "text", "text": sufijo},
-                    ],
-                }]
-            else:
-                messages = [{"role": "user", "content": prompt}]
+        if proveedor == "anthropic":
+            client = _cliente("anthropic")
+            kwargs = _peticion_anthropic(prompt, modelo, temperature, esquema)
             response = _con_reintentos(
-                lambda: client.messages.create(
-                    model=modelo,
-                    max_tokens=8192,
-                    temperature=temperature,
-                    messages=messages,
-                ),
-                proveedor="anthropic",
-            )
-            u = response.usage
-            _registrar_consumo(
-                prompt_tokens=getattr(u, "input_tokens", 0) or 0,
-                completion_tokens=getattr(u, "output_tokens", 0) or 0,
-                cache_read_tokens=getattr(u, "cache_read_input_tokens", 0) or 0,
-                cache_creation_tokens=getattr(u, "cache_creation_input_tokens", 0) or 0,
-                proveedor="anthropic",
+                lambda: client.messages.create(**kwargs),
+                proveedor="anthropic", modelo=modelo, tokens=_estimar_tokens(prompt),
             )
-            texto = "".join(
-                bloque.text for bloque in response.content if bloque.type == "text"
-            )
-            return texto.strip()
-        except Exception as e:
-            print(f"Error conectando con el modelo {modelo}: {e}")
-            return ""
+            return _leer_anthropic(response)
+
+        # Se llama vía `ollama.chat` (atributo del módulo) o, con varios servidores,
+        # vía ollama.Client.chat de cada host, para que la instrumentación de
+        # tiempos de los runners del cluster siga funcionando.
+        kwargs = _peticion_ollama(prompt, modelo, temperature, max_tokens, esquema)
+        if cortar_en:
+            return _protegido(lambda: _chat_ollama_stream(kwargs, cortar_en), "ollama", modelo)
+        chat = _balanceador_ollama.chat if _balanceador_ollama is not None else ollama.chat
+        response = _protegido(lambda: chat(**kwargs), "ollama", modelo)
+        return _leer_ollama(response, kwargs["options"])
+
+    except cortacircuitos.CircuitoAbierto:
+        raise   # no es un fallo de este artículo: la corrida entera debe detenerse
+    except Exception as e:
+        print(f"Error conectando con el modelo {modelo}: {e}")
+        return ""
 
+
+# =====================================================================================
+# 0b. Router asíncrono (aconsultar)
+# =====================================================================================
+# Misma petición, mismo consumo y misma caché que consultar_ollama, pero sobre los
+# clientes async de cada SDK (AsyncOpenAI, AsyncAnthropic, genai .aio y
+# ollama.AsyncClient). Un semáforo por proveedor acota las peticiones en vuelo, de
+# modo que un único hilo puede mantener cientos de llamadas abiertas.
+_CONCURRENCIA_ASYNC = {"gemini": 64, "openai": 64, "anthropic": 64, "ollama": 4}
+# Por bucle de eventos (los pools y semáforos async quedan ligados al suyo: otro
+# asyncio.run() → otros). Clave débil: un bucle nuevo nunca hereda el estado de uno
+# muerto que tuviera el mismo id().
+_clientes_async: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_semaforos_async: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def configurar_concurrencia_async(n: int, proveedor: Optional[str] = None) -> None:
+    """
+    Máximo de peticiones async en vuelo por proveedor (todos si `proveedor` es None).
+    Llamar antes de arrancar el bucle de eventos.
+    """
+    for p in ([proveedor] if proveedor else list(_CONCURRENCIA_ASYNC)):
+        _CONCURRENCIA_ASYNC[p] = max(1, int(n))
+
+
+def _crear_cliente_async(proveedor: str, api_key: Optional[str]):
+    n = _CONCURRENCIA_ASYNC[proveedor]
+    if proveedor == "openai":
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        http = DefaultAsyncHttpxClient(**_opciones_httpx(proveedor, n, asincrono=True))
+        return AsyncOpenAI(api_key=api_key, http_client=http)
+    if proveedor == "anthropic":
+        from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+        http = DefaultAsyncHttpxClient(**_opciones_httpx(proveedor, n, asincrono=True))
+        return AsyncAnthropic(api_key=api_key, http_client=http)
+    if proveedor == "gemini":
+        from google import genai
+        return genai.Client(api_key=api_key).aio
+    return ollama.AsyncClient()
+
+
+def _del_bucle(tabla: "weakref.WeakKeyDictionary") -> dict:
+    """Estado del bucle de eventos en curso dentro de `tabla`. Con el lock tomado."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    if loop not in tabla:
+        # Los semáforos y clientes guardan referencia a su bucle, así que la clave débil
+        # sola no lo libera: se descartan aquí los de bucles ya cerrados.
+        for viejo in [b for b in list(tabla.keys()) if b.is_closed()]:
+            del tabla[viejo]
+        tabla[loop] = {}
+    return tabla[loop]
+
+
+def _cliente_async(proveedor: str):
+    """Cliente async compartido, uno por (proveedor, credencial) en cada bucle de eventos."""
+    api_key = _get_api_key(f"{proveedor}_api_key") if proveedor != "ollama" else None
+    with _clientes_lock:
+        clientes = _del_bucle(_clientes_async)
+        if (proveedor, api_key) not in clientes:
+            clientes[(proveedor, api_key)] = _crear_cliente_async(proveedor, api_key)
+        return clientes[(proveedor, api_key)]
+
+
+def _semaforo_async(proveedor: str):
+    import asyncio
+    with _clientes_lock:
+        semaforos = _del_bucle(_semaforos_async)
+        if proveedor not in semaforos:
+            semaforos[proveedor] = asyncio.Semaphore(_CONCURRENCIA_ASYNC[proveedor])
+        return semaforos[proveedor]
+
+
+async def aconsultar(prompt: str, modelo: str = "gemma3:4b", temperature: float = 0,
+                     max_tokens: Optional[int] = None, esquema=None,
+                     cortar_en: Optional[str] = None) -> str:
+    """
+    Versión asyncio de consultar_ollama (mismo enrutado, prompt caching, caché de
+    respuestas, salida estructurada, corte temprano y consumo en get_consumo_llamada(),
+    que es por tarea asyncio).
+    """
+    esquema = _esquema_json(esquema)
+    if _cache_respuestas is None:
+        return await _aconsultar_proveedor(prompt, modelo, temperature, max_tokens, esquema, cortar_en)
+    clave = _clave_cache(prompt, modelo, temperature, max_tokens, esquema, cortar_en)
+    respuesta = await _aleer_cache(clave)
+    if respuesta is None:
+        respuesta = await _aconsultar_proveedor(prompt, modelo, temperature, max_tokens,
+                                                esquema, cortar_en)
+        if respuesta:
+            import asyncio
+            # to_thread copia el contexto: _escribir_cache ve el consumo de esta tarea.
+            await asyncio.to_thread(_escribir_cache, clave, modelo, respuesta)
+    return respuesta
+
+
+async def _aconsultar_proveedor(prompt: str, modelo: str, temperature: float,
+                               max_tokens: Optional[int] = None,
+                               esquema: Optional[dict] = None,
+                               cortar_en: Optional[str] = None) -> str:
+    reset_consumo_llamada()
+    proveedor = _proveedor_de(modelo)
+    if not _sdk_disponible(proveedor, modelo):
+        return ""
     try:
-        # Ollama no tiene prompt cache: quitamos el marcador y unimos las partes.
-        prefijo, sufijo = _partir_prompt_cache(prompt)
-        prompt_local = f"{prefijo}\n\n{sufijo}" if prefijo and sufijo else prompt
-        response = ollama.chat(
-            model=modelo,
-            messages=[{'role': 'user', 'content': prompt_local}],
-            options={'temperature': temperature},
-        )
-        _registrar_consumo(proveedor="ollama")
-        return response['message']['content'].strip()
+        async with _semaforo_async(proveedor):
+            client = _cliente_async(proveedor)
+            if proveedor == "gemini":
+                kwargs = _peticion_gemini(prompt, modelo, temperature, esquema)
+                response = await _acon_reintentos(
+                    lambda: client.models.generate_content(**kwargs),
+                    proveedor="gemini", modelo=modelo, tokens=_estimar_tokens(prompt),
+                )
+                return _leer_gemini(response)
+
+            if proveedor == "openai":
+                kwargs = _peticion_openai(prompt, modelo, temperature, esquema)
+                response = await _acon_reintentos(
+                    lambda: client.chat.completions.create(**kwargs),
+                    proveedor="openai", modelo=modelo, tokens=_estimar_tokens(prompt),
+                )
+                return _leer_openai(response)
+
+            if proveedor == "anthropic":
+                kwargs = _peticion_anthropic(prompt, modelo, temperature, esquema)
+                response = await _acon_reintentos(
+                    lambda: client.messages.create(**kwargs),
+                    proveedor="anthropic", modelo=modelo, tokens=_estimar_tokens(prompt),
+                )
+                return _leer_anthropic(response)
+
+            kwargs = _peticion_ollama(prompt, modelo, temperature, max_tokens, esquema)
+            if cortar_en:
+                return await _aprotegido(lambda: _achat_ollama_stream(client, kwargs, cortar_en),
+                                         "ollama", modelo)
+            chat = _balanceador_ollama.achat if _balanceador_ollama is not None else client.chat
+            response = await _aprotegido(lambda: chat(**kwargs), "ollama", modelo)
+            return _leer_ollama(response, kwargs["options"])
+
+    except cortacircuitos.CircuitoAbierto:
+        raise
+    except Exception as e:
+        print(f"Error conectando con el modelo {modelo}: {e}")
+        return ""
+
+
+# =====================================================================================
+# 0c. Conversación multi-turno (consultar_chat)
+# =====================================================================================
+# Para agentes: en lugar de reenviar en cada turno un único prompt con todo el
+# historial concatenado, se envía la lista de mensajes por la API de chat de cada
+# proveedor. El prefijo (system + turnos anteriores) es byte-idéntico entre turnos:
+#   - Anthropic: corte cache_control en el system y otro móvil en el último mensaje,
+#     de modo que cada turno lee de caché todo lo anterior y sólo escribe lo nuevo.
+#   - OpenAI / Gemini: caché implícita de prefijo (system + mensajes en orden).
+#   - Ollama: el servidor reaprovecha el KV cache del prefijo común mientras el
+#     modelo sigue cargado (keep_alive) y num_ctx no cambia (los buckets sólo crecen).
+# `mensajes` = [{"role": "user" | "assistant", "content": str}, ...], alternados y
+# terminando en "user". El consumo de cada turno queda en get_consumo_llamada().
+def _peticion_chat_anthropic(system: str, mensajes: list, modelo: str, temperature: float,
+                             cache: bool) -> dict:
+    efimero = {"cache_control": {"type": "ephemeral"}} if cache else {}
+    msgs = [{"role": m["role"], "content": [{"type": "text", "text": m["content"]}]}
+            for m in mensajes]
+    if cache:
+        msgs[-1]["content"][-1].update(efimero)
+    return {
+        "model": modelo,
+        "max_tokens": 8192,
+        "temperature": temperature,
+        "system": [{"type": "text", "text": system, **efimero}],
+        "messages": msgs,
+    }
+
+
+def _peticion_chat_openai(system: str, mensajes: list, modelo: str, temperature: float) -> dict:
+    # Mismas opciones de benchmark (razonamiento/temperatura) que la petición de un turno.
+    kwargs = _peticion_openai("", modelo, temperature)
+    kwargs["messages"] = [{"role": "system", "content": system}] + \
+        [{"role": m["role"], "content": m["content"]} for m in mensajes]
+    return kwargs
 
+
+def _peticion_chat_gemini(system: str, mensajes: list, modelo: str, temperature: float) -> dict:
+    from google.genai import types
+    config = types.GenerateContentConfig(
+        temperature=temperature,
+        system_instruction=system,
+        thinking_config=types.ThinkingConfig(thinking_budget=0),
+    )
+    contents = [{"role": "model" if m["role"] == "assistant" else "user",
+                 "parts": [{"text": m["content"]}]} for m in mensajes]
+    return {"model": modelo, "contents": contents, "config": config}
+
+
+def _peticion_chat_ollama(system: str, mensajes: list, modelo: str, temperature: float,
+                          max_tokens: Optional[int] = None) -> dict:
+    # num_ctx se calcula sobre la conversación completa.
+    kwargs = _peticion_ollama("\n\n".join([system] + [m["content"] for m in mensajes]),
+                              modelo, temperature, max_tokens)
+    kwargs["messages"] = [{"role": "system", "content": system}] + \
+        [{"role": m["role"], "content": m["content"]} for m in mensajes]
+    return kwargs
+
+
+def consultar_chat(system: str, mensajes: list, modelo: str = "gemma3:4b",
+                   temperature: float = 0, max_tokens: Optional[int] = None,
+                   cache: bool = True) -> str:
+    """
+    Un turno de una conversación multi-turno (mismo enrutado, reintentos,
+    corta-circuitos y caché de respuestas que consultar_ollama). `cache=False`
+    quita los cortes cache_control de Anthropic (ablación de prompt caching).
+    """
+    if _cache_respuestas is None:
+        return _consultar_chat_proveedor(system, mensajes, modelo, temperature, max_tokens, cache)
+    from cache_respuestas import clave_respuesta
+    clave = clave_respuesta(modelo, (system, json.dumps(mensajes, ensure_ascii=False)),
+                            temperature, {**_opciones_proveedor(modelo, max_tokens),
+                                          "chat": True, "cache": cache})
+    respuesta = _leer_cache(clave)
+    if respuesta is None:
+        respuesta = _consultar_chat_proveedor(system, mensajes, modelo, temperature,
+                                              max_tokens, cache)
+        _escribir_cache(clave, modelo, respuesta)
+    return respuesta
+
+
+def _consultar_chat_proveedor(system: str, mensajes: list, modelo: str, temperature: float,
+                              max_tokens: Optional[int], cache: bool) -> str:
+    reset_consumo_llamada()
+    proveedor = _proveedor_de(modelo)
+    if not _sdk_disponible(proveedor, modelo):
+        return ""
+    tokens = _estimar_tokens(system + "".join(m["content"] for m in mensajes))
+    try:
+        if proveedor == "gemini":
+            client = _cliente("gemini")
+            kwargs = _peticion_chat_gemini(system, mensajes, modelo, temperature)
+            response = _con_reintentos(lambda: client.models.generate_content(**kwargs),
+                                       proveedor="gemini", modelo=modelo, tokens=tokens)
+            return _leer_gemini(response)
+
+        if proveedor == "openai":
+            client = _cliente("openai")
+            kwargs = _peticion_chat_openai(system, mensajes, modelo, temperature)
+            response = _con_reintentos(lambda: client.chat.completions.create(**kwargs),
+                                       proveedor="openai", modelo=modelo, tokens=tokens)
+            return _leer_openai(response)
+
+        if proveedor == "anthropic":
+            client = _cliente("anthropic")
+            kwargs = _peticion_chat_anthropic(system, mensajes, modelo, temperature, cache)
+            response = _con_reintentos(lambda: client.messages.create(**kwargs),
+                                       proveedor="anthropic", modelo=modelo, tokens=tokens)
+            return _leer_anthropic(response)
+
+        kwargs = _peticion_chat_ollama(system, mensajes, modelo, temperature, max_tokens)
+        chat = _balanceador_ollama.chat if _balanceador_ollama is not None else ollama.chat
+        response = _protegido(lambda: chat(**kwargs), "ollama", modelo)
+        return _leer_ollama(response, kwargs["options"])
+
+    except cortacircuitos.CircuitoAbierto:
+        raise
     except Exception as e:
         print(f"Error conectando con el modelo {modelo}: {e}")
         return ""
@@ -544,11 +1736,57 @@ class FuentesValidadas(BaseModel):
 # =====================================================================================
 # Bloque II. Lenguaje (25-39)
 # =====================================================================================
+# ============================================================================
+# Registro de prompts compilados (proceso completo, invalidación por mtime)
+# ============================================================================
+# Cada clasificar_var_* releía variables.json (~66 KB) y el template, y volvía a
+# aplanar definición/metodología/ejemplos, por artículo y variable. Aquí cada
+# fichero se parsea una vez (se relee sólo si cambian su mtime o su tamaño) y cada
+# par (variable, template) se compila una vez: el prompt queda partido por
+# {texto_input} y en cada llamada sólo se une con el texto del artículo.
+_ficheros_cache: dict = {}
+_compilados: dict = {}
+_registro_lock = threading.Lock()
+_stats_registro = {"lecturas_disco": 0, "compilaciones": 0, "prompts": 0}
+_MARCA_TEXTO = "\x00IRIS_TEXTO_INPUT\x00"
+
+
+def _firma_fichero(ruta: Path) -> tuple:
+    st = ruta.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _leer_fichero_cacheado(ruta: Union[str, Path], cargar) -> Any:
+    """Contenido de `ruta` transformado por `cargar(texto)`, cacheado por mtime/tamaño."""
+    ruta = Path(ruta).resolve()
+    firma = _firma_fichero(ruta)
+    clave = (ruta, cargar)
+    entrada = _ficheros_cache.get(clave)
+    if entrada is not None and entrada[0] == firma:
+        return entrada[1]
+    contenido = cargar(ruta.read_text(encoding="utf-8"))
+    with _registro_lock:
+        if entrada is not None:
+            # Cambió en disco: los compilados del objeto anterior (claves por id(config))
+            # no se volverían a usar y se acumularían una vez por recarga.
+            _compilados.clear()
+        _ficheros_cache[clave] = (firma, contenido)
+        _stats_registro["lecturas_disco"] += 1
+    return contenido
+
+
+def estadisticas_registro_prompts() -> dict:
+    with _registro_lock:
+        return {**_stats_registro, "compilados": len(_compilados)}
+
+
 def cargar_variables_desde_json(ruta_archivo: str = "variables.json") -> list:
-    """Carga el archivo JSON completo desde el disco."""
+    """
+    Carga el archivo JSON completo (parseado una vez por proceso; se relee si cambia
+    en disco). El objeto devuelto es compartido: no modificarlo.
+    """
     try:
-        with open(ruta_archivo, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return _leer_fichero_cacheado(ruta_archivo, json.loads)
     except FileNotFoundError:
         raise FileNotFoundError(f"No se encontró el archivo '{ruta_archivo}'. Asegúrate de crearlo con los datos del prompt anterior.")
     except json.JSONDecodeError:
@@ -580,8 +1818,8 @@ def obtener_config_variable(datos_json: Any, codigo_buscado: str) -> dict:
     raise TypeError(f"Estructura JSON no reconocida: {type(datos_json).__name__}")
 
 def cargar_texto_template(ruta: Union[str, Path]) -> str:
-    """Lee el template .md desde disco."""
-    return Path(ruta).read_text(encoding="utf-8")
+    """Lee el template .md (desde disco sólo la primera vez o si ha cambiado)."""
+    return _leer_fichero_cacheado(ruta, str)
 
 
 # ============================================================================
@@ -737,10 +1975,46 @@ def generar_prompt_dinamico(config: dict, texto: str, ruta_template: str) -> str
     Rellena el template .md con los datos de la variable.
     Compatible con JSON plano (legacy) y enriquecido (v2).
 
-    Si el template incluye IRIS_CACHE_BREAK, consultar_ollama parte el prompt:
-    prefijo (artículo) cacheable + sufijo específico de la variable.
+    El template se maqueta con maquetar_prefijo_estable: consultar_ollama parte el
+    prompt por IRIS_CACHE_BREAK en prefijo (artículo) cacheable + sufijo específico
+    de la variable.
+
+    Las secciones estáticas se compilan una vez por (variable, template) y aquí
+    sólo se inserta el texto (ver _partes_prompt).
+    """
+    return texto.join(_partes_prompt(config, ruta_template))
+
+
+def _compilado(clave: tuple, configs: tuple, ruta_template: Union[str, Path], compilar) -> list:
+    """
+    Partes del prompt ya rellenado, separadas donde va {texto_input}. La entrada
+    guarda los propios dicts de configuración: si el id se reutiliza con otro
+    objeto, o cambia el template en disco, se recompila.
     """
     template = cargar_texto_template(ruta_template)
+    clave += (USAR_PREFIJO_ESTABLE,)
+    entrada = _compilados.get(clave)
+    if entrada is not None and entrada[1] is template \
+            and all(a is b for a, b in zip(entrada[0], configs)):
+        partes = entrada[2]
+    else:
+        partes = compilar(maquetar_prefijo_estable(template) if USAR_PREFIJO_ESTABLE
+                          else template).split(_MARCA_TEXTO)
+        with _registro_lock:
+            _compilados[clave] = (configs, template, partes)
+            _stats_registro["compilaciones"] += 1
+    with _registro_lock:
+        _stats_registro["prompts"] += 1
+    return partes
+
+
+def _partes_prompt(config: dict, ruta_template: Union[str, Path]) -> list:
+    clave = (id(config), str(ruta_template))
+    return _compilado(clave, (config,), ruta_template,
+                      lambda template: _rellenar_template(template, config, _MARCA_TEXTO))
+
+
+def _rellenar_template(template: str, config: dict, texto: str) -> str:
  
     valores = config["valores_posibles"]
     nombre = config["nombre"]
@@ -800,6 +2074,44 @@ class _SafeDict(dict):
         return "{" + key + "}"  # mantiene el placeholder si no hay dato
 
 
+# Cuántas respuestas llegan como JSON válido y cuántas necesitan json_repair: con
+# salida estructurada la tasa de reparación debería caer a ~0.
+_stats_parseo = {"json_valido": 0, "reparado": 0, "irrecuperable": 0}
+_parseo_lock = threading.Lock()
+
+
+def _cargar_json_respuesta(respuesta_raw: str) -> Any:
+    """json.loads estricto y, sólo si falla, json_repair (contabilizado)."""
+    try:
+        data = json.loads(respuesta_raw)
+        resultado = "json_valido"
+    except (TypeError, ValueError):
+        import json_repair
+        data = json_repair.loads(respuesta_raw or "")
+        resultado = "reparado" if isinstance(data, dict) and data else "irrecuperable"
+    with _parseo_lock:
+        _stats_parseo[resultado] += 1
+    return data
+
+
+def estadisticas_parseo() -> dict:
+    with _parseo_lock:
+        total = sum(_stats_parseo.values())
+        return {**_stats_parseo,
+                "tasa_reparacion": round(
+                    (_stats_parseo["reparado"] + _stats_parseo["irrecuperable"]) / total, 3)
+                if total else None}
+
+
+def imprimir_estadisticas_parseo() -> None:
+    """JSON válido / reparado / irrecuperable (final de los runners)."""
+    st = estadisticas_parseo()
+    if st["tasa_reparacion"] is None:
+        return
+    print(f"  Parseo JSON: válido={st['json_valido']} · reparado={st['reparado']} · "
+          f"irrecuperable={st['irrecuperable']} · tasa_reparacion={st['tasa_reparacion']}")
+
+
 def parsear_respuesta_modelo(respuesta_raw: str) -> dict:
     """
     Parsea la respuesta cruda del modelo a dict.
@@ -808,8 +2120,7 @@ def parsear_respuesta_modelo(respuesta_raw: str) -> dict:
       2. JSON envuelto: {"respuesta": {"codigo": 1, ...}} → desenvuelve automáticamente
       3. Campos faltantes (típico cuando codigo=1, omiten "evidencias"): se rellenan con defaults seguros.
     """
-    import json_repair
-    data = json_repair.loads(respuesta_raw)
+    data = _cargar_json_respuesta(respuesta_raw)
 
     if (
         isinstance(data, dict)
@@ -820,6 +2131,11 @@ def parsear_respuesta_modelo(respuesta_raw: str) -> dict:
         if any(k in inner for k in ("codigo", "explicacion", "evidencias")):
             data = inner
 
+    return _normalizar_bloque(data)
+
+
+def _normalizar_bloque(data: Any) -> dict:
+    """Rellena codigo/explicacion/evidencias con defaults seguros."""
     if not isinstance(data, dict):
         data = {}
 
@@ -831,6 +2147,96 @@ def parsear_respuesta_modelo(respuesta_raw: str) -> dict:
         data["evidencias"] = [str(data["evidencias"])] if data["evidencias"] else []
 
     return data
+
+
+# ============================================================================
+# Modo multivariable: una sola llamada para varias variables del mismo artículo
+# ============================================================================
+
+_BLOQUE_VARIABLE_MULTI = """### VARIABLE {codigo}: "{nombre}"
+
+DEFINICIÓN:
+{definicion}
+
+METODOLOGÍA (resumen):
+{metodologia}
+
+EJEMPLOS (casos donde SÍ aplica):
+{ejemplos_positivos}
+
+CÓDIGOS POSIBLES:
+{lista_opciones}"""
+
+
+def generar_prompt_multivariable(configs: Dict[str, dict], texto: str, ruta_template: str) -> str:
+    """
+    Un único prompt para varias variables ({codigo: config}). El artículo va una
+    sola vez (antes de IRIS_CACHE_BREAK) y cada variable aporta su bloque de
+    definición/metodología/ejemplos/códigos, con los mismos aplanadores que
+    generar_prompt_dinamico. La respuesta esperada es un JSON indexado por código.
+    """
+    clave = (tuple(configs), tuple(id(c) for c in configs.values()), str(ruta_template))
+    return texto.join(_compilado(
+        clave, tuple(configs.values()), ruta_template,
+        lambda template: _rellenar_template_multivariable(template, configs, _MARCA_TEXTO)))
+
+
+def _rellenar_template_multivariable(template: str, configs: Dict[str, dict], texto: str) -> str:
+    bloques = []
+    esquema = []
+    for codigo, config in configs.items():
+        valores = config["valores_posibles"]
+        if "ejemplos_positivos" in config:
+            ejemplos_pos_str = _aplanar_ejemplos_positivos(config["ejemplos_positivos"])
+        else:
+            ejemplos_pos_str = _aplanar_ejemplos_positivos(config.get("ejemplos", ""))
+        bloques.append(_BLOQUE_VARIABLE_MULTI.format(
+            codigo=codigo,
+            nombre=config["nombre"],
+            definicion=_aplanar_definicion(config.get("definicion", "")),
+            metodologia=_aplanar_metodologia(config.get("metodologia", "")),
+            ejemplos_positivos=ejemplos_pos_str,
+            lista_opciones=_generar_lista_opciones(valores),
+        ))
+        esquema.append(
+            f'  "{codigo}": {{"codigo": <número entero {_generar_rango_codigos(valores)}>, '
+            f'"explicacion": "<por qué sí o no>", '
+            f'"evidencias": [<citas literales del texto o [] si codigo es 1>]}}'
+        )
+    contexto = {
+        "texto_input": texto,
+        "bloques_variables": "\n\n".join(bloques),
+        "esquema_respuesta": "{\n" + ",\n".join(esquema) + "\n}",
+    }
+    return template.format_map(_SafeDict(contexto))
+
+
+def parsear_respuesta_multivariable(respuesta_raw: str, configs: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Parsea la respuesta multivariable a {codigo: {codigo, explicacion, evidencias}}.
+    Acepta claves por código ("25", "V25") o por nombre de variable, y un posible
+    envoltorio de un nivel ({"variables": {...}}). Las variables ausentes quedan
+    con los defaults de parsear_respuesta_modelo (codigo=1).
+    """
+    data = _cargar_json_respuesta(respuesta_raw)
+    if not isinstance(data, dict):
+        data = {}
+    claves = {codigo: (codigo, f"V{codigo}", f"v{codigo}", config.get("nombre"))
+              for codigo, config in configs.items()}
+    # Se desenvuelve sólo si la única clave no es ninguna forma aceptada de una variable.
+    if len(data) == 1 and isinstance(next(iter(data.values())), dict) \
+            and not any(k in data for c in claves.values() for k in c if k):
+        data = next(iter(data.values()))
+
+    resultado = {}
+    for codigo in configs:
+        bloque = None
+        for clave in claves[codigo]:
+            if clave in data:
+                bloque = data[clave]
+                break
+        resultado[codigo] = _normalizar_bloque(bloque if isinstance(bloque, dict) else None)
+    return resultado
  
 
 class BloqueAnalisisLenguajeSexista(BaseModel):
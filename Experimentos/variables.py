@@ -7,10 +7,19 @@ from typing import Optional, Any, List
 import re
 import json
 import json_repair
-from utils import cargar_variables_desde_json, consultar_ollama, generar_prompt_dinamico, obtener_config_variable, parsear_respuesta_modelo
+from utils import cargar_variables_desde_json, consultar_ollama, esquema_variable, generar_prompt_dinamico, obtener_config_variable, parsear_respuesta_modelo
 import ast
 import pandas as pd
 
+# Tope de salida (num_predict en Ollama) de las variables de lenguaje 25–39: el JSON
+# {codigo, explicacion, evidencias} cabe de sobra; evita divagaciones hasta 1024 tokens.
+MAX_TOKENS_VARIABLE = 512
+
+# Esquema JSON de salida (BloqueAnalisis*) que las variables 25–39 pasan a
+# consultar_ollama para pedir salida estructurada. Ablación: False → sin esquema,
+# sólo las instrucciones del prompt + json_repair (runners: --sin-esquema).
+USAR_ESQUEMA = True
+
 # =====================================================================================
 # 1. IdNoticia
 # =====================================================================================
@@ -2147,7 +2156,8 @@ def clasificar_var_lenguaje_sexista(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2206,7 +2216,8 @@ def clasificar_var_masc_generico(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2263,7 +2274,8 @@ def clasificar_var_hombre_denominar_humanidad(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2320,7 +2332,8 @@ def clasificar_var_uso_dual_zorr(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2377,7 +2390,8 @@ def clasificar_var_uso_cargo_mujer(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2434,7 +2448,8 @@ def clasificar_var_sexismo_discurso(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2491,7 +2506,8 @@ def clasificar_var_androcentrismo(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2548,7 +2564,8 @@ def clasificar_var_mencion_nombre_investigadora(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2605,7 +2622,8 @@ def clasificar_var_asimetria_mujer_hombre(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2662,7 +2680,8 @@ def clasificar_var_diminutivos_infantilizacion(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2719,7 +2738,8 @@ def clasificar_var_denominacion_sexualizada(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2776,7 +2796,8 @@ def clasificar_var_denominacion_redundante(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2833,7 +2854,8 @@ def clasificar_var_denominacion_dependiente(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2890,7 +2912,8 @@ def clasificar_var_criterios_excepcion(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2947,7 +2970,8 @@ def clasificar_var_comparacion_mujer_hombre(
 
     # C. Llamada a Ollama
     print(f"--- Analizando {config['nombre']} con template dinámico ---")
-    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1) 
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config) if USAR_ESQUEMA else None)
 
     # D. Parsing y Validación ROBUSTA
     try:
@@ -2975,3 +2999,124 @@ def clasificar_var_comparacion_mujer_hombre(
             explicacion=f"Error técnico irrecuperable: {str(e)}", 
             evidencias=[]
         )
+
+
+# =====================================================================================
+# Variables 25–39 por partes: prompt e interpretación (async / modo lote)
+# =====================================================================================
+def construir_prompt_variable(
+    codigo: str,
+    texto_articulo: str,
+    ruta_json: str = "variables.json",
+    ruta_template: str = "prompts/prompt_clara.md",
+) -> str:
+    """
+    Prompt de la variable `codigo` tal como lo construyen los clasificar_var_* de
+    las variables 25–39 (que sólo se diferencian en el código de variables.json).
+    """
+    vars_data = cargar_variables_desde_json(ruta_json)
+    config = obtener_config_variable(vars_data, codigo)
+    # Comillas dobles → simples, como en la versión sync.
+    texto_seguro = texto_articulo.replace('"', "'")
+    return generar_prompt_dinamico(config, texto_seguro, ruta_template)
+
+
+def interpretar_respuesta_variable(respuesta_raw: str, esquema_respuesta=BloqueAnalisisLenguajeSexista):
+    """Parsing y validación ROBUSTA de la respuesta (misma lógica que clasificar_var_*)."""
+    try:
+        data = parsear_respuesta_modelo(respuesta_raw)
+    except Exception as e:
+        print(f"❌ Error fatal: {e}")
+        return esquema_respuesta(
+            codigo=1,
+            explicacion=f"Error técnico irrecuperable: {str(e)}",
+            evidencias=[]
+        )
+    return _validar_bloque(data, esquema_respuesta)
+
+
+def _validar_bloque(data: dict, esquema_respuesta):
+    try:
+        return esquema_respuesta(**data)
+    except ValidationError as e:
+        print(f"⚠️ Error de validación Pydantic: {e}")
+        return esquema_respuesta(
+            codigo=1,
+            explicacion=f"El modelo no devolvió los campos correctos. Raw: {str(e)}",
+            evidencias=[]
+        )
+    except Exception as e:
+        print(f"❌ Error fatal: {e}")
+        return esquema_respuesta(
+            codigo=1,
+            explicacion=f"Error técnico irrecuperable: {str(e)}",
+            evidencias=[]
+        )
+
+
+def clasificar_multivariable(
+    codigos: list,
+    texto_articulo: str,
+    ruta_json: str = "variables.json",
+    ruta_template: str = "prompts/prompt_clara_multivariable.md",
+    modelo: str = "gemma3:4b",
+    esquemas: Optional[dict] = None,
+) -> dict:
+    """
+    Clasifica varias variables (25–39) con UNA sola llamada: el artículo, que es
+    el grueso de los tokens de entrada, se envía una vez en lugar de una por variable.
+    Devuelve {codigo: BloqueAnalisis*} con los mismos objetos (y los mismos
+    fallbacks codigo=1) que los clasificar_var_* individuales.
+    `esquemas`: {codigo: modelo Pydantic}; por defecto BloqueAnalisisLenguajeSexista.
+    """
+    from utils import esquema_multivariable, generar_prompt_multivariable, parsear_respuesta_multivariable
+
+    esquemas = esquemas or {}
+    try:
+        vars_data = cargar_variables_desde_json(ruta_json)
+        configs = {c: obtener_config_variable(vars_data, c) for c in codigos}
+    except Exception as e:
+        return {c: esquemas.get(c, BloqueAnalisisLenguajeSexista)(
+                    codigo=1, explicacion=f"Error config: {e}", evidencias=[])
+                for c in codigos}
+
+    texto_seguro = texto_articulo.replace('"', "'")
+    prompt = generar_prompt_multivariable(configs, texto_seguro, ruta_template)
+
+    print(f"--- Analizando {len(configs)} variables en una sola llamada ---")
+    respuesta_raw = consultar_ollama(prompt, modelo, temperature=0.1,
+                                     max_tokens=MAX_TOKENS_VARIABLE * len(configs),
+                                     esquema=esquema_multivariable(configs, esquemas) if USAR_ESQUEMA else None)
+
+    try:
+        datos = parsear_respuesta_multivariable(respuesta_raw, configs)
+    except Exception as e:
+        print(f"❌ Error fatal: {e}")
+        datos = {c: {"codigo": 1, "explicacion": f"Error técnico irrecuperable: {str(e)}",
+                     "evidencias": []} for c in codigos}
+    return {c: _validar_bloque(datos[c], esquemas.get(c, BloqueAnalisisLenguajeSexista))
+            for c in codigos}
+
+
+async def aclasificar_var_lenguaje(
+    codigo: str,
+    texto_articulo: str,
+    ruta_json: str = "variables.json",
+    ruta_template: str = "prompts/prompt_clara.md",
+    modelo: str = "gemma3:4b",
+    esquema_respuesta=BloqueAnalisisLenguajeSexista,
+):
+    """
+    Equivalente async de los clasificar_var_* de las variables 25–39. Pensado para
+    lanzar cientos de artículos concurrentes desde un único hilo con asyncio.gather.
+    """
+    from utils import aconsultar
+
+    try:
+        prompt = construir_prompt_variable(codigo, texto_articulo, ruta_json, ruta_template)
+        config = obtener_config_variable(cargar_variables_desde_json(ruta_json), codigo)
+    except Exception as e:
+        return esquema_respuesta(codigo=1, explicacion=f"Error config: {e}", evidencias=[])
+    respuesta_raw = await aconsultar(prompt, modelo, temperature=0.1, max_tokens=MAX_TOKENS_VARIABLE,
+                                     esquema=esquema_variable(config, esquema_respuesta) if USAR_ESQUEMA else None)
+    return interpretar_respuesta_variable(respuesta_raw, esquema_respuesta)